@@ -0,0 +1,258 @@
+"""
+Dynamic micro-batching for the `/predict` endpoint.
+
+Concurrent requests put their claims on a shared queue. A single worker task
+collects them until either `max_batch_size` claims are waiting or `max_wait_ms`
+has elapsed since the first one arrived, runs one batched generation, and
+resolves each request with its own results.
+
+Claims may belong to a group, e.g. the adapter serving them : a batch only holds
+claims of the group of its first claim, the others wait for a following batch.
+
+Generation is blocking and takes seconds : it runs on a dedicated, bounded
+executor so the event loop keeps serving `/health` and other endpoints.
+At most `max_concurrency` batches run at the same time; claims arriving while
+all slots are busy keep accumulating into the next batch. Work running on the
+same model outside of the batches (streaming) reserves one of these slots too,
+in turn with the claims queued before it.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# queued in place of a claim by `reserve`
+_RESERVATION = object()
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        generate_batch: Callable[[List[str]], list],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20,
+        max_concurrency: int = 1,
+        executor: Optional[Executor] = None,
+    ):
+        """
+        Args:
+            generate_batch: blocking callable mapping a list of claims to a list of results, one per claim,
+                called with the `group` keyword for claims submitted with a group.
+            max_batch_size: maximum number of claims sent to the model in one batch.
+            max_wait_ms: maximum time the first claim of a batch waits for others to join.
+            max_concurrency: maximum number of batches generated at the same time.
+            executor: executor running generate_batch, defaults to a dedicated thread pool of max_concurrency threads.
+        """
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_concurrency = max(1, max_concurrency)
+        self._own_executor = executor is None
+        self._executor = executor
+        self._queue: asyncio.Queue = None
+        # claims taken from the queue but left out of a batch of another group
+        self._pending = deque()
+        self._slots: asyncio.Semaphore = None
+        self._worker: asyncio.Task = None
+        self._inflight = set()
+        self._metrics = {
+            "batches": 0,
+            "claims": 0,
+            "max_batch_size": 0,
+            "queue_wait_ms_total": 0.0,
+            "queue_wait_ms_max": 0.0,
+        }
+
+    async def start(self):
+        """Start the batching worker on the running event loop"""
+        if self._worker is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency, thread_name_prefix="inference"
+                )
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._worker = asyncio.create_task(self._run())
+            logger.info(
+                "MicroBatcher started (max_batch_size=%d, max_wait_ms=%.1f, max_concurrency=%d)",
+                self.max_batch_size,
+                self.max_wait * 1000,
+                self.max_concurrency,
+            )
+
+    async def stop(self):
+        """Stop the worker, let running batches finish and fail any claim still waiting in the queue"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        while not self._queue.empty():
+            self._pending.append(self._queue.get_nowait())
+        while self._pending:
+            _, future, _, _ = self._pending.popleft()
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped"))
+        logger.info("MicroBatcher stopped")
+
+    async def submit(self, quotes: List[str], group: Optional[Hashable] = None) -> list:
+        """Queue claims of a group for the next batches and wait for their results"""
+        if self._worker is None:
+            raise RuntimeError("Batcher not started")
+        loop = asyncio.get_running_loop()
+        futures = []
+        for quote in quotes:
+            future = loop.create_future()
+            self._queue.put_nowait((quote, future, time.perf_counter(), group))
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    @asynccontextmanager
+    async def reserve(self):
+        """
+        Hold one of the max_concurrency slots, for a generation running outside of the batches.
+        The reservation is queued like a claim : the worker hands it the slot it took for its next batch.
+        """
+        if self._worker is None:
+            raise RuntimeError("Batcher not started")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((_RESERVATION, future, time.perf_counter(), _RESERVATION))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # the slot may have been handed over in the meantime
+            if future.done() and not future.cancelled():
+                self._slots.release()
+            raise
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def _collect(self) -> list:
+        """
+        Wait for a first claim, then gather more of its group until the batch is full or the window closes.
+        Claims of other groups are kept, in order, for the next batches.
+        """
+        first = self._pending.popleft() if self._pending else await self._queue.get()
+        if first[0] is _RESERVATION:
+            return [first]
+        group = first[3]
+        items = [first]
+        others = deque()
+        while self._pending:
+            item = self._pending.popleft()
+            if item[3] == group and len(items) < self.max_batch_size:
+                items.append(item)
+            else:
+                others.append(item)
+        self._pending = others
+
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item[3] == group:
+                items.append(item)
+            else:
+                self._pending.append(item)
+        return items
+
+    async def _run(self):
+        while True:
+            # wait for a free slot first : claims keep queuing while all slots are busy
+            await self._slots.acquire()
+            try:
+                items = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            items = [item for item in items if not item[1].cancelled()]
+            if not items:
+                self._slots.release()
+                continue
+            if items[0][0] is _RESERVATION:
+                # the slot now belongs to the reservation, released when it ends
+                items[0][1].set_result(None)
+                continue
+
+            task = asyncio.create_task(self._process(items))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _process(self, items: list):
+        """Run one batch on the executor and resolve the waiting requests"""
+        try:
+            now = time.perf_counter()
+            waits_ms = [(now - enqueued) * 1000 for _, _, enqueued, _ in items]
+            self._record(batch_size=len(items), waits_ms=waits_ms)
+            logger.info(
+                "MicroBatcher running batch of %d claims (max wait %.1f ms)",
+                len(items),
+                max(waits_ms),
+            )
+
+            quotes = [quote for quote, _, _, _ in items]
+            group = items[0][3]
+            generate_batch = (
+                self.generate_batch
+                if group is None
+                else functools.partial(self.generate_batch, group=group)
+            )
+            loop = asyncio.get_running_loop()
+            try:
+                outputs = await loop.run_in_executor(self._executor, generate_batch, quotes)
+            except Exception as e:
+                logger.exception("Batch generation failed: %s", e)
+                for _, future, _, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            for (_, future, _, _), output in zip(items, outputs):
+                if not future.done():
+                    future.set_result(output)
+        finally:
+            self._slots.release()
+
+    def _record(self, batch_size: int, waits_ms: List[float]):
+        m = self._metrics
+        m["batches"] += 1
+        m["claims"] += batch_size
+        m["max_batch_size"] = max(m["max_batch_size"], batch_size)
+        m["queue_wait_ms_total"] += sum(waits_ms)
+        m["queue_wait_ms_max"] = max(m["queue_wait_ms_max"], max(waits_ms))
+
+    def metrics(self) -> dict:
+        """Batch size and queue wait statistics since startup"""
+        m = self._metrics
+        return {
+            "batches": m["batches"],
+            "claims": m["claims"],
+            "queue_size": (self._queue.qsize() if self._queue is not None else 0) + len(self._pending),
+            "running_batches": len(self._inflight),
+            "avg_batch_size": m["claims"] / m["batches"] if m["batches"] else 0.0,
+            "max_batch_size": m["max_batch_size"],
+            "avg_queue_wait_ms": m["queue_wait_ms_total"] / m["claims"] if m["claims"] else 0.0,
+            "max_queue_wait_ms": m["queue_wait_ms_max"],
+        }
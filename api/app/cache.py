@@ -0,0 +1,108 @@
+"""
+In-memory prediction cache for the `/predict` endpoints.
+
+Entries are keyed by the normalized claim, the prediction mode, the base model
+and the adapter, so a new adapter never serves stale predictions.
+Least recently used entries are evicted once the memory bound is reached,
+and entries expire after a time to live.
+"""
+
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# approximate per-entry overhead of the dict, tuples and strings
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def normalize_claim(claim: str) -> str:
+    """Unicode (NFKC), case and whitespace insensitive form of a claim"""
+    claim = unicodedata.normalize("NFKC", claim).casefold()
+    return re.sub(r"\s+", " ", claim).strip()
+
+
+class PredictionCache:
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024**2,
+        ttl_s: float = 24 * 3600,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            max_bytes: approximate memory bound of the cached entries, 0 disables the cache.
+            ttl_s: time to live of an entry, in seconds.
+            clock: monotonic time source, injectable for tests.
+        """
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def key(claim: str, model_name: str, adapter: str, mode: str = "generate") -> tuple:
+        return (normalize_claim(claim), mode, model_name, adapter)
+
+    @staticmethod
+    def _size(key: Hashable, value) -> int:
+        return len(repr(key).encode()) + len(repr(value).encode()) + ENTRY_OVERHEAD_BYTES
+
+    def get(self, key: Hashable) -> Optional[object]:
+        """Cached value of key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._metrics["misses"] += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self._bytes -= size
+                self._metrics["expirations"] += 1
+                self._metrics["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._metrics["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (self.clock() + self.ttl_s, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._metrics["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        logger.info("Prediction cache cleared")
+
+    def metrics(self) -> dict:
+        """Hit, miss and eviction counters and current size"""
+        with self._lock:
+            lookups = self._metrics["hits"] + self._metrics["misses"]
+            return {
+                **self._metrics,
+                "hit_rate": self._metrics["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,349 @@
+"""
+Write-behind ingestion of user feedback.
+
+`/feedback` and `/feedback/batch` validate the rows and put them into a bounded
+in-process queue, without waiting for BigQuery. A background thread writes them in
+batches of `Config.FEEDBACK_BATCH_SIZE` rows, or of the rows queued during
+`Config.FEEDBACK_FLUSH_INTERVAL_S`. Rows that cannot be written (the table is
+unreachable, or the queue is full) are appended to a local JSONL journal, replayed
+once the table answers again, including from a later process : while the journal is
+not empty, the rows taken from the queue are journaled behind it. Rows journaled
+because the queue was full are newer than the queued ones but may be written before
+them : the write order is not the acceptance order, `created_at` is.
+The queue is drained on shutdown.
+
+Rows the table rejects for good (invalid for its schema, too large) would fail every
+replay : they are moved to a dead-letter JSONL file (`Config.FEEDBACK_DEAD_LETTER_PATH`)
+with their error, and the other rows are written.
+
+Every row gets an insert id when it is accepted, sent with each insert : BigQuery
+uses it for best-effort dedup of rows retried within about a minute, so a batch
+replayed soon after a partial failure is usually not duplicated. Rows replayed
+later from the journal may be duplicated. The insert id is also stored in the
+`insert_id` column, the identity of the row for readers (rows of a
+`/feedback/batch` request share their `created_at`). Rows written later than
+`Config.FEEDBACK_SNAPSHOT_LOOKBACK_S` after they were accepted are logged : the
+feedback snapshots do not read that far back.
+
+The writer talks to a table with a single `insert_rows(rows, row_ids)` method, raising
+on failure, `RowsRejectedError` for rejected rows : `BigQueryFeedbackTable` for BigQuery, `JsonlFeedbackTable` for tests and
+offline runs ("file://<path>" as `Config.FEEDBACK_TABLE`).
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from google.cloud.exceptions import BadRequest
+
+from shared.config import Config
+from shared.gcp import Gcp, RowsRejectedError
+from shared.pydantic_models import FeedbackInsertionBQ, FeedbackRequest
+from shared.utils import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class BigQueryFeedbackTable:
+    def __init__(self, project_id: str, dataset_id: str, table_id: str):
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+
+    def insert_rows(self, rows: List[dict], row_ids: List[str]):
+        """Insert rows, raises RowsRejectedError with the rows rejected for good"""
+        try:
+            Gcp.insert_feedback_rows_bq(
+                project_id=self.project_id,
+                dataset_id=self.dataset_id,
+                table_id=self.table_id,
+                rows=rows,
+                row_ids=row_ids,
+            )
+        except BadRequest as e:
+            # the whole request is refused (e.g. a row too large) : narrowed down to the rows by halves
+            if len(rows) == 1:
+                raise RowsRejectedError({0: str(e)}) from e
+            half = len(rows) // 2
+            rejected = {}
+            for offset, end in ((0, half), (half, len(rows))):
+                try:
+                    self.insert_rows(rows[offset:end], row_ids[offset:end])
+                except RowsRejectedError as part:
+                    rejected.update({offset + index: error for index, error in part.rejected.items()})
+            if rejected:
+                raise RowsRejectedError(rejected) from e
+
+
+class JsonlFeedbackTable:
+    """Local stand-in of the feedback table : one JSON row per line, rows retried with the same id are dropped"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._row_ids = {row["insert_id"] for row in self.rows()}
+
+    def rows(self) -> List[dict]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def insert_rows(self, rows: List[dict], row_ids: List[str]):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for row, row_id in zip(rows, row_ids):
+                    if row_id not in self._row_ids:
+                        self._row_ids.add(row_id)
+                        f.write(json.dumps({**row, "insert_id": row_id}) + "\n")
+
+
+def open_table(spec: str = Config.FEEDBACK_TABLE):
+    """Feedback table of the configuration : BigQuery, or a local JSONL file for "file://<path>" """
+    if spec.startswith("file://"):
+        return JsonlFeedbackTable(spec[len("file://"):])
+    return BigQueryFeedbackTable(
+        project_id=Config.GCP_PROJECT_ID,
+        dataset_id=Config.BQ_DATASET_ID,
+        table_id=Config.BQ_TABLE_ID,
+    )
+
+
+class FeedbackWriter:
+    def __init__(
+        self,
+        table,
+        journal_path: str,
+        dead_letter_path: Optional[str] = None,
+        batch_size: int = 500,
+        flush_interval_s: float = 2.0,
+        max_queue: int = 10000,
+    ):
+        """
+        Args:
+            table: `BigQueryFeedbackTable` or `JsonlFeedbackTable`.
+            journal_path: JSONL journal of the rows not written yet.
+            dead_letter_path: JSONL file of the rows rejected by the table, next to the journal by default.
+            batch_size: maximum rows per insert.
+            flush_interval_s: maximum delay before a queued row is written.
+            max_queue: rows held in memory, further rows go to the journal.
+        """
+        self.table = table
+        self.journal_path = journal_path
+        # journal taken aside by the writer thread while it is replayed
+        self.replay_path = journal_path + ".replay"
+        self.dead_letter_path = dead_letter_path or os.path.splitext(journal_path)[0] + ".rejected.jsonl"
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._journal_lock = threading.Lock()
+        self._thread = None
+        self._counters = {"accepted": 0, "written": 0, "batches": 0, "journaled": 0, "replayed": 0, "rejected": 0, "late": 0, "errors": 0}
+
+    # ---- caller side
+
+    def submit(self, feedback: List[FeedbackRequest]) -> int:
+        """
+        Validate and queue feedback rows, journaled if the queue is full ; number of rows accepted.
+        Journaling writes to disk : call it off the event loop.
+        """
+        created_at = datetime.now(timezone.utc)
+        records = []
+        for item in feedback:
+            insert_id = uuid.uuid4().hex
+            row = FeedbackInsertionBQ(**item.model_dump(), created_at=created_at, insert_id=insert_id)
+            records.append({"insert_id": insert_id, "row": row.model_dump(mode="json")})
+        overflow = []
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                overflow.append(record)
+        if overflow:
+            logger.warning("Feedback queue full, %d rows journaled", len(overflow))
+            self._journal(overflow)
+        self._counters["accepted"] += len(records)
+        return len(records)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+            self._thread.start()
+
+    def flush(self, timeout: Optional[float] = None):
+        """Wait until every queued row is written or journaled"""
+        if self._thread is None:
+            self._process(self._drain())
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Write or journal the queued rows and stop the background thread"""
+        if self._thread is None:
+            self._process(self._drain())
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def metrics(self) -> dict:
+        return {**self._counters, "queued": self._queue.qsize(), "journal": self._journal_pending()}
+
+    # ---- background thread
+
+    def _drain(self) -> list:
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _collect(self, first) -> list:
+        """Items queued until the batch is full or the flush interval since the first one has passed"""
+        items = [first]
+        deadline = time.monotonic() + self.flush_interval_s
+        rows = int(isinstance(first, dict))
+        while rows < self.batch_size and isinstance(items[-1], dict):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            rows += isinstance(item, dict)
+        return items
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval_s)
+            except queue.Empty:
+                if self._journal_pending():
+                    self._process([])
+                continue
+            items = self._collect(first)
+            if not isinstance(items[-1], dict):
+                # flush or close : everything queued so far
+                items += self._drain()
+            self._process([item for item in items if isinstance(item, dict)])
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in items:
+                return
+
+    def _journal_pending(self) -> bool:
+        return os.path.exists(self.replay_path) or os.path.exists(self.journal_path)
+
+    def _process(self, records: list):
+        if self._journal_pending() and not self._replay():
+            # the table is unreachable : newer rows wait behind the journaled ones
+            self._journal(records)
+            return
+        written = self._write(records)
+        if written < len(records):
+            self._journal(records[written:])
+
+    def _write(self, records: list) -> int:
+        """
+        Insert records in batches, in order, until the table fails ; number of records done,
+        written or moved to the dead-letter file when the table rejects them.
+        """
+        done = 0
+        try:
+            while done < len(records):
+                batch = records[done:done + self.batch_size]
+                pending = batch
+                while pending:
+                    try:
+                        self.table.insert_rows([r["row"] for r in pending], [r["insert_id"] for r in pending])
+                    except RowsRejectedError as e:
+                        self._dead_letter(pending, e.rejected)
+                        # the other rows were not inserted : retried with their insert ids
+                        pending = [record for index, record in enumerate(pending) if index not in e.rejected]
+                        continue
+                    self._counters["written"] += len(pending)
+                    self._check_late(pending)
+                    break
+                done += len(batch)
+                self._counters["batches"] += 1
+        except Exception as e:
+            self._counters["errors"] += 1
+            logger.warning("Feedback insertion failed: %s", e)
+        return done
+
+    def _check_late(self, records: list):
+        """
+        Warn about rows written longer after their created_at than the lookback of the feedback
+        snapshots : a snapshot refreshed in the meantime has moved past them and will not read them.
+        """
+        limit = datetime.now(timezone.utc) - timedelta(seconds=Config.FEEDBACK_SNAPSHOT_LOOKBACK_S)
+        late = [record for record in records if parse_timestamp(record["row"]["created_at"]) < limit]
+        if late:
+            self._counters["late"] += len(late)
+            logger.warning(
+                "%d feedback rows written more than %ss after they were accepted (oldest %s) : "
+                "feedback snapshots refreshed since then miss them until they are rebuilt",
+                len(late),
+                Config.FEEDBACK_SNAPSHOT_LOOKBACK_S,
+                min(record["row"]["created_at"] for record in late),
+            )
+
+    def _replay(self) -> bool:
+        """
+        Write the journaled rows, True when the journal is empty afterwards.
+        The journal is renamed aside first : `submit` keeps journaling to a new one while it is written.
+        """
+        if not os.path.exists(self.replay_path):
+            with self._journal_lock:
+                if not os.path.exists(self.journal_path):
+                    return True
+                os.replace(self.journal_path, self.replay_path)
+        with open(self.replay_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        done = self._write(records)
+        self._counters["replayed"] += done
+        if done < len(records):
+            tmp_path = self.replay_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in records[done:]:
+                    f.write(json.dumps(record) + "\n")
+            os.replace(tmp_path, self.replay_path)
+            return False
+        os.remove(self.replay_path)
+        logger.info("Feedback journal replayed: %d rows", done)
+        # rows journaled during the replay
+        return self._replay()
+
+    def _journal(self, records: list):
+        if not records:
+            return
+        with self._journal_lock:
+            os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+        self._counters["journaled"] += len(records)
+        logger.warning("%d feedback rows journaled to %s", len(records), self.journal_path)
+
+    def _dead_letter(self, records: list, rejected: Dict[int, str]):
+        """Append the rejected records, by index in records, with their error to the dead-letter file"""
+        os.makedirs(os.path.dirname(self.dead_letter_path) or ".", exist_ok=True)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for index, error in sorted(rejected.items()):
+                f.write(json.dumps({**records[index], "error": error}) + "\n")
+        self._counters["rejected"] += len(rejected)
+        logger.error("%d feedback rows rejected by the table, moved to %s", len(rejected), self.dead_letter_path)
@@ -1,13 +1,23 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.batching import MicroBatcher
+from app.cache import PredictionCache
+from app.feedback import FeedbackWriter, open_table
+from app.routing import AdapterRouter, parse_weights
+from app.similarity import NearDuplicateIndex
+from app.store import PredictionStore
 from app.routes import router
 from shared.config import Config, setup_logging
 from shared.gcp import Gcp
 from shared.model.model import LLMWrapper
+from shared.model.precision import load_reference, self_check
+from shared.energy import energy_meter
+from shared.telemetry import telemetry
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -18,10 +28,76 @@ async def lifespan(app: FastAPI):
     """
     Application lifespan context manager for FastAPI - triggered at startup and shutdown.
     - Downloads model adapter files from Google Cloud Storage.
-    - Initializes a model into the app state.
-    - Clears the model from memory on shutdown.
+    - Initializes a model into the app state, and checks its precision against fp32 if enabled.
+    - Starts the inference executor and the micro-batching schedulers used by /predict, one per mode.
+    - Starts the process-wide energy meter and the serving telemetry, flushing periodic summaries to MLflow in the background.
+    - Loads the other adapters of `Config.ADAPTERS` on the same base model and routes claims between them.
+    - Creates the prediction cache and opens the persistent prediction store and near-duplicate index if enabled.
+    - Starts the feedback writer, replaying the rows journaled by a previous process.
+    - Drains the feedback queue and clears the model from memory on shutdown.
     """
     logger.info("Starting API")
+    app.state.model = None
+    app.state.precision_report = None
+    weights = parse_weights(Config.ADAPTERS, default=Config.ADAPTER_NAME)
+    app.state.router = AdapterRouter(weights=weights, default=Config.ADAPTER_NAME)
+    energy_meter.start()
+    telemetry.start()
+    app.state.feedback = FeedbackWriter(
+        table=open_table(Config.FEEDBACK_TABLE),
+        journal_path=Config.FEEDBACK_JOURNAL_PATH,
+        dead_letter_path=Config.FEEDBACK_DEAD_LETTER_PATH,
+        batch_size=Config.FEEDBACK_BATCH_SIZE,
+        flush_interval_s=Config.FEEDBACK_FLUSH_INTERVAL_S,
+        max_queue=Config.FEEDBACK_MAX_QUEUE,
+    )
+    app.state.feedback.start()
+    app.state.cache = PredictionCache(
+        max_bytes=Config.PREDICTION_CACHE_MAX_BYTES,
+        ttl_s=Config.PREDICTION_CACHE_TTL_S,
+    )
+    app.state.store = (
+        PredictionStore(
+            path=Config.PREDICTION_STORE_PATH,
+            max_bytes=Config.PREDICTION_STORE_MAX_BYTES,
+        )
+        if Config.PREDICTION_STORE_ENABLED
+        else None
+    )
+    app.state.near_duplicates = (
+        NearDuplicateIndex(
+            threshold=Config.NEAR_DUPLICATE_THRESHOLD,
+            max_entries=Config.NEAR_DUPLICATE_MAX_ENTRIES,
+        )
+        if Config.NEAR_DUPLICATE_ENABLED
+        else None
+    )
+    app.state.executor = ThreadPoolExecutor(
+        max_workers=Config.INFERENCE_MAX_CONCURRENCY, thread_name_prefix="inference"
+    )
+    app.state.batchers = {
+        "generate": MicroBatcher(
+            # batches are grouped by (model, adapter slot) as routed, each claim is resolved with its (output, usage)
+            generate_batch=lambda quotes, group: list(zip(
+                *group[0].generate_batch(quotes=quotes, return_usage=True, adapter=group[1])
+            )),
+            max_batch_size=Config.PREDICT_MAX_BATCH_SIZE,
+            max_wait_ms=Config.PREDICT_MAX_WAIT_MS,
+            max_concurrency=Config.INFERENCE_MAX_CONCURRENCY,
+            executor=app.state.executor,
+        ),
+        "classify_fast": MicroBatcher(
+            generate_batch=lambda quotes, group: list(zip(
+                *group[0].classify_fast(quotes=quotes, return_usage=True, adapter=group[1])
+            )),
+            max_batch_size=Config.PREDICT_MAX_BATCH_SIZE,
+            max_wait_ms=Config.PREDICT_MAX_WAIT_MS,
+            max_concurrency=Config.INFERENCE_MAX_CONCURRENCY,
+            executor=app.state.executor,
+        ),
+    }
+    for batcher in app.state.batchers.values():
+        await batcher.start()
     try:
         Gcp.load_adapter_gcs(
             project_id=Config.GCP_PROJECT_ID,
@@ -35,13 +111,53 @@ async def lifespan(app: FastAPI):
             model_name=Config.MODEL_NAME,
             project_id=Config.GCP_PROJECT_ID,
             bucket_name=Config.GCS_BUCKET_NAME,
+            merge_adapter=Config.MERGE_ADAPTER,
+        )
+        # adapters served next to the default one, sharing its base model
+        for name in weights:
+            if name in app.state.model.adapters:
+                continue
+            try:
+                Gcp.load_adapter_gcs(
+                    project_id=Config.GCP_PROJECT_ID,
+                    bucket_name=Config.GCS_BUCKET_NAME,
+                    adapter_name=name,
+                    local_directory=Config.LOCAL_DIRECTORY,
+                )
+                app.state.model.reload_adapter(name)
+            except Exception as e:
+                logger.exception("Adapter %s not served: %s", name, e)
+        app.state.router = AdapterRouter(
+            weights={
+                name: weight for name, weight in weights.items() if name in app.state.model.adapters
+            },
+            default=Config.ADAPTER_NAME,
         )
+        if Config.PRECISION_SELF_CHECK and app.state.model.precision != "fp32":
+            # fp32 outputs computed offline : no second full precision model in the served process
+            reference = load_reference(model_name=Config.MODEL_NAME, adapter=app.state.model.active_adapter)
+            if reference is None:
+                logger.warning(
+                    "No fp32 reference for adapter %s, precision self-check skipped : "
+                    "run `python -m shared.model.precision` to compute it",
+                    app.state.model.active_adapter,
+                )
+            else:
+                app.state.precision_report = self_check(llm=app.state.model, reference=reference)
 
     except Exception as e:
         logger.exception(f"{e}")
 
     yield
 
+    for batcher in app.state.batchers.values():
+        await batcher.stop()
+    app.state.executor.shutdown(wait=False)
+    app.state.feedback.close()
+    if app.state.store is not None:
+        app.state.store.close()
+    telemetry.stop()
+    energy_meter.stop()
     if app.state.model is not None:
         app.state.model.clear()
     logger.info("Shutting down API")
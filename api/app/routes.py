@@ -4,14 +4,21 @@ API router for model operations and feedback collection.
 This module defines the FastAPI endpoints used to:
 - (`GET /`)              Check API status
 - (`GET /health`)        Vertex AI endpoint for healthcheck - healthy when model is loaded
-- (`GET /reload_model`)  Triggers a model adapter reload from GCS
+- (`GET /reload_model`)  Triggers a model adapter reload from GCS, hot swapped without downtime
 - (`POST /predict`)      Classify a user claim using the model - uses Vertex AI convention
-- (`POST /feedback`)     Send user feedback to BQ
+- (`POST /predict/stream`) Classify a user claim, streaming the answer as server-sent events
+- (`POST /feedback`)     Send user feedback to BQ, written behind in batches
+- (`POST /feedback/batch`) Send a batch of user feedback to BQ
+- (`GET /metrics`)       Micro-batching, prediction cache, store, near-duplicate index and telemetry statistics
 
 Requires shared modules
 """
 
+import asyncio
+import json
 import logging
+import time
+from typing import Optional
 
 from fastapi import (
     APIRouter,
@@ -20,16 +27,26 @@ from fastapi import (
     Response,
     status,
 )
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
+from app.routing import AdapterRouter
 from shared.config import Config
+from shared.energy import energy_meter
 from shared.gcp import Gcp
 from shared.model.model import LLMWrapper
+from shared.telemetry import telemetry
 from shared.pydantic_models import (
     ClassifyRequest, 
     ClassifyResponse, 
+    FeedbackBatchRequest,
+    FeedbackBatchResponse,
     FeedbackRequest,
+    PredictMetadata,
     PredictRequest,
-    PredictResponse
+    PredictResponse,
+    Usage,
 )
 
 logger = logging.getLogger(__name__)
@@ -55,28 +72,55 @@ async def health(request: Request):
 
 
 @router.get("/reload_model")
-async def reload(request: Request):
-    """External force reload : triggers a model adapter reload from GCS"""
+async def reload(request: Request, adapter: Optional[str] = None):
+    """
+    External force reload : downloads an adapter from GCS (the default adapter if not given) and hot swaps it.
+    The new version is loaded next to the served ones on the resident base model, warmed up,
+    then serves new requests ; the previous one is released once its in-flight requests finish.
+    A model whose adapter is merged into its weights is rebuilt with that adapter instead, and swapped
+    in once loaded : the previous model serves requests until then and is cleared once idle.
+    """
+    adapter_name = adapter or Config.ADAPTER_NAME
+    if adapter_name not in request.app.state.router.adapters:
+        raise HTTPException(status_code=400, detail=f"Adapter {adapter_name} is not served")
     try:
-        logger.info("New reload request")
-        if (
-            hasattr(request.app.state, "model")
-            and getattr(request.app.state, "model") is not None
-        ):
-            request.app.state.model.clear()
-        Gcp.load_adapter_gcs(
+        logger.info("New reload request for %s", adapter_name)
+        llm = getattr(request.app.state, "model", None)
+        # downloading and loading the model is blocking : keep it off the event loop
+        await run_in_threadpool(
+            Gcp.load_adapter_gcs,
             project_id=Config.GCP_PROJECT_ID,
             bucket_name=Config.GCS_BUCKET_NAME,
-            adapter_name=Config.ADAPTER_NAME,
-            local_directory=Config.LOCAL_DIRECTORY,
-        )
-        request.app.state.model = LLMWrapper(
+            adapter_name=adapter_name,
             local_directory=Config.LOCAL_DIRECTORY,
-            adapter_name=Config.ADAPTER_NAME,
-            model_name=Config.MODEL_NAME,
-            project_id=Config.GCP_PROJECT_ID,
-            bucket_name=Config.GCS_BUCKET_NAME,
         )
+        if llm is not None and llm.can_swap_adapters:
+            slot = await run_in_threadpool(llm.reload_adapter, adapter_name)
+            logger.info("Adapter %s hot swapped to %s", adapter_name, slot)
+        else:
+            # the served model keeps answering while the new one is built
+            new_llm = await run_in_threadpool(
+                LLMWrapper,
+                local_directory=Config.LOCAL_DIRECTORY,
+                adapter_name=adapter_name,
+                model_name=Config.MODEL_NAME,
+                project_id=Config.GCP_PROJECT_ID,
+                bucket_name=Config.GCS_BUCKET_NAME,
+                merge_adapter=Config.MERGE_ADAPTER,
+            )
+            if getattr(new_llm, "model", None) is None:
+                raise RuntimeError(f"Model with adapter {adapter_name} failed to load")
+            router = request.app.state.router
+            request.app.state.router = AdapterRouter(
+                weights={name: weight for name, weight in router.weights.items() if name in new_llm.adapters},
+                default=adapter_name,
+            )
+            request.app.state.model = new_llm
+            if llm is not None:
+                llm.clear_when_idle()
+        request.app.state.cache.clear()
+        if getattr(request.app.state, "near_duplicates", None) is not None:
+            request.app.state.near_duplicates.clear()
         return {"reload": "ok"}
 
     except Exception as e:
@@ -85,12 +129,124 @@ async def reload(request: Request):
 
 
 
+def _cache_key(request: Request, llm: LLMWrapper, quote: str, mode: str, slot: str) -> tuple:
+    return request.app.state.cache.key(
+        claim=quote,
+        model_name=llm.model_name,
+        adapter=slot,
+        mode=mode,
+    )
+
+
+def _route(request: Request, llm: LLMWrapper, quotes: list, adapter: Optional[str]) -> list:
+    """Adapter name serving each quote : the requested adapter, else chosen by the routing policy"""
+    try:
+        adapters = [request.app.state.router.choose(quote, requested=adapter) for quote in quotes]
+        for name in set(adapters):
+            llm.resolve_adapter(name)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Adapter {e.args[0]} is not served") from e
+    return adapters
+
+
+async def _predict_cached(
+    request: Request, llm: LLMWrapper, quotes: list, mode: str, adapters: list
+) -> list:
+    """
+    Outputs of quotes for the given mode, each with its adapter, as (output, similarity, usage) :
+    - served from the prediction cache, then from the persistent prediction store (similarity and usage None)
+    - else from a near-duplicate of an already predicted claim, if enabled (approximate, with its similarity)
+    - else sent to the micro-batcher once per normalized claim, in batches of its adapter slot,
+      then cached, indexed and queued for writing to the store (similarity None, usage of its inference)
+    Entries are keyed by adapter slot : a new version of an adapter does not serve stale predictions.
+    """
+    # the slots are held until the claims are answered : a reload does not delete them while claims wait in the batcher
+    held = {name: llm.acquire_adapter(name) for name in dict.fromkeys(adapters)}
+    try:
+        return await _predict_held(request, llm, quotes, mode, [held[adapter] for adapter in adapters])
+    finally:
+        # releasing the last hold of a retired slot or a replaced model frees it : off the event loop
+        for slot in held.values():
+            await run_in_threadpool(llm.release_adapter, slot)
+
+
+async def _predict_held(request: Request, llm: LLMWrapper, quotes: list, mode: str, slots: list) -> list:
+    """Outputs of quotes, as `_predict_cached`, with the adapter slot of each quote held"""
+    cache = request.app.state.cache
+    store = getattr(request.app.state, "store", None)
+    index = getattr(request.app.state, "near_duplicates", None)
+    keys = [_cache_key(request, llm, quote, mode, slot) for quote, slot in zip(quotes, slots)]
+    outputs = {key: cache.get(key) for key in keys}
+    similarities = {}
+    usages = {}
+    quote_of = {}
+    slot_of = {}
+    for quote, key, slot in zip(quotes, keys, slots):
+        quote_of.setdefault(key, quote)
+        slot_of.setdefault(key, slot)
+
+    def scope(key: tuple) -> tuple:
+        return (mode, llm.model_name, slot_of[key])
+
+    missing = [key for key, output in outputs.items() if output is None]
+    if missing and store is not None:
+        stored = await run_in_threadpool(store.get_many, missing)
+        for key, output in stored.items():
+            cache.put(key, output)
+            if index is not None:
+                index.add(quote_of[key], scope(key), output)
+        outputs.update(stored)
+        missing = [key for key in missing if key not in stored]
+
+    if missing and index is not None:
+        for key in list(missing):
+            match = index.query(quote_of[key], scope(key))
+            if match is not None:
+                outputs[key], similarities[key] = match
+                missing.remove(key)
+
+    if missing:
+        logger.info("Prediction cache : %d claims to generate", len(missing))
+        groups = {}
+        for key in missing:
+            groups.setdefault(slot_of[key], []).append(key)
+        batcher = request.app.state.batchers[mode]
+        grouped_results = await asyncio.gather(*(
+            # the batch runs on the model the claims were routed on, even if it was replaced since
+            batcher.submit([quote_of[key] for key in group], group=(llm, slot))
+            for slot, group in groups.items()
+        ))
+        generated = {}
+        for group, results in zip(groups.values(), grouped_results):
+            for key, (output, usage) in zip(group, results):
+                generated[key] = output
+                usages[key] = usage
+        for key, result in generated.items():
+            cache.put(key, result)
+            if index is not None:
+                index.add(quote_of[key], scope(key), result)
+        if store is not None:
+            store.put_many(generated)
+        outputs.update(generated)
+
+    return [(outputs[key], similarities.get(key), usages.get(key)) for key in keys]
+
+
 @router.post("/predict", response_model=PredictResponse, tags=["classification"])
 async def predict(request: Request, body: PredictRequest):
     """
     Classify a list of user claims using the loaded LLM model.
+    Claims already predicted are served from the prediction cache or store, near-duplicates
+    of predicted claims are answered with their prediction, tagged as approximate. The others are
+    queued on the micro-batcher and generated together with claims from
+    concurrent requests, on the inference executor (off the event loop).
     Vertex AI expects a POST to /predict with: {"instances": [{"text": "..."}]}
-    Returns: {"predictions": [...]} with a list of responses.
+    Optional {"parameters": {"mode": "classify_fast"}} returns the category and its
+    probabilities from a single forward pass, without explanation.
+    Optional {"parameters": {"adapter": "..."}} selects the adapter, else each claim is routed by
+    the weighted routing policy ; `model_name` of each prediction is the adapter that served it.
+    Returns: {"predictions": [...], "metadata": {"usage", "instances"}} with a list of responses,
+    and the usage (tokens, latency, energy) of the request and of each prediction.
     """
     logger.info("New classification request with %d instances", len(body.instances))
     logger.info("user_claim %s", body.instances[0].user_claim)
@@ -101,43 +257,207 @@ async def predict(request: Request, body: PredictRequest):
         raise HTTPException(status_code=500, detail="Model not available")
     logger.info("Model available")
 
+    mode = body.parameters.mode
+    start = time.perf_counter()
+    quotes = [instance.user_claim for instance in body.instances]
+    adapters = _route(request, llm, quotes, body.parameters.adapter)
+    try:
+        outputs = await _predict_cached(request, llm, quotes, mode, adapters)
+    except Exception as e:
+        logger.exception("Error during generation: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error during generation: {e}"
+        ) from e
+
     responses = []
-    for instance in body.instances:
-        try:
-            category, explanation = llm.generate(quote=instance.user_claim)
-            responses.append(ClassifyResponse(
-                model_name=llm.model_name,
-                user_claim=instance.user_claim,
-                category=category,
-                explanation=explanation
-            ))
-            logger.info("response: %s", responses[-1])
+    usages = []
+    for quote, adapter, (output, similarity, usage) in zip(quotes, adapters, outputs):
+        if mode == "classify_fast":
+            category, probabilities = output
+            explanation = ""
+        else:
+            category, explanation = output
+            probabilities = None
+        responses.append(ClassifyResponse(
+            model_name=adapter,
+            user_claim=quote,
+            category=category,
+            explanation=explanation,
+            probabilities=probabilities,
+            approximate=similarity is not None,
+            similarity=similarity,
+        ))
+        usages.append(Usage(**usage) if usage is not None else None)
+        logger.info("response: %s", responses[-1])
 
-        except Exception as e:
-            logger.exception("Error during generation: %s", e)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error during generation: {e}"
-            ) from e
+    inferred = [usage for usage in usages if usage is not None]
+    total = Usage(
+        tokens_in=sum(usage.tokens_in for usage in inferred),
+        tokens_out=sum(usage.tokens_out for usage in inferred),
+        latency_s=time.perf_counter() - start,
+        energy_j=sum(usage.energy_j for usage in inferred),
+        co2_g=sum(usage.co2_g for usage in inferred),
+        energy_estimated=any(usage.energy_estimated for usage in inferred),
+    )
+    return PredictResponse(
+        predictions=responses,
+        metadata=PredictMetadata(usage=total, instances=usages),
+    )
+
+
+
+@router.post("/predict/stream", tags=["classification"])
+async def predict_stream(request: Request, body: ClassifyRequest, adapter: Optional[str] = None):
+    """
+    Classify a single user claim with the adapter (else routed) and stream the answer as server-sent events :
+    - `category`    : {"category"} as soon as it is decoded
+    - `explanation` : {"text"} for each decoded chunk of the explanation
+    - `done`        : {"model_name", "user_claim", "category", "explanation"}, same as /predict
+    - `error`       : {"detail"} if generation fails
+    """
+    logger.info("New streaming classification request")
+
+    llm = getattr(request.app.state, "model", None)
+    if llm is None:
+        logger.error("Model not available")
+        raise HTTPException(status_code=500, detail="Model not available")
+
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    (adapter,) = _route(request, llm, [body.user_claim], adapter)
+    # held until the stream ends : a reload does not delete the slot before the generation starts
+    slot = llm.acquire_adapter(adapter)
+    released = False
+
+    def release():
+        # called when the stream ends, and as the response background task if the stream never started
+        nonlocal released
+        if not released:
+            released = True
+            llm.release_adapter(slot)
 
-    return PredictResponse(predictions=responses)
+    def done(category: str, explanation: str) -> dict:
+        return ClassifyResponse(
+            model_name=adapter,
+            user_claim=body.user_claim,
+            category=category,
+            explanation=explanation,
+        ).model_dump()
 
+    cache = request.app.state.cache
+    store = getattr(request.app.state, "store", None)
+    key = _cache_key(request, llm, body.user_claim, "generate", slot)
+    cached = cache.get(key)
+    if cached is None and store is not None:
+        try:
+            cached = await run_in_threadpool(store.get, key)
+        except BaseException:
+            await run_in_threadpool(release)
+            raise
+
+    async def events():
+        """
+        Events of the answer. A generation holds an inference slot of the /predict batches :
+        streams and batches together stay within `INFERENCE_MAX_CONCURRENCY`. It stops when
+        the client disconnects.
+        """
+        try:
+            if cached is not None:
+                category, explanation = cached
+                yield sse("category", {"category": category})
+                yield sse("explanation", {"text": explanation})
+                yield sse("done", done(category, explanation))
+                return
+            async with request.app.state.batchers["generate"].reserve():
+                stream = llm.generate_stream(
+                    quote=body.user_claim,
+                    executor=request.app.state.executor,
+                    adapter=slot,
+                )
+                step = None
+                try:
+                    while True:
+                        # shielded : a cancelled stream lets the running step end before closing the generation
+                        step = asyncio.ensure_future(run_in_threadpool(next, stream, None))
+                        item = await asyncio.shield(step)
+                        if item is None:
+                            break
+                        event, data = item
+                        if event == "done":
+                            output = (data["category"], data["explanation"])
+                            cache.put(key, output)
+                            if store is not None:
+                                await run_in_threadpool(store.put_many, {key: output})
+                            data = done(**data)
+                        yield sse(event, data)
+                        if await request.is_disconnected():
+                            logger.info("Client disconnected, streaming generation stopped")
+                            break
+                except Exception as e:
+                    logger.exception("Error during streaming generation: %s", e)
+                    yield sse("error", {"detail": f"Error during generation: {e}"})
+                finally:
+                    if step is not None and not step.done():
+                        await asyncio.wait([step])
+                    # stops the generation if it is still running, and waits for it
+                    await run_in_threadpool(stream.close)
+        finally:
+            await run_in_threadpool(release)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release),
+    )
 
 
 @router.post("/feedback", status_code=status.HTTP_204_NO_CONTENT, tags=["feedback"])
 async def submit_feedback(request: Request, body: FeedbackRequest):
-    """Send user feedback to BQ"""
+    """Queue user feedback for BQ, written in batches in the background"""
 
     logger.info("New feedback request: %s", body)
 
-    Gcp.send_feedback_bq(
-        project_id=Config.GCP_PROJECT_ID,
-        dataset_id=Config.BQ_DATASET_ID,
-        table_id=Config.BQ_TABLE_ID,
-        user_claim=body.user_claim,
-        predicted_category=int(body.predicted_category),
-        assistant_explanation=body.assistant_explanation,
-        correct_category=int(body.correct_category),
-    )
+    # the rows are journaled to disk when the queue is full
+    await run_in_threadpool(request.app.state.feedback.submit, [body])
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post(
+    "/feedback/batch",
+    response_model=FeedbackBatchResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["feedback"],
+)
+async def submit_feedback_batch(request: Request, body: FeedbackBatchRequest):
+    """Queue a batch of user feedback for BQ, for bulk labelling tools"""
+
+    logger.info("New feedback batch: %d rows", len(body.instances))
+
+    accepted = await run_in_threadpool(request.app.state.feedback.submit, body.instances)
+    return FeedbackBatchResponse(accepted=accepted)
+
+
+@router.get("/metrics")
+async def metrics(request: Request):
+    """Micro-batching statistics per prediction mode, prediction cache, store and feedback counters, energy and telemetry totals"""
+    store = getattr(request.app.state, "store", None)
+    index = getattr(request.app.state, "near_duplicates", None)
+    llm = getattr(request.app.state, "model", None)
+    return {
+        "adapters": dict(llm.adapters) if llm is not None else None,
+        "routing": request.app.state.router.metrics(),
+        "batching": {
+            mode: batcher.metrics() for mode, batcher in request.app.state.batchers.items()
+        },
+        "cache": request.app.state.cache.metrics(),
+        "store": store.metrics() if store is not None else None,
+        "feedback": request.app.state.feedback.metrics(),
+        "near_duplicates": index.metrics() if index is not None else None,
+        "precision": getattr(request.app.state, "precision_report", None),
+        "telemetry": telemetry.metrics(),
+        "energy": energy_meter.metrics(),
+    }
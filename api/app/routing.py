@@ -0,0 +1,69 @@
+"""
+Adapter routing for A/B tests and canary releases.
+
+Several LoRA adapters are served on the same base model. A request can name its
+adapter, otherwise each claim is routed by a weighted policy. The choice is derived
+from a hash of the normalized claim : a claim always gets the same adapter, so its
+cached predictions stay consistent, and the traffic split follows the weights.
+
+Weights are configured as `Config.ADAPTERS`, e.g. "adapter=0.9,adapter_v2=0.1".
+"""
+
+import hashlib
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+from app.cache import normalize_claim
+
+logger = logging.getLogger(__name__)
+
+
+def parse_weights(spec: str, default: str) -> Dict[str, float]:
+    """Routing weights of "name=weight,..." ; the default adapter alone if spec is empty"""
+    weights = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = entry.partition("=")
+        weights[name.strip()] = float(weight) if weight else 1.0
+    return weights or {default: 1.0}
+
+
+class AdapterRouter:
+    def __init__(self, weights: Dict[str, float], default: str):
+        """
+        Args:
+            weights: routing weight of each served adapter, adapters of weight 0 are only served on request.
+            default: adapter of the claims when no weight is positive.
+        """
+        self.default = default
+        self.weights = dict(weights)
+        total = sum(weight for weight in self.weights.values() if weight > 0)
+        self._bounds = []
+        cumulative = 0.0
+        for name, weight in self.weights.items():
+            if weight > 0:
+                cumulative += weight / total
+                self._bounds.append((cumulative, name))
+        self._routed = Counter()
+
+    @property
+    def adapters(self) -> List[str]:
+        return list(dict.fromkeys([self.default, *self.weights]))
+
+    def choose(self, claim: str, requested: Optional[str] = None) -> str:
+        """Adapter serving the claim : the requested one if any, else chosen by weight"""
+        if requested is not None:
+            if requested not in self.weights and requested != self.default:
+                raise KeyError(requested)
+            adapter = requested
+        elif len(self._bounds) <= 1:
+            adapter = self._bounds[0][1] if self._bounds else self.default
+        else:
+            digest = hashlib.sha256(normalize_claim(claim).encode("utf-8")).digest()
+            point = int.from_bytes(digest[:8], "big") / 2**64
+            adapter = next((name for bound, name in self._bounds if point < bound), self._bounds[-1][1])
+        self._routed[adapter] += 1
+        return adapter
+
+    def metrics(self) -> dict:
+        return {"weights": self.weights, "routed": dict(self._routed)}
@@ -0,0 +1,138 @@
+"""
+Near-duplicate claim lookup with MinHash and locality sensitive hashing (LSH).
+
+Claims are reduced to sets of character shingles of their normalized, punctuation-free
+text. A MinHash signature estimates the Jaccard similarity of two such sets, and
+LSH banding finds candidate claims without scanning the whole index.
+A query returns the most similar indexed claim above the similarity threshold,
+within the same (mode, model name, adapter) as the query.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Hashable, Optional, Tuple
+
+import numpy as np
+
+from app.cache import normalize_claim
+
+logger = logging.getLogger(__name__)
+
+# Mersenne prime 2^31 - 1 : (a * h + b) stays below 2^63
+PRIME = (1 << 31) - 1
+
+
+def shingles(claim: str, k: int = 5) -> set:
+    """Character k-grams of the claim, ignoring case, unicode variants, punctuation and spacing"""
+    text = re.sub(r"[^\w]+", " ", normalize_claim(claim)).strip()
+    if len(text) <= k:
+        return {text}
+    return {text[i : i + k] for i in range(len(text) - k + 1)}
+
+
+class NearDuplicateIndex:
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 64,
+        bands: int = 16,
+        max_entries: int = 100_000,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            threshold: minimum estimated Jaccard similarity for a match.
+            num_perm: number of hash permutations of the MinHash signatures.
+            bands: number of LSH bands, num_perm must be a multiple of it.
+            max_entries: maximum number of indexed claims, oldest are evicted first.
+            seed: seed of the hash permutations.
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+
+        self._entries = OrderedDict()  # (scope, claim) -> (signature, value)
+        self._buckets = defaultdict(set)  # (scope, band, band hash) -> {(scope, claim)}
+        self._lock = threading.Lock()
+        self._metrics = {"queries": 0, "hits": 0, "evictions": 0}
+
+    def signature(self, claim: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (
+                int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") % PRIME
+                for s in shingles(claim)
+            ),
+            dtype=np.uint64,
+        )
+        # one row per permutation, min over shingles
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % PRIME).min(axis=1)
+
+    def _band_keys(self, scope: Hashable, signature: np.ndarray) -> list:
+        return [
+            (scope, band, signature[band * self.rows : (band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def add(self, claim: str, scope: Hashable, value):
+        """Index claim within scope, e.g. (mode, model name, adapter)"""
+        key = (scope, normalize_claim(claim))
+        signature = self.signature(claim)
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (self._entries[key][0], value)
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (signature, value)
+            for band_key in self._band_keys(scope, signature):
+                self._buckets[band_key].add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._metrics["evictions"] += 1
+
+    def _remove(self, key):
+        signature, _ = self._entries.pop(key)
+        for band_key in self._band_keys(key[0], signature):
+            bucket = self._buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def query(self, claim: str, scope: Hashable) -> Optional[Tuple[object, float]]:
+        """(value, estimated similarity) of the most similar claim of scope above threshold, else None"""
+        signature = self.signature(claim)
+        with self._lock:
+            self._metrics["queries"] += 1
+            candidates = set()
+            for band_key in self._band_keys(scope, signature):
+                candidates |= self._buckets.get(band_key, set())
+
+            best, best_similarity = None, self.threshold
+            for candidate in candidates:
+                candidate_signature, value = self._entries[candidate]
+                similarity = float(np.mean(candidate_signature == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = value, similarity
+            if best is None:
+                return None
+            self._metrics["hits"] += 1
+            return best, best_similarity
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._metrics, "entries": len(self._entries), "threshold": self.threshold}
@@ -0,0 +1,291 @@
+"""
+Persistent prediction store, shared by restarts and replicas mounting the same directory.
+
+Predictions are kept in a SQLite file under `Config.LOCAL_DIRECTORY`, keyed like the
+in-memory prediction cache : (normalized claim, mode, model name, adapter slot), the
+slot being the adapter name and a hash of its files, reported by /metrics.
+Reads are synchronous and cheap, writes are queued and applied by a background thread.
+The least recently used rows are evicted once the file content exceeds its size bound.
+
+Pre-warm from an export of historical predictions (JSONL or CSV with columns
+user_claim, category, explanation, model_name, adapter slot or adapter_name and optionally mode, probabilities) :
+    python -m app.store prewarm predictions.jsonl
+Rows with only an adapter_name are keyed by the slot of the version of that adapter
+in `Config.LOCAL_DIRECTORY`, the one the API serves ; rows of adapters not found there are skipped.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from app.cache import PredictionCache
+from app.routing import parse_weights
+from shared.config import Config, setup_logging
+from shared.model.merged_checkpoint import adapter_slot
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    claim TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    adapter TEXT NOT NULL,
+    output TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (claim, mode, model_name, adapter)
+);
+CREATE INDEX IF NOT EXISTS predictions_accessed_at ON predictions (accessed_at);
+"""
+
+# after an eviction, the store is shrunk to this fraction of max_bytes
+EVICTION_TARGET = 0.9
+
+
+class PredictionStore:
+    def __init__(self, path: str, max_bytes: int = 1024**3):
+        """
+        Args:
+            path: SQLite file path, created if missing.
+            max_bytes: bound on the stored predictions size, least recently used rows are evicted beyond.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM predictions"
+        ).fetchone()[0]
+
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="prediction-store", daemon=True)
+        self._writer.start()
+        self._metrics = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        logger.info("Prediction store %s opened (%d bytes)", path, self._bytes)
+
+    @staticmethod
+    def _encode(output) -> str:
+        return json.dumps(list(output))
+
+    @staticmethod
+    def _decode(output: str) -> tuple:
+        return tuple(json.loads(output))
+
+    def get_many(self, keys: List[tuple]) -> Dict[tuple, tuple]:
+        """Stored outputs of keys, missing keys are left out. Marks hits as recently used."""
+        found = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                row = self._conn.execute(
+                    "SELECT output FROM predictions"
+                    " WHERE claim = ? AND mode = ? AND model_name = ? AND adapter = ?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    found[key] = self._decode(row[0])
+            self._metrics["hits"] += len(found)
+            self._metrics["misses"] += len(set(keys)) - len(found)
+        if found:
+            self._writes.put(("touch", list(found)))
+        return found
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, outputs: Dict[tuple, tuple]):
+        """Queue outputs for writing, returns immediately"""
+        if outputs:
+            self._writes.put(("put", dict(outputs)))
+
+    def flush(self):
+        """Block until every queued write is applied"""
+        self._writes.join()
+
+    def close(self):
+        self.flush()
+        self._writes.put(None)
+        self._writer.join()
+        self._conn.close()
+        logger.info("Prediction store %s closed", self.path)
+
+    def _write_loop(self):
+        while True:
+            item = self._writes.get()
+            try:
+                if item is None:
+                    return
+                op, payload = item
+                if op == "put":
+                    self._put(payload)
+                else:
+                    self._touch(payload)
+            except Exception as e:
+                logger.exception("Prediction store write failed: %s", e)
+            finally:
+                self._writes.task_done()
+
+    def _put(self, outputs: Dict[tuple, tuple]):
+        now = time.time()
+        rows = []
+        for key, output in outputs.items():
+            encoded = self._encode(output)
+            size = len(encoded.encode()) + len("".join(key).encode())
+            rows.append((*key, encoded, size, now))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for row in rows:
+                previous = self._conn.execute(
+                    "SELECT size FROM predictions"
+                    " WHERE claim = ? AND mode = ? AND model_name = ? AND adapter = ?",
+                    row[:4],
+                ).fetchone()
+                self._bytes -= previous[0] if previous else 0
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO predictions"
+                    " (claim, mode, model_name, adapter, output, size, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                self._bytes += row[5]
+            self._conn.execute("COMMIT")
+            self._metrics["writes"] += len(rows)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _touch(self, keys: List[tuple]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE predictions SET accessed_at = ?"
+                " WHERE claim = ? AND mode = ? AND model_name = ? AND adapter = ?",
+                [(now, *key) for key in keys],
+            )
+
+    def _evict(self):
+        """Delete least recently used rows until the store is back under EVICTION_TARGET * max_bytes"""
+        target = self.max_bytes * EVICTION_TARGET
+        evicted = 0
+        self._conn.execute("BEGIN")
+        rows = self._conn.execute(
+            "SELECT rowid, size FROM predictions ORDER BY accessed_at"
+        )
+        doomed = []
+        for rowid, size in rows:
+            if self._bytes <= target:
+                break
+            doomed.append((rowid,))
+            self._bytes -= size
+            evicted += 1
+        self._conn.executemany("DELETE FROM predictions WHERE rowid = ?", doomed)
+        self._conn.execute("COMMIT")
+        self._metrics["evictions"] += evicted
+        logger.info("Prediction store evicted %d rows", evicted)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                **self._metrics,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "pending_writes": self._writes.unfinished_tasks,
+            }
+
+    def prewarm(
+        self,
+        records: Iterable[dict],
+        slots: Dict[str, str],
+        model_name: str = Config.MODEL_NAME,
+        batch_size: int = 1000,
+    ) -> int:
+        """
+        Load historical predictions of the base model model_name, e.g. from an export of past
+        /predict responses, whose `model_name` is the adapter that served them.
+        Records name their adapter slot (`adapter`), or an adapter name (`adapter_name`, else `model_name`)
+        resolved with slots (name -> served slot) ; records of an adapter without slot are skipped,
+        they would never be looked up.
+        Returns the number of predictions loaded.
+        """
+        loaded = skipped = 0
+        batch = {}
+        for record in records:
+            mode = record.get("mode") or "generate"
+            slot = record.get("adapter") or slots.get(record.get("adapter_name") or record.get("model_name"))
+            if not slot:
+                skipped += 1
+                continue
+            # keyed as looked up by /predict : on the base model and the slot
+            key = PredictionCache.key(
+                claim=record["user_claim"],
+                model_name=model_name,
+                adapter=slot,
+                mode=mode,
+            )
+            if mode == "classify_fast":
+                probabilities = record["probabilities"]
+                if isinstance(probabilities, str):
+                    probabilities = json.loads(probabilities)
+                batch[key] = (str(record["category"]), probabilities)
+            else:
+                batch[key] = (str(record["category"]), record.get("explanation") or "")
+            if len(batch) >= batch_size:
+                self.put_many(batch)
+                loaded += len(batch)
+                batch = {}
+        self.put_many(batch)
+        loaded += len(batch)
+        self.flush()
+        logger.info("Prediction store pre-warmed with %d predictions", loaded)
+        if skipped:
+            logger.warning("%d predictions skipped : adapter not served", skipped)
+        return loaded
+
+
+def served_slots(local_directory: str = Config.LOCAL_DIRECTORY) -> Dict[str, str]:
+    """Slot of the local version of each configured adapter, as served by the API"""
+    names = parse_weights(Config.ADAPTERS, default=Config.ADAPTER_NAME)
+    slots = {}
+    for name in dict.fromkeys([Config.ADAPTER_NAME, *names]):
+        adapter_dir = os.path.join(local_directory, name)
+        if name and os.path.isdir(adapter_dir):
+            slots[name] = adapter_slot(name, adapter_dir)
+    return slots
+
+
+def read_records(path: str) -> Iterable[dict]:
+    """Records of a JSONL or CSV export"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Persistent prediction store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    prewarm = subparsers.add_parser("prewarm", help="load an export of historical predictions")
+    prewarm.add_argument("path", help="JSONL or CSV export")
+    prewarm.add_argument("--store", default=Config.PREDICTION_STORE_PATH)
+    prewarm.add_argument("--model", default=Config.MODEL_NAME, help="base model that served the predictions")
+    args = parser.parse_args()
+
+    store = PredictionStore(path=args.store, max_bytes=Config.PREDICTION_STORE_MAX_BYTES)
+    store.prewarm(read_records(args.path), slots=served_slots(), model_name=args.model)
+    store.close()
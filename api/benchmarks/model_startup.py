@@ -0,0 +1,86 @@
+"""
+Startup time of the base model : resolution from the mirrors and loading.
+
+Each source is timed from an empty cache :
+- hub    : from_pretrained with the Hub name, downloaded into a fresh Hugging Face cache
+- bucket : fetched from the bucket mirror into a fresh local mirror, then loaded
+- local  : resolved from the local mirror filled by the previous run, then loaded
+Loading memory-maps the safetensors with low-CPU-memory loading, as the API does.
+
+Run from the api directory :
+    python -m benchmarks.model_startup --sources hub bucket local
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from shared.config import Config, setup_logging
+from shared.model.model_mirror import ModelMirror, default_mirror, has_safetensors
+
+logger = logging.getLogger(__name__)
+
+
+def load(path: str):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    AutoTokenizer.from_pretrained(path)
+    return AutoModelForCausalLM.from_pretrained(
+        path,
+        low_cpu_mem_usage=True,
+        use_safetensors=has_safetensors(path) or None,
+    )
+
+
+def timed(source: str, resolve):
+    start = time.perf_counter()
+    path = resolve()
+    resolve_s = time.perf_counter() - start
+    start = time.perf_counter()
+    load(path)
+    load_s = time.perf_counter() - start
+    print(
+        f"{source:<7} resolve={resolve_s:7.2f}s load={load_s:7.2f}s "
+        f"total={resolve_s + load_s:7.2f}s ({path})"
+    )
+
+
+def benchmark(model_name: str, sources: list):
+    configured = default_mirror()
+    with tempfile.TemporaryDirectory() as directory:
+        mirror = ModelMirror(
+            directory=os.path.join(directory, "mirror"),
+            bucket=configured.bucket,
+            prefix=configured.prefix,
+            chunk_size=configured.chunk_size,
+            max_workers=configured.max_workers,
+        )
+        for source in sources:
+            if source == "hub":
+                from huggingface_hub import snapshot_download
+
+                cache_dir = os.path.join(directory, "hub")
+                timed(source, lambda: snapshot_download(repo_id=model_name, cache_dir=cache_dir))
+            elif source == "bucket":
+                if mirror.bucket is None:
+                    logger.warning("MODEL_MIRROR_BUCKET is not set, skipping the bucket mirror")
+                    continue
+                timed(source, lambda: mirror.fetch(model_name))
+            elif source == "local":
+                if mirror.local_path(model_name) is None:
+                    # filled from the configured mirrors, not timed
+                    mirror.add(model_name, configured.resolve(model_name))
+                timed(source, lambda: mirror.resolve(model_name))
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=Config.MODEL_NAME)
+    parser.add_argument("--sources", nargs="+", choices=["hub", "bucket", "local"], default=["hub", "bucket", "local"])
+    args = parser.parse_args()
+
+    benchmark(args.model, sources=args.sources)
@@ -0,0 +1,108 @@
+"""
+Precision / recall and latency benchmark of the near-duplicate claim lookup,
+on labelled claims of the feedback table.
+
+Half of the claims are indexed with their correct category. Queries are
+- paraphrase-like variants of indexed claims (punctuation, numbers, an extra clause),
+  which should match with the same category
+- the other half of the claims, unseen, which should only match if they share the category
+
+A hit is correct when the category of the matched claim is the correct category of the query.
+- precision : correct hits / hits
+- recall    : correct hits / queries
+
+Run from the api directory :
+    python -m benchmarks.near_duplicate --thresholds 0.6 0.7 0.8 0.9
+"""
+
+import argparse
+import logging
+import random
+import re
+import time
+
+import numpy as np
+
+from app.similarity import NearDuplicateIndex
+from shared.config import Config, setup_logging
+from shared.data.feedback_snapshot import load_feedback
+
+logger = logging.getLogger(__name__)
+
+SCOPE = ("generate", "benchmark", "benchmark")
+EXTRA_CLAUSES = [
+    ", everyone knows it",
+    " and that is a fact",
+    ", according to many experts",
+]
+
+
+def perturb(claim: str, rng: random.Random) -> str:
+    """Paraphrase-like variant : punctuation, a different number or an extra clause"""
+    kind = rng.choice(["punctuation", "number", "clause"])
+    if kind == "number" and re.search(r"\d+", claim):
+        return re.sub(r"\d+", lambda m: str(int(m.group(0)) + rng.randint(1, 9)), claim, count=1)
+    if kind == "clause":
+        return claim.rstrip(".!? ") + rng.choice(EXTRA_CLAUSES) + "."
+    return re.sub(r"[.,;:!?]", "", claim).rstrip() + rng.choice(["!", "...", " ?"])
+
+
+def evaluate(index: NearDuplicateIndex, queries: list) -> dict:
+    hits, correct, latencies = 0, 0, []
+    for claim, label in queries:
+        start = time.perf_counter()
+        match = index.query(claim, SCOPE)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if match is not None:
+            hits += 1
+            correct += match[0] == label
+    return {
+        "queries": len(queries),
+        "hits": hits,
+        "precision": correct / hits if hits else float("nan"),
+        "recall": correct / len(queries) if queries else float("nan"),
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p99": float(np.percentile(latencies, 99)),
+    }
+
+
+def benchmark(claims: list, thresholds: list, seed: int = 0):
+    rng = random.Random(seed)
+    rng.shuffle(claims)
+    indexed, unseen = claims[: len(claims) // 2], claims[len(claims) // 2 :]
+    variants = [(perturb(claim, rng), label) for claim, label in indexed]
+
+    for threshold in thresholds:
+        index = NearDuplicateIndex(threshold=threshold, max_entries=len(indexed) + 1)
+        start = time.perf_counter()
+        for claim, label in indexed:
+            index.add(claim, SCOPE, label)
+        build_s = time.perf_counter() - start
+
+        for name, queries in (("variants", variants), ("unseen", unseen)):
+            results = evaluate(index, queries)
+            print(
+                f"threshold={threshold:.2f} {name:<8} "
+                f"queries={results['queries']:<5} hits={results['hits']:<5} "
+                f"precision={results['precision']:.3f} recall={results['recall']:.3f} "
+                f"p50={results['latency_ms_p50']:.2f}ms p99={results['latency_ms_p99']:.2f}ms "
+                f"(index of {len(indexed)} built in {build_s:.2f}s)"
+            )
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.6, 0.7, 0.8, 0.9])
+    parser.add_argument("--start-date", default=None)
+    args = parser.parse_args()
+
+    df = load_feedback(
+        project_id=Config.GCP_PROJECT_ID,
+        dataset_id=Config.BQ_DATASET_ID,
+        table_id=Config.BQ_TABLE_ID,
+        start_date=args.start_date,
+    )
+    claims = list(zip(df["text"], df["label_true"].astype(str)))
+    benchmark(claims, thresholds=args.thresholds)
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.batching import MicroBatcher
+
+
+class RecordingModel:
+    """Records the batches it is called with, optionally failing them"""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+        self._lock = threading.Lock()
+
+    def generate_batch(self, quotes, group=None):
+        with self._lock:
+            self.batches.append(list(quotes))
+        if self.error is not None:
+            raise self.error
+        return [quote.upper() for quote in quotes]
+
+
+def _run(model, scenario, **kwargs):
+    async def main():
+        batcher = MicroBatcher(generate_batch=model.generate_batch, **kwargs)
+        await batcher.start()
+        try:
+            return await scenario(batcher)
+        finally:
+            await batcher.stop()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_submits_coalesce_into_one_batch():
+    model = RecordingModel()
+
+    async def scenario(batcher):
+        return await asyncio.gather(*(batcher.submit([f"claim {i}"]) for i in range(5)))
+
+    results = _run(model, scenario, max_batch_size=8, max_wait_ms=200)
+
+    assert model.batches == [[f"claim {i}" for i in range(5)]]
+    assert results == [[f"CLAIM {i}"] for i in range(5)]
+
+
+def test_max_batch_size_splits_batches():
+    model = RecordingModel()
+
+    async def scenario(batcher):
+        return await asyncio.gather(*(batcher.submit([f"claim {i}"]) for i in range(5)))
+
+    results = _run(model, scenario, max_batch_size=2, max_wait_ms=200)
+
+    assert [len(batch) for batch in model.batches] == [2, 2, 1]
+    assert sum(model.batches, []) == [f"claim {i}" for i in range(5)]
+    assert results == [[f"CLAIM {i}"] for i in range(5)]
+
+
+def test_failed_batch_fails_every_waiter():
+    model = RecordingModel(error=ValueError("out of memory"))
+
+    async def scenario(batcher):
+        return await asyncio.gather(
+            *(batcher.submit([f"claim {i}"]) for i in range(3)),
+            return_exceptions=True,
+        )
+
+    results = _run(model, scenario, max_batch_size=8, max_wait_ms=200)
+
+    assert len(model.batches) == 1
+    assert len(results) == 3
+    for result in results:
+        assert isinstance(result, ValueError) and str(result) == "out of memory"
+
+
+def test_submit_requires_started_batcher():
+    batcher = MicroBatcher(generate_batch=RecordingModel().generate_batch)
+    with pytest.raises(RuntimeError):
+        asyncio.run(batcher.submit(["claim"]))
@@ -0,0 +1,54 @@
+from app.cache import PredictionCache, normalize_claim
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_claim():
+    assert normalize_claim("  Climate\tchange  IS\n cool ") == "climate change is cool"
+    assert normalize_claim("ＣＯ２ is fine") == normalize_claim("co2 is fine")
+
+
+def test_key_depends_on_adapter_and_mode():
+    key = PredictionCache.key("Claim", "model", "adapter:v1")
+    assert key == PredictionCache.key(" claim ", "model", "adapter:v1")
+    assert key != PredictionCache.key("claim", "model", "adapter:v2")
+    assert key != PredictionCache.key("claim", "model", "adapter:v1", mode="classify_fast")
+
+
+def test_ttl_expiration():
+    clock = FakeClock()
+    cache = PredictionCache(max_bytes=10_000, ttl_s=10, clock=clock)
+    cache.put("k", ("1", "explanation"))
+    assert cache.get("k") == ("1", "explanation")
+    clock.now = 11
+    assert cache.get("k") is None
+    metrics = cache.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["expirations"]) == (1, 1, 1)
+    assert metrics["entries"] == 0
+
+
+def test_lru_eviction_by_memory_bound():
+    cache = PredictionCache(max_bytes=3 * PredictionCache._size("k0", ("0", "x" * 10)))
+    for i in range(3):
+        cache.put(f"k{i}", (str(i), "x" * 10))
+    # k0 becomes the most recently used
+    assert cache.get("k0") is not None
+    cache.put("k3", ("3", "x" * 10))
+
+    assert cache.get("k1") is None
+    assert cache.get("k0") is not None
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_clear():
+    cache = PredictionCache()
+    cache.put("k", ("1", "explanation"))
+    cache.clear()
+    assert cache.get("k") is None
+    assert cache.metrics()["bytes"] == 0
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from google.cloud.exceptions import BadRequest
+
+from app.feedback import BigQueryFeedbackTable, FeedbackWriter, JsonlFeedbackTable
+from app.routes import router
+from shared.gcp import RowsRejectedError
+from shared.pydantic_models import FeedbackRequest
+
+
+class FlakyTable(JsonlFeedbackTable):
+    """Local table failing while unavailable, counting inserts"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.available = True
+        self.inserts = 0
+
+    def insert_rows(self, rows, row_ids):
+        self.inserts += 1
+        if not self.available:
+            raise ConnectionError("table unreachable")
+        super().insert_rows(rows, row_ids)
+
+
+def _feedback(i):
+    return FeedbackRequest(
+        user_claim=f"claim {i}", predicted_category=1, correct_category=2, assistant_explanation="explanation"
+    )
+
+
+def test_rows_are_written_in_batches(tmp_path):
+    table = FlakyTable(str(tmp_path / "table.jsonl"))
+    writer = FeedbackWriter(table, journal_path=str(tmp_path / "journal.jsonl"), batch_size=50, flush_interval_s=5)
+    writer.start()
+    for i in range(120):
+        writer.submit([_feedback(i)])
+    writer.close()
+
+    assert [row["user_claim"] for row in table.rows()] == [f"claim {i}" for i in range(120)]
+    assert table.inserts == 3
+
+
+def test_unavailable_table_journals_and_replays(tmp_path):
+    table = FlakyTable(str(tmp_path / "table.jsonl"))
+    table.available = False
+    journal = tmp_path / "journal.jsonl"
+    writer = FeedbackWriter(table, journal_path=str(journal), batch_size=10, flush_interval_s=0.05, max_queue=5)
+    writer.start()
+    # beyond the queue bound, rows go straight to the journal
+    assert writer.submit([_feedback(i) for i in range(8)]) == 8
+    writer.close()
+    assert journal.exists()
+    assert table.rows() == []
+
+    # a later process replays the journal once the table answers
+    table.available = True
+    writer = FeedbackWriter(table, journal_path=str(journal), batch_size=10)
+    writer.submit([_feedback(8)])
+    writer.flush()
+
+    assert not journal.exists()
+    assert sorted(row["user_claim"] for row in table.rows()) == [f"claim {i}" for i in range(9)]
+
+
+def test_feedback_endpoints(tmp_path):
+    app = FastAPI()
+    app.include_router(router)
+    table = JsonlFeedbackTable(str(tmp_path / "table.jsonl"))
+    app.state.feedback = FeedbackWriter(table, journal_path=str(tmp_path / "journal.jsonl"))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            single = await client.post("/feedback", json=_feedback(0).model_dump())
+            batch = await client.post(
+                "/feedback/batch", json={"instances": [_feedback(i).model_dump() for i in range(1, 4)]}
+            )
+            empty = await client.post("/feedback/batch", json={"instances": []})
+        return single, batch, empty
+
+    single, batch, empty = asyncio.run(scenario())
+    assert single.status_code == 204
+    assert batch.status_code == 202
+    assert batch.json() == {"accepted": 3}
+    assert empty.status_code == 422
+
+    app.state.feedback.close()
+    assert len(table.rows()) == 4
+
+
+def _records(writer, claims):
+    """Records as accepted by the writer, taken back from its queue"""
+    writer.submit([
+        FeedbackRequest(user_claim=claim, predicted_category=1, correct_category=2, assistant_explanation="explanation")
+        for claim in claims
+    ])
+    return [writer._queue.get_nowait() for _ in claims]
+
+
+class RejectingTable(FlakyTable):
+    """Local table rejecting the rows of claims starting with "invalid", as BigQuery does for schema errors"""
+
+    def insert_rows(self, rows, row_ids):
+        rejected = {index: "no such field" for index, row in enumerate(rows) if row["user_claim"].startswith("invalid")}
+        if rejected:
+            self.inserts += 1
+            raise RowsRejectedError(rejected)
+        super().insert_rows(rows, row_ids)
+
+
+def test_rejected_rows_go_to_dead_letter(tmp_path):
+    table = RejectingTable(str(tmp_path / "table.jsonl"))
+    journal = tmp_path / "journal.jsonl"
+    dead_letter = tmp_path / "rejected.jsonl"
+    # journaled by an earlier process, with a row the migrated table rejects
+    writer = FeedbackWriter(table, journal_path=str(journal), dead_letter_path=str(dead_letter))
+    writer._journal(_records(writer, ["claim 0", "invalid 1", "claim 2"]))
+
+    writer.submit([_feedback(3)])
+    writer.flush()
+
+    assert not journal.exists()
+    assert [row["user_claim"] for row in table.rows()] == ["claim 0", "claim 2", "claim 3"]
+    rejected = [json.loads(line) for line in dead_letter.read_text().splitlines()]
+    assert [record["row"]["user_claim"] for record in rejected] == ["invalid 1"]
+    assert rejected[0]["error"] == "no such field"
+    assert writer.metrics()["rejected"] == 1
+
+
+def test_journal_is_not_blocked_by_a_replay(tmp_path):
+    table = FlakyTable(str(tmp_path / "table.jsonl"))
+    release = threading.Event()
+    inserting = threading.Event()
+    insert_rows = table.insert_rows
+
+    def slow_insert(rows, row_ids):
+        inserting.set()
+        release.wait(5)
+        insert_rows(rows, row_ids)
+
+    table.insert_rows = slow_insert
+    journal = tmp_path / "journal.jsonl"
+    writer = FeedbackWriter(table, journal_path=str(journal), max_queue=1)
+    writer._journal(_records(writer, ["claim 0"]))
+    replay = threading.Thread(target=writer._replay)
+    replay.start()
+    inserting.wait(5)
+
+    # the queue is full : journaled while the replay waits on the table
+    start = time.perf_counter()
+    writer.submit([_feedback(1), _feedback(2)])
+    assert time.perf_counter() - start < 1
+    assert journal.exists()
+
+    release.set()
+    replay.join()
+    writer.flush()
+    assert sorted(row["user_claim"] for row in table.rows()) == ["claim 0", "claim 1", "claim 2"]
+    assert not journal.exists()
+
+
+def test_refused_bigquery_request_is_narrowed_to_its_rows(monkeypatch):
+    inserted = []
+
+    def insert_feedback_rows_bq(rows, row_ids, **kwargs):
+        if any(row["user_claim"] == "too large" for row in rows):
+            raise BadRequest("Request payload size exceeds the limit")
+        inserted.extend(row_ids)
+
+    monkeypatch.setattr("app.feedback.Gcp.insert_feedback_rows_bq", insert_feedback_rows_bq)
+    table = BigQueryFeedbackTable("project", "dataset", "table")
+    rows = [{"user_claim": claim} for claim in ["a", "b", "too large", "c"]]
+
+    with pytest.raises(RowsRejectedError) as e:
+        table.insert_rows(rows, ["0", "1", "2", "3"])
+    assert list(e.value.rejected) == [2]
+    assert inserted == ["0", "1", "3"]
+
+
+def test_journaled_rows_written_late_are_counted(tmp_path, monkeypatch):
+    table = FlakyTable(str(tmp_path / "table.jsonl"))
+    table.available = False
+    writer = FeedbackWriter(table, journal_path=str(tmp_path / "journal.jsonl"))
+    writer.submit([_feedback(i) for i in range(2)])
+    writer.flush()
+
+    # replayed after the lookback of the feedback snapshots
+    monkeypatch.setattr("app.feedback.Config.FEEDBACK_SNAPSHOT_LOOKBACK_S", -1)
+    table.available = True
+    writer.flush()
+
+    rows = table.rows()
+    assert len(rows) == 2
+    # the insert id is stored with the row, rows of a batch share their created_at
+    assert len({row["insert_id"] for row in rows}) == 2
+    assert rows[0]["created_at"] == rows[1]["created_at"]
+    assert writer.metrics()["late"] == 2
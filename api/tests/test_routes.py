@@ -0,0 +1,444 @@
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI
+
+from app.batching import MicroBatcher
+from app.cache import PredictionCache
+from app.routing import AdapterRouter
+from app.routes import router
+from shared.model.model import LLMWrapper
+
+
+class SlowLLM:
+    """Stands in for LLMWrapper : blocks its thread like a real generation"""
+
+    model_name = "slow-llm"
+    adapter_name = "adapter"
+    active_adapter = "adapter_0"
+    adapters = {"adapter": "adapter_0"}
+
+    # adapter merged into the weights : reloads rebuild the model
+    can_swap_adapters = False
+    model = "weights"
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.cleared = False
+
+    def clear_when_idle(self):
+        self.cleared = True
+
+    def resolve_adapter(self, adapter_name=None):
+        return self.adapters[adapter_name or self.adapter_name]
+
+    def acquire_adapter(self, adapter_name=None):
+        return self.resolve_adapter(adapter_name)
+
+    def release_adapter(self, adapter):
+        pass
+
+    def generate_batch(self, quotes, group=None):
+        time.sleep(self.delay)
+        usage = {"tokens_in": 10, "tokens_out": 5, "latency_s": self.delay, "energy_j": 1.0, "co2_g": 0.1}
+        return [(("0", "explanation"), usage) for _ in quotes]
+
+
+def test_health_responsive_during_generation():
+    app = FastAPI()
+    app.include_router(router)
+    app.state.model = SlowLLM(delay=2.0)
+    app.state.cache = PredictionCache()
+    app.state.router = AdapterRouter(weights={"adapter": 1.0}, default="adapter")
+    app.state.batchers = {
+        "generate": MicroBatcher(
+            generate_batch=app.state.model.generate_batch,
+            max_batch_size=8,
+            max_wait_ms=5,
+            max_concurrency=1,
+        )
+    }
+
+    async def scenario():
+        await app.state.batchers["generate"].start()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            predict = asyncio.create_task(
+                client.post("/predict", json={"instances": [{"user_claim": "claim"}]})
+            )
+            # let the generation start on the inference executor
+            await asyncio.sleep(0.2)
+            assert not predict.done()
+
+            start = time.perf_counter()
+            health = await client.get("/health")
+            health_latency = time.perf_counter() - start
+
+            response = await predict
+        await app.state.batchers["generate"].stop()
+        return health, health_latency, response
+
+    health, health_latency, response = asyncio.run(scenario())
+
+    assert health.status_code == 200
+    assert health_latency < 0.1
+    assert response.status_code == 200
+    assert response.json()["predictions"][0]["category"] == "0"
+    assert response.json()["predictions"][0]["model_name"] == "adapter"
+    assert response.json()["metadata"]["usage"]["energy_j"] == 1.0
+
+
+def test_reload_serves_previous_model_until_rebuilt(monkeypatch):
+    app = FastAPI()
+    app.include_router(router)
+    old = SlowLLM(delay=0.01)
+    app.state.model = old
+    app.state.cache = PredictionCache()
+    app.state.router = AdapterRouter(weights={"adapter": 1.0, "adapter_v2": 0.0}, default="adapter")
+    app.state.batchers = {
+        "generate": MicroBatcher(
+            generate_batch=lambda quotes, group: group[0].generate_batch(quotes, group[1]),
+            max_batch_size=8,
+            max_wait_ms=5,
+            max_concurrency=1,
+        )
+    }
+
+    def build(adapter_name, **kwargs):
+        time.sleep(0.5)
+        llm = SlowLLM(delay=0.01)
+        llm.adapter_name = adapter_name
+        llm.adapters = {adapter_name: f"{adapter_name}_1"}
+        return llm
+
+    monkeypatch.setattr("app.routes.LLMWrapper", build)
+    monkeypatch.setattr("app.routes.Gcp", SimpleNamespace(load_adapter_gcs=lambda **kwargs: None))
+
+    async def scenario():
+        await app.state.batchers["generate"].start()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            reload = asyncio.create_task(client.get("/reload_model", params={"adapter": "adapter_v2"}))
+            await asyncio.sleep(0.1)
+            during = await client.post("/predict", json={"instances": [{"user_claim": "claim"}]})
+            reloaded = await reload
+            after = await client.post("/predict", json={"instances": [{"user_claim": "claim"}]})
+        await app.state.batchers["generate"].stop()
+        return during, reloaded, after
+
+    during, reloaded, after = asyncio.run(scenario())
+
+    assert during.status_code == 200
+    assert during.json()["predictions"][0]["model_name"] == "adapter"
+    assert reloaded.status_code == 200
+    assert old.cleared
+    assert app.state.model.adapter_name == "adapter_v2"
+    assert after.json()["predictions"][0]["model_name"] == "adapter_v2"
+
+
+class ScriptedLLM:
+    """Stands in for LLMWrapper : a fixed answer per claim, streamed in chunks"""
+
+    model_name = "scripted-llm"
+    adapter_name = "adapter"
+    adapters = {"adapter": "adapter_0"}
+
+    def __init__(self, category="2", explanation="The claim contradicts the observed warming trend."):
+        self.category = category
+        self.explanation = explanation
+        self.calls = []
+
+    def resolve_adapter(self, adapter_name=None):
+        return self.adapters[adapter_name or self.adapter_name]
+
+    def acquire_adapter(self, adapter_name=None):
+        return self.resolve_adapter(adapter_name)
+
+    def release_adapter(self, adapter):
+        pass
+
+    def _usage(self):
+        return {"tokens_in": 10, "tokens_out": 5, "latency_s": 0.0, "energy_j": 1.0, "co2_g": 0.1}
+
+    def generate_batch(self, quotes, return_usage=False, adapter=None):
+        self.calls.append(("generate", list(quotes)))
+        results = [(self.category, self.explanation) for _ in quotes]
+        return (results, [self._usage() for _ in quotes]) if return_usage else results
+
+    def classify_fast(self, quotes, return_usage=False, adapter=None):
+        self.calls.append(("classify_fast", list(quotes)))
+        probabilities = {str(category): 0.02 for category in range(8)}
+        probabilities[self.category] = 0.86
+        results = [(self.category, dict(probabilities)) for _ in quotes]
+        return (results, [self._usage() for _ in quotes]) if return_usage else results
+
+    def generate_stream(self, quote, executor=None, adapter=None):
+        self.calls.append(("stream", [quote]))
+        yield "category", {"category": self.category}
+        words = self.explanation.split(" ")
+        for i, word in enumerate(words):
+            yield "explanation", {"text": word if i == len(words) - 1 else word + " "}
+        yield "done", {"category": self.category, "explanation": self.explanation}
+
+
+def _scripted_app(llm):
+    app = FastAPI()
+    app.include_router(router)
+    app.state.model = llm
+    app.state.cache = PredictionCache()
+    app.state.router = AdapterRouter(weights={"adapter": 1.0}, default="adapter")
+    app.state.executor = None
+    app.state.batchers = {
+        "generate": MicroBatcher(
+            generate_batch=lambda quotes, group: list(zip(
+                *group[0].generate_batch(quotes=quotes, return_usage=True, adapter=group[1])
+            )),
+            max_batch_size=8,
+            max_wait_ms=5,
+        ),
+        "classify_fast": MicroBatcher(
+            generate_batch=lambda quotes, group: list(zip(
+                *group[0].classify_fast(quotes=quotes, return_usage=True, adapter=group[1])
+            )),
+            max_batch_size=8,
+            max_wait_ms=5,
+        ),
+    }
+    return app
+
+
+def _parse_sse(body: str) -> list:
+    events = []
+    for frame in body.split("\n\n"):
+        if not frame:
+            continue
+        lines = frame.split("\n")
+        assert lines[0].startswith("event: ") and lines[1].startswith("data: ") and len(lines) == 2
+        events.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return events
+
+
+def test_stream_matches_predict():
+    llm = ScriptedLLM()
+    app = _scripted_app(llm)
+    claim = {"user_claim": "The climate has always changed"}
+
+    async def scenario():
+        await app.state.batchers["generate"].start()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            stream = await client.post("/predict/stream", json=claim)
+            # generated again : not served from the cache filled by the stream
+            app.state.cache = PredictionCache()
+            predict = await client.post("/predict", json={"instances": [claim]})
+        await app.state.batchers["generate"].stop()
+        return stream, predict
+
+    stream, predict = asyncio.run(scenario())
+
+    assert stream.status_code == 200
+    assert stream.headers["content-type"].startswith("text/event-stream")
+    assert stream.text.endswith("\n\n")
+    events = _parse_sse(stream.text)
+    names = [name for name, _ in events]
+    assert names[0] == "category" and names[-1] == "done"
+    assert set(names[1:-1]) == {"explanation"} and len(names) > 3
+
+    prediction = predict.json()["predictions"][0]
+    assert events[0][1] == {"category": prediction["category"]}
+    assert "".join(data["text"] for name, data in events if name == "explanation") == prediction["explanation"]
+    done = events[-1][1]
+    for field in ("model_name", "user_claim", "category", "explanation"):
+        assert done[field] == prediction[field]
+    assert [kind for kind, _ in llm.calls] == ["stream", "generate"]
+
+
+def test_classify_fast_does_not_share_generate_cache_entries():
+    llm = ScriptedLLM()
+    app = _scripted_app(llm)
+    claim = {"user_claim": "The climate has always changed"}
+
+    async def scenario():
+        for batcher in app.state.batchers.values():
+            await batcher.start()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            generated = await client.post("/predict", json={"instances": [claim]})
+            fast = await client.post(
+                "/predict", json={"instances": [claim], "parameters": {"mode": "classify_fast"}}
+            )
+            fast_again = await client.post(
+                "/predict", json={"instances": [claim], "parameters": {"mode": "classify_fast"}}
+            )
+        for batcher in app.state.batchers.values():
+            await batcher.stop()
+        return generated, fast, fast_again
+
+    generated, fast, fast_again = asyncio.run(scenario())
+
+    prediction = fast.json()["predictions"][0]
+    assert fast.status_code == 200
+    assert prediction["category"] == llm.category
+    assert prediction["explanation"] == ""
+    assert abs(sum(prediction["probabilities"].values()) - 1.0) < 1e-6
+    assert generated.json()["predictions"][0]["explanation"] == llm.explanation
+    assert generated.json()["predictions"][0]["probabilities"] is None
+
+    # one inference per mode, the second classify_fast request is served from its own entry
+    assert [kind for kind, _ in llm.calls] == ["generate", "classify_fast"]
+    assert fast_again.json()["predictions"][0] == prediction
+    key = app.state.cache.key
+    assert key(claim="claim", model_name="m", adapter="a", mode="generate") != key(
+        claim="claim", model_name="m", adapter="a", mode="classify_fast"
+    )
+
+
+class SwappableLLM(LLMWrapper):
+    """LLMWrapper with the adapter bookkeeping of a PEFT model and no weights : adapters are names in `loaded`"""
+
+    model_name = "swappable-llm"
+    can_swap_adapters = True
+
+    def __init__(self):
+        self._adapters_lock = threading.Lock()
+        self._inflight = Counter()
+        self._retired = set()
+        self._clear_when_idle = False
+        self._prefix_caches = {}
+        self.adapter_name = "adapter"
+        self.active_adapter = "adapter_v1"
+        self.adapters = {"adapter": "adapter_v1"}
+        self.loaded = {"adapter_v1"}
+        self.deleted = []
+        self.running = threading.Event()
+        self.resume = threading.Event()
+
+    def load_adapter(self, adapter_name):
+        self.loaded.add("adapter_v2")
+        return "adapter_v2"
+
+    def warm_up(self, adapter):
+        assert adapter in self.loaded
+
+    def _delete_adapter(self, adapter):
+        self.loaded.remove(adapter)
+        self.deleted.append(adapter)
+
+    def generate_batch(self, quotes, return_usage=False, adapter=None):
+        with self._using_adapter(adapter) as adapter:
+            if adapter not in self.loaded:
+                raise RuntimeError(f"Adapter {adapter} was deleted")
+            self.running.set()
+            self.resume.wait(5)
+            results = [("1", adapter) for _ in quotes]
+        usage = [{"tokens_in": 1, "tokens_out": 1} for _ in quotes]
+        return (results, usage) if return_usage else results
+
+
+def test_hot_swap_keeps_queued_slot_until_answered(monkeypatch):
+    llm = SwappableLLM()
+    app = _scripted_app(llm)
+    monkeypatch.setattr("app.routes.Gcp", SimpleNamespace(load_adapter_gcs=lambda **kwargs: None))
+
+    async def scenario():
+        await app.state.batchers["generate"].start()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            running = asyncio.create_task(client.post("/predict", json={"instances": [{"user_claim": "first"}]}))
+            await asyncio.to_thread(llm.running.wait, 5)
+            # queued behind the running batch, on the same slot
+            queued = asyncio.create_task(client.post("/predict", json={"instances": [{"user_claim": "second"}]}))
+            await asyncio.sleep(0.1)
+
+            reload = await client.get("/reload_model", params={"adapter": "adapter"})
+            deleted_after_reload = list(llm.deleted)
+            llm.resume.set()
+            running, queued = await running, await queued
+            after = await client.post("/predict", json={"instances": [{"user_claim": "third"}]})
+        await app.state.batchers["generate"].stop()
+        return reload, deleted_after_reload, running, queued, after
+
+    reload, deleted_after_reload, running, queued, after = asyncio.run(scenario())
+
+    assert reload.status_code == 200
+    assert llm.active_adapter == "adapter_v2"
+    # the previous slot is retired but still loaded while claims routed to it wait
+    assert deleted_after_reload == []
+    assert running.status_code == 200 and queued.status_code == 200
+    assert running.json()["predictions"][0]["explanation"] == "adapter_v1"
+    assert queued.json()["predictions"][0]["explanation"] == "adapter_v1"
+    assert after.json()["predictions"][0]["explanation"] == "adapter_v2"
+    assert llm.deleted == ["adapter_v1"] and not llm._inflight
+
+
+class EndlessLLM(ScriptedLLM):
+    """Streams explanation chunks until the stream is closed"""
+
+    def __init__(self):
+        super().__init__()
+        self.closed = threading.Event()
+
+    def generate_stream(self, quote, executor=None, adapter=None):
+        try:
+            yield "category", {"category": self.category}
+            while True:
+                time.sleep(0.01)
+                yield "explanation", {"text": "more "}
+        finally:
+            self.closed.set()
+
+
+def test_stream_holds_an_inference_slot_and_stops_on_disconnect():
+    llm = EndlessLLM()
+    app = _scripted_app(llm)
+    batcher = app.state.batchers["generate"]
+    claim = json.dumps({"user_claim": "The climate has always changed"}).encode()
+
+    async def scenario():
+        await batcher.start()
+        chunks = []
+        batch_done = []
+        streaming = asyncio.Event()
+        batch = None
+
+        async def receive():
+            if not chunks:
+                return {"type": "http.request", "body": claim, "more_body": False}
+            # the client goes away after the first events
+            await streaming.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal batch
+            if message["type"] == "http.response.body" and message.get("body"):
+                chunks.append(message["body"])
+                if batch is None:
+                    batch = asyncio.ensure_future(batcher.submit(["other claim"], group=(llm, "adapter_0")))
+                else:
+                    batch_done.append(batch.done())
+                if len(chunks) == 3:
+                    streaming.set()
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+            "method": "POST", "scheme": "http", "path": "/predict/stream", "raw_path": b"/predict/stream",
+            "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+            "client": ("test", 1), "server": ("test", 80),
+        }
+        await asyncio.wait_for(app(scope, receive, send), timeout=5)
+        # the slot is released with the stream
+        await asyncio.wait_for(batch, timeout=1)
+        await batcher.stop()
+        return chunks, batch_done
+
+    chunks, batch_done = asyncio.run(scenario())
+
+    assert 3 <= len(chunks) < 10
+    # max_concurrency=1 : the /predict batch waits while the stream generates
+    assert batch_done and not any(batch_done)
+    assert llm.closed.is_set()
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from app.batching import MicroBatcher
+from app.routing import AdapterRouter, parse_weights
+
+
+def test_parse_weights():
+    assert parse_weights("adapter=0.9, adapter_v2=0.1", default="adapter") == {"adapter": 0.9, "adapter_v2": 0.1}
+    assert parse_weights("", default="adapter") == {"adapter": 1.0}
+
+
+def test_weighted_routing_is_sticky_per_claim():
+    router = AdapterRouter(weights={"a": 0.8, "b": 0.2}, default="a")
+    claims = [f"claim number {i}" for i in range(2000)]
+    routed = [router.choose(claim) for claim in claims]
+
+    assert routed == [router.choose(claim) for claim in claims]
+    assert router.choose("Claim  NUMBER 3") == routed[3]
+    assert 0.15 < routed.count("b") / len(routed) < 0.25
+
+
+def test_requested_adapter():
+    router = AdapterRouter(weights={"b": 1.0}, default="a")
+    assert router.choose("claim", requested="a") == "a"
+    assert router.choose("claim") == "b"
+    with pytest.raises(KeyError):
+        router.choose("claim", requested="c")
+
+
+def test_batches_grouped_by_adapter():
+    batches = []
+
+    def generate_batch(quotes, group=None):
+        batches.append((group, list(quotes)))
+        return [f"{group}:{quote}" for quote in quotes]
+
+    async def scenario():
+        batcher = MicroBatcher(generate_batch=generate_batch, max_batch_size=8, max_wait_ms=50)
+        await batcher.start()
+        results = await asyncio.gather(
+            batcher.submit(["q1", "q2"], group="a"),
+            batcher.submit(["q3"], group="b"),
+            batcher.submit(["q4"], group="a"),
+        )
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert results == [["a:q1", "a:q2"], ["b:q3"], ["a:q4"]]
+    assert sorted(batches) == [("a", ["q1", "q2", "q4"]), ("b", ["q3"])]
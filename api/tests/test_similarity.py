@@ -0,0 +1,33 @@
+from app.similarity import NearDuplicateIndex
+
+SCOPE = ("generate", "model", "adapter")
+
+
+def test_matches_paraphrase_above_threshold():
+    index = NearDuplicateIndex(threshold=0.7)
+    index.add("Global temperatures have not risen since 1998, the warming stopped.", SCOPE, ("1", "denial"))
+
+    match = index.query("global temperatures have not risen since 1998 - the warming stopped!!", SCOPE)
+    assert match is not None
+    value, similarity = match
+    assert value == ("1", "denial")
+    assert similarity >= 0.7
+
+
+def test_no_match_for_unrelated_claim_or_other_scope():
+    index = NearDuplicateIndex(threshold=0.7)
+    index.add("Global temperatures have not risen since 1998, the warming stopped.", SCOPE, ("1", "denial"))
+
+    assert index.query("Wind turbines kill more birds than oil spills", SCOPE) is None
+    other_adapter = ("generate", "model", "adapter:v2")
+    assert index.query("Global temperatures have not risen since 1998, the warming stopped.", other_adapter) is None
+
+
+def test_bounded_entries():
+    index = NearDuplicateIndex(max_entries=2)
+    for i, claim in enumerate(["first claim about co2", "second claim about ice", "third claim about seas"]):
+        index.add(claim, SCOPE, (str(i), ""))
+
+    assert index.metrics()["entries"] == 2
+    assert index.query("first claim about co2", SCOPE) is None
+    assert index.query("third claim about seas", SCOPE)[0] == ("2", "")
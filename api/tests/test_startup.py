@@ -0,0 +1,51 @@
+"""
+Startup benchmark of the API : import time and peak RSS of `app.main`, measured in a
+fresh interpreter, and a check that training-only dependencies stay off the serving path.
+Budgets can be tuned with API_IMPORT_TIME_BUDGET_S and API_IMPORT_RSS_BUDGET_MB.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+TRAINING_ONLY_MODULES = ["trl", "datasets", "mlflow", "codecarbon"]
+IMPORT_TIME_BUDGET_S = float(os.getenv("API_IMPORT_TIME_BUDGET_S", "20"))
+PEAK_RSS_BUDGET_MB = float(os.getenv("API_IMPORT_RSS_BUDGET_MB", "1024"))
+
+SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app.main
+duration = time.perf_counter() - start
+peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# ru_maxrss is in bytes on macOS, kilobytes on Linux
+peak_rss_mb = peak_rss / 1024**2 if sys.platform == "darwin" else peak_rss / 1024
+print(json.dumps({
+    "import_time_s": duration,
+    "peak_rss_mb": peak_rss_mb,
+    "modules": sorted({name.split(".")[0] for name in sys.modules}),
+}))
+"""
+
+
+def measure_startup() -> dict:
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT],
+        cwd=api_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_api_startup_import():
+    startup = measure_startup()
+    measured = f"app.main import: {startup['import_time_s']:.2f}s, peak RSS {startup['peak_rss_mb']:.0f} MB"
+
+    loaded = [name for name in TRAINING_ONLY_MODULES if name in startup["modules"]]
+    assert not loaded, f"training-only modules imported by the API: {loaded}"
+    assert startup["import_time_s"] < IMPORT_TIME_BUDGET_S, f"{measured}, over the {IMPORT_TIME_BUDGET_S}s budget"
+    assert startup["peak_rss_mb"] < PEAK_RSS_BUDGET_MB, f"{measured}, over the {PEAK_RSS_BUDGET_MB:.0f} MB budget"
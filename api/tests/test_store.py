@@ -0,0 +1,69 @@
+import json
+
+from app.cache import PredictionCache
+from app.store import PredictionStore, read_records
+from shared.model.merged_checkpoint import adapter_slot
+
+
+def test_persists_across_restarts(tmp_path):
+    path = str(tmp_path / "predictions.sqlite")
+    key = PredictionCache.key("Climate change is cool", "model", "adapter:v1")
+
+    store = PredictionStore(path=path)
+    store.put_many({key: ("3", "explanation")})
+    store.close()
+
+    store = PredictionStore(path=path)
+    assert store.get(key) == ("3", "explanation")
+    assert store.get(PredictionCache.key("Climate change is cool", "model", "adapter:v2")) is None
+    store.close()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    store = PredictionStore(path=str(tmp_path / "predictions.sqlite"), max_bytes=300)
+    keys = [PredictionCache.key(f"claim {i}", "model", "adapter") for i in range(4)]
+    for key in keys[:3]:
+        store.put_many({key: ("1", "x" * 50)})
+        store.flush()
+    # first key becomes the most recently used
+    assert store.get(keys[0]) is not None
+    store.flush()
+
+    store.put_many({keys[3]: ("1", "x" * 50)})
+    store.flush()
+
+    assert store.get(keys[1]) is None
+    assert store.get(keys[0]) is not None
+    assert store.metrics()["bytes"] <= 300
+    store.close()
+
+
+def test_prewarm_from_export(tmp_path):
+    adapter_dir = tmp_path / "ad"
+    adapter_dir.mkdir()
+    (adapter_dir / "adapter_config.json").write_text("{}")
+    slot = adapter_slot("ad", str(adapter_dir))
+
+    export = tmp_path / "export.jsonl"
+    records = [
+        # a /predict response : model_name is the adapter that served it
+        {"user_claim": "Claim A", "category": 1, "explanation": "a", "model_name": "ad"},
+        {
+            "user_claim": "Claim B",
+            "category": "2",
+            "adapter": slot,
+            "mode": "classify_fast",
+            "probabilities": {"2": 0.9},
+        },
+        # adapter not served : never looked up
+        {"user_claim": "Claim C", "category": 3, "explanation": "c", "model_name": "old"},
+    ]
+    export.write_text("\n".join(json.dumps(record) for record in records))
+
+    store = PredictionStore(path=str(tmp_path / "predictions.sqlite"))
+    assert store.prewarm(read_records(str(export)), slots={"ad": slot}, model_name="base") == 2
+    # keyed by base model and slot, as looked up by /predict
+    assert store.get(PredictionCache.key(" claim a ", "base", slot)) == ("1", "a")
+    assert store.get(PredictionCache.key("claim b", "base", slot, mode="classify_fast")) == ("2", {"2": 0.9})
+    assert store.get(PredictionCache.key("claim a", "ad", slot)) is None
+    store.close()
@@ -1,6 +1,15 @@
+import argparse
+
 from google.cloud import bigquery, storage
 from google.cloud.exceptions import NotFound
 from mlpipeline.config import Config, setup_logging
+from shared.feedback_table import (
+    CLUSTERING,
+    PARTITIONING,
+    is_partitioned,
+    migrate_feedback_table,
+    migration_pending,
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,10 +21,11 @@ schema = [
     bigquery.SchemaField("predicted_category", "INTEGER", mode="REQUIRED"),
     bigquery.SchemaField("correct_category", "INTEGER", mode="REQUIRED"),
     bigquery.SchemaField("assistant_explanation", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("insert_id", "STRING", mode="NULLABLE"),
 ]
 
 
-def ensure_bq_resources():
+def ensure_bq_resources(migrate: bool = False, buffer_timeout_s: float = 0):
     logger.info('\nChecking Big Query ressources')
     bq_client = bigquery.Client(project=Config.GCP_PROJECT_ID)
 
@@ -37,9 +47,30 @@ def ensure_bq_resources():
         print(f"Schema for table {table_ref}:")
         for field in table.schema:
             print(f" - {field.name}: {field.field_type} ({field.mode})")
+        missing = [field for field in schema if field.name not in {f.name for f in table.schema}]
+        if missing:
+            # nullable columns are added in place, the existing rows get NULL
+            table.schema = list(table.schema) + missing
+            bq_client.update_table(table, ["schema"])
+            print(f"Columns {', '.join(field.name for field in missing)} added to table {table_ref}.")
+        if not is_partitioned(table) or table.clustering_fields != CLUSTERING:
+            if migrate:
+                migrate_feedback_table(bq_client, table_ref, buffer_timeout_s=buffer_timeout_s)
+            else:
+                print(f"Table {table_ref} is not partitioned and clustered, run with --migrate to migrate it.")
 
     except NotFound:
+        if migration_pending(bq_client, table_ref):
+            # renamed by a migration that stopped midway : creating an empty table would hide its rows
+            if migrate:
+                migrate_feedback_table(bq_client, table_ref, buffer_timeout_s=buffer_timeout_s)
+                print(f"Table {table_ref} migrated.")
+            else:
+                print(f"Migration of table {table_ref} stopped midway, run with --migrate to resume it.")
+            return
         table = bigquery.Table(table_ref, schema=schema)
+        table.time_partitioning = PARTITIONING
+        table.clustering_fields = CLUSTERING
         bq_client.create_table(table)
         print(f"Table {Config.BQ_TABLE_ID} created.")
         print(f"Schema for table {table_ref}:")
@@ -65,5 +96,19 @@ def ensure_gcs_bucket():
 if __name__ == "__main__":
     setup_logging()
 
-    ensure_bq_resources()
+    parser = argparse.ArgumentParser(description="Create the GCP resources")
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="migrate an existing feedback table to partitioning and clustering, with the feedback ingestion paused",
+    )
+    parser.add_argument(
+        "--buffer-timeout",
+        type=float,
+        default=0,
+        help="seconds to wait for the streaming buffer of the feedback table to be flushed before migrating it",
+    )
+    args = parser.parse_args()
+
+    ensure_bq_resources(migrate=args.migrate, buffer_timeout_s=args.buffer_timeout)
     ensure_gcs_bucket()
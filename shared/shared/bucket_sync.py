@@ -0,0 +1,293 @@
+"""
+Incremental, checksum-verified sync of a bucket prefix into a local directory.
+
+The local copy of a prefix holds a manifest of the blobs it was built from : their
+generation, crc32c and size, as listed by the bucket. A sync lists the prefix once and
+compares it with the manifest :
+- nothing changed : nothing is downloaded, the local copy is left as is
+- else changed blobs are downloaded into a new version directory, unchanged files are
+  hard linked from the current version, large blobs are downloaded in parallel chunks,
+  every file is verified against its crc32c and failed downloads are retried.
+  The local path is a symlink switched atomically to the new version : readers see either
+  the previous or the new files, never a mix of both. The previous version is kept until
+  the next sync, for readers that opened its files before the switch ; older ones are removed.
+
+`GcsBucket` lists and downloads from Google Cloud Storage, `LocalBucket` serves a local
+directory laid out like a bucket, for tests and offline runs ("file://" bucket names).
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".manifest.json"
+VERSIONS_DIRECTORY = ".versions"
+
+
+class BlobInfo(NamedTuple):
+    name: str
+    size: int
+    # base64 of the big-endian crc32c, as reported by GCS
+    crc32c: str
+    generation: str
+
+
+def crc32c(path: str) -> str:
+    """crc32c of a file, in the GCS format"""
+    import google_crc32c
+
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode()
+
+
+class GcsBucket:
+    def __init__(self, project_id: str, bucket_name: str):
+        from shared.gcp_clients import clients
+
+        self.bucket = clients.storage(project_id).bucket(bucket_name)
+
+    def list(self, prefix: str) -> List[BlobInfo]:
+        """Blobs directly under prefix"""
+        return [
+            BlobInfo(blob.name, blob.size, blob.crc32c, str(blob.generation))
+            for blob in self.bucket.list_blobs(prefix=prefix, delimiter="/")
+        ]
+
+    def get(self, name: str) -> Optional[BlobInfo]:
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            return None
+        return BlobInfo(blob.name, blob.size, blob.crc32c, str(blob.generation))
+
+    def download(self, blob: BlobInfo, f, start: int, end: int):
+        """Write bytes [start, end] of the blob generation at the current position of f"""
+        self.bucket.blob(blob.name, generation=int(blob.generation)).download_to_file(
+            f, start=start, end=end, checksum=None
+        )
+
+    def upload(self, path: str, name: str):
+        self.bucket.blob(name).upload_from_filename(path, checksum="crc32c")
+
+
+class LocalBucket:
+    """A local directory served like a bucket : generations are modification times"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def list(self, prefix: str) -> List[BlobInfo]:
+        directory = os.path.join(self.root, prefix)
+        if not os.path.isdir(directory):
+            return []
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        return [self.get(prefix + entry.name) for entry in entries if entry.is_file()]
+
+    def get(self, name: str) -> Optional[BlobInfo]:
+        path = os.path.join(self.root, name)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return BlobInfo(name, stat.st_size, crc32c(path), str(stat.st_mtime_ns))
+
+    def download(self, blob: BlobInfo, f, start: int, end: int):
+        with open(os.path.join(self.root, blob.name), "rb") as source:
+            source.seek(start)
+            f.write(source.read(end - start + 1))
+
+    def upload(self, path: str, name: str):
+        destination = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(path, destination)
+
+
+def open_bucket(project_id: Optional[str], bucket_name: str):
+    """Bucket for a GCS bucket name, or a local directory for "file://<path>" (no project needed)"""
+    if bucket_name.startswith("file://"):
+        return LocalBucket(bucket_name[len("file://"):])
+    if not project_id:
+        raise ValueError("Missing project_id.")
+    return GcsBucket(project_id=project_id, bucket_name=bucket_name)
+
+
+def sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download(
+    bucket,
+    blob: BlobInfo,
+    destination: str,
+    executor: ThreadPoolExecutor,
+    chunk_size: int = 32 * 1024**2,
+    retries: int = 3,
+    expected_sha256: Optional[str] = None,
+):
+    """
+    Download a blob to destination, in parallel chunks on executor if it is larger than chunk_size.
+    The file is verified against the crc32c of the blob, and expected_sha256 if given ;
+    failed or corrupted downloads are retried.
+    """
+    ranges = [
+        (start, min(start + chunk_size, blob.size) - 1)
+        for start in range(0, blob.size, chunk_size)
+    ]
+
+    def fetch(byte_range):
+        with open(destination, "r+b") as f:
+            f.seek(byte_range[0])
+            bucket.download(blob, f, *byte_range)
+
+    last_error: Optional[Exception] = None
+    for attempt in range(1, retries + 1):
+        try:
+            with open(destination, "wb") as f:
+                f.truncate(blob.size)
+            list(executor.map(fetch, ranges))
+            checksum = crc32c(destination)
+            if checksum != blob.crc32c:
+                raise ValueError(f"crc32c mismatch for {blob.name}: {checksum} != {blob.crc32c}")
+            if expected_sha256 is not None and sha256(destination) != expected_sha256:
+                raise ValueError(f"sha256 mismatch for {blob.name}")
+            return
+        except Exception as e:
+            last_error = e
+            logger.warning("Download of %s failed (attempt %d/%d): %s", blob.name, attempt, retries, e)
+    raise RuntimeError(f"Failed to download {blob.name}") from last_error
+
+
+class BucketSync:
+    def __init__(
+        self,
+        bucket,
+        chunk_size: int = 32 * 1024**2,
+        max_workers: int = 8,
+        retries: int = 3,
+    ):
+        """
+        Args:
+            bucket: `GcsBucket` or `LocalBucket`.
+            chunk_size: blobs larger than this are downloaded in parallel chunks of this size.
+            max_workers: parallel downloads.
+            retries: attempts per file before the sync fails.
+        """
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.retries = retries
+
+    @staticmethod
+    def read_manifest(path: str) -> Dict[str, dict]:
+        try:
+            with open(os.path.join(path, MANIFEST_NAME), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _entry(blob: BlobInfo) -> dict:
+        return {"generation": blob.generation, "crc32c": blob.crc32c, "size": blob.size}
+
+    @staticmethod
+    def _is_current(path: str, name: str, entry: dict, manifest: Dict[str, dict]) -> bool:
+        file_path = os.path.join(path, name)
+        return (
+            manifest.get(name) == entry
+            and os.path.isfile(file_path)
+            and os.path.getsize(file_path) == entry["size"]
+        )
+
+    def sync(self, prefix: str, path: str) -> bool:
+        """
+        Make path a verified copy of the blobs directly under prefix.
+        Returns True if files were downloaded, False if the local copy was already current.
+        Raises if the prefix is empty or a file cannot be downloaded : the local copy is then unchanged.
+        """
+        if not prefix.endswith("/"):
+            prefix += "/"
+        blobs = [blob for blob in self.bucket.list(prefix) if blob.name != prefix]
+        if not blobs:
+            raise ValueError(f"No files found under {prefix}")
+
+        remote = {blob.name[len(prefix):]: blob for blob in blobs}
+        expected = {name: self._entry(blob) for name, blob in remote.items()}
+        manifest = self.read_manifest(path)
+        changed = [
+            name for name, entry in expected.items()
+            if not self._is_current(path, name, entry, manifest)
+        ]
+        if not changed and set(manifest) == set(expected):
+            logger.info("%s is up to date (%d files)", path, len(expected))
+            return False
+
+        parent = os.path.dirname(os.path.abspath(path))
+        versions = os.path.join(parent, VERSIONS_DIRECTORY)
+        os.makedirs(versions, exist_ok=True)
+        version = tempfile.mkdtemp(dir=versions, prefix=os.path.basename(path) + ".")
+        try:
+            for name in expected:
+                if name not in changed:
+                    # unchanged : shares the bytes of the current version
+                    self._link(os.path.join(path, name), os.path.join(version, name))
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sync") as executor:
+                for name in changed:
+                    self._download(remote[name], os.path.join(version, name), executor)
+            with open(os.path.join(version, MANIFEST_NAME), "w", encoding="utf-8") as f:
+                json.dump(expected, f, indent=1, sort_keys=True)
+        except BaseException:
+            shutil.rmtree(version, ignore_errors=True)
+            raise
+
+        self._swap(path, version)
+        logger.info("%s synced : %d of %d files downloaded", path, len(changed), len(expected))
+        return True
+
+    @staticmethod
+    def _link(source: str, destination: str):
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy2(source, destination)
+
+    def _download(self, blob: BlobInfo, destination: str, executor: ThreadPoolExecutor):
+        download(
+            bucket=self.bucket,
+            blob=blob,
+            destination=destination,
+            executor=executor,
+            chunk_size=self.chunk_size,
+            retries=self.retries,
+        )
+
+    @staticmethod
+    def _swap(path: str, version: str):
+        """Point path to version atomically, keep the version it replaces and remove the older ones"""
+        previous = os.path.realpath(path) if os.path.islink(path) else None
+        versions = os.path.dirname(version)
+        if os.path.isdir(path) and not os.path.islink(path):
+            # plain directory of an earlier download : moved aside, not swappable atomically
+            legacy = os.path.join(versions, f"{os.path.basename(path)}.legacy.{uuid.uuid4().hex}")
+            os.rename(path, legacy)
+            previous = legacy
+        link = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.symlink(os.path.relpath(version, os.path.dirname(os.path.abspath(path))), link)
+        os.replace(link, path)
+        keep = {os.path.realpath(version), previous}
+        for entry in os.scandir(versions):
+            if entry.name.startswith(os.path.basename(path) + ".") and os.path.realpath(entry.path) not in keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
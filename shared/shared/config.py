@@ -9,11 +9,79 @@ class Config:
     BQ_DATASET_ID = os.getenv("BQ_DATASET_ID", "")
     BQ_TABLE_ID = os.getenv("BQ_TABLE_ID", "")
     GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "")
+    GCS_DOWNLOAD_CHUNK_MB = int(os.getenv("GCS_DOWNLOAD_CHUNK_MB", "32"))
+    GCS_DOWNLOAD_WORKERS = int(os.getenv("GCS_DOWNLOAD_WORKERS", "8"))
+    # shared GCP clients : connections kept alive per host, call timeout and retry deadline
+    GCP_HTTP_POOL_SIZE = int(os.getenv("GCP_HTTP_POOL_SIZE", "16"))
+    GCP_TIMEOUT_S = float(os.getenv("GCP_TIMEOUT_S", "30"))
+    GCP_RETRY_DEADLINE_S = float(os.getenv("GCP_RETRY_DEADLINE_S", "60"))
     LOCAL_DIRECTORY = os.getenv("LOCAL_DIRECTORY", "")
     ADAPTER_NAME = os.getenv("ADAPTER_NAME", "")
+    # adapters served on the same base model with their routing weights, e.g. "adapter=0.9,adapter_v2=0.1"
+    ADAPTERS = os.getenv("ADAPTERS", "")
     MODEL_NAME = os.getenv("MODEL_NAME", "")
+    # content-addressed base model mirrors, see shared.model.model_mirror
+    MODEL_MIRROR_DIRECTORY = os.getenv(
+        "MODEL_MIRROR_DIRECTORY", os.path.join(LOCAL_DIRECTORY, "base_models")
+    )
+    MODEL_MIRROR_BUCKET = os.getenv("MODEL_MIRROR_BUCKET", "")
+    MODEL_MIRROR_PREFIX = os.getenv("MODEL_MIRROR_PREFIX", "base_models")
     GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "")
+    # feedback table : BigQuery (BQ_DATASET_ID.BQ_TABLE_ID), or "file://<path>" for a local JSONL table
+    FEEDBACK_TABLE = os.getenv("FEEDBACK_TABLE", "")
+    FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "500"))
+    FEEDBACK_FLUSH_INTERVAL_S = float(os.getenv("FEEDBACK_FLUSH_INTERVAL_S", "2"))
+    FEEDBACK_MAX_QUEUE = int(os.getenv("FEEDBACK_MAX_QUEUE", "10000"))
+    FEEDBACK_JOURNAL_PATH = os.getenv(
+        "FEEDBACK_JOURNAL_PATH", os.path.join(LOCAL_DIRECTORY, "feedback_journal.jsonl")
+    )
+    # feedback rows rejected by the table for good, with their error
+    FEEDBACK_DEAD_LETTER_PATH = os.getenv(
+        "FEEDBACK_DEAD_LETTER_PATH", os.path.join(LOCAL_DIRECTORY, "feedback_rejected.jsonl")
+    )
+    # local Parquet snapshot of the feedback table, read by training and evaluation
+    FEEDBACK_SNAPSHOT_DIRECTORY = os.getenv(
+        "FEEDBACK_SNAPSHOT_DIRECTORY", os.path.join(LOCAL_DIRECTORY, "feedback_snapshot")
+    )
+    FEEDBACK_SNAPSHOT_LOOKBACK_S = float(os.getenv("FEEDBACK_SNAPSHOT_LOOKBACK_S", str(24 * 3600)))
     MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
+    MLFLOW_SPOOL_DIRECTORY = os.getenv(
+        "MLFLOW_SPOOL_DIRECTORY", os.path.join(LOCAL_DIRECTORY, "mlflow_spool")
+    )
+    MLFLOW_FLUSH_INTERVAL_S = float(os.getenv("MLFLOW_FLUSH_INTERVAL_S", "1"))
+    # the tracking server is retried after a failure with a backoff doubling up to the maximum
+    MLFLOW_RETRY_BACKOFF_S = float(os.getenv("MLFLOW_RETRY_BACKOFF_S", "5"))
+    MLFLOW_MAX_RETRY_BACKOFF_S = float(os.getenv("MLFLOW_MAX_RETRY_BACKOFF_S", "300"))
+    TELEMETRY_SAMPLE_RATE = float(os.getenv("TELEMETRY_SAMPLE_RATE", "1.0"))
+    TELEMETRY_FLUSH_INTERVAL_S = float(os.getenv("TELEMETRY_FLUSH_INTERVAL_S", "60"))
+    TELEMETRY_MLFLOW = os.getenv("TELEMETRY_MLFLOW", "true").lower() == "true"
+    ENERGY_W_PER_CPU_CORE = float(os.getenv("ENERGY_W_PER_CPU_CORE", "10"))
+    ENERGY_SAMPLE_INTERVAL_S = float(os.getenv("ENERGY_SAMPLE_INTERVAL_S", "1"))
+    # idle power of the CPU packages (RAPL), not charged to spans ; learned while no span is open if unset
+    ENERGY_IDLE_W = float(os.getenv("ENERGY_IDLE_W")) if os.getenv("ENERGY_IDLE_W") else None
+    # world average, to be set for the serving region
+    CARBON_INTENSITY_G_PER_KWH = float(os.getenv("CARBON_INTENSITY_G_PER_KWH", "475"))
+    PREDICT_MAX_BATCH_SIZE = int(os.getenv("PREDICT_MAX_BATCH_SIZE", "8"))
+    PREDICT_MAX_WAIT_MS = float(os.getenv("PREDICT_MAX_WAIT_MS", "20"))
+    MODEL_PRECISION = os.getenv("MODEL_PRECISION", "auto")
+    MERGE_ADAPTER = os.getenv("MERGE_ADAPTER", "false").lower() == "true"
+    PRECISION_SELF_CHECK = os.getenv("PRECISION_SELF_CHECK", "false").lower() == "true"
+    # fp32 outputs on the self-check claims, written offline by `python -m shared.model.precision`
+    PRECISION_REFERENCE_DIRECTORY = os.getenv(
+        "PRECISION_REFERENCE_DIRECTORY", os.path.join(LOCAL_DIRECTORY, "precision_reference")
+    )
+    MAX_EXPLANATION_TOKENS = int(os.getenv("MAX_EXPLANATION_TOKENS", "512"))
+    INFERENCE_MAX_CONCURRENCY = int(os.getenv("INFERENCE_MAX_CONCURRENCY", "1"))
+    PREDICTION_CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", str(64 * 1024**2)))
+    PREDICTION_CACHE_TTL_S = float(os.getenv("PREDICTION_CACHE_TTL_S", str(24 * 3600)))
+    PREDICTION_STORE_ENABLED = os.getenv("PREDICTION_STORE_ENABLED", "false").lower() == "true"
+    PREDICTION_STORE_PATH = os.getenv(
+        "PREDICTION_STORE_PATH", os.path.join(LOCAL_DIRECTORY, "predictions.sqlite")
+    )
+    PREDICTION_STORE_MAX_BYTES = int(os.getenv("PREDICTION_STORE_MAX_BYTES", str(1024**3)))
+    NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "false").lower() == "true"
+    NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+    NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "100000"))
 
 def setup_logging():
     logging.basicConfig(
@@ -1,4 +1,4 @@
-# - load from BQ
+# - load from BQ, through the local snapshot of the feedback table
 # - preprocess
 # - train test split
 # - tokenization
@@ -8,6 +8,7 @@ import logging
 from datasets import ClassLabel, Dataset
 
 from shared.config import Config, setup_logging
+from shared.data.feedback_snapshot import load_feedback
 from shared.gcp import Gcp
 
 logger = logging.getLogger(__name__)
@@ -21,9 +22,12 @@ class DataProcessor:
         dataset_id: str,
         table_id: str,
         start_date: str,
+        use_snapshot: bool = True,
     ):
+        # the snapshot only reads the rows added since the previous run, memory-mapped
+        load = load_feedback if use_snapshot else Gcp.load_data_bq
         logger.info("Loading training dataset from bq")
-        self.df = Gcp.load_data_bq(
+        self.df = load(
             project_id=project_id,
             dataset_id=dataset_id,
             table_id=table_id,
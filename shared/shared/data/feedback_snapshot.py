@@ -0,0 +1,276 @@
+"""
+Incremental local Parquet snapshot of the feedback table.
+
+The snapshot is a directory of Parquet parts, each holding the rows of one refresh,
+and a state file with the `created_at` watermark : the latest `created_at` in the
+snapshot. A refresh reads only the rows created after the watermark, through the
+BigQuery Storage read API (no query job, no full table scan), and writes them as a
+new part. Training and evaluation read the parts memory-mapped.
+
+Feedback rows are inserted in the background, some after a delay (batching, journal
+replay) : a refresh also reads back `Config.FEEDBACK_SNAPSHOT_LOOKBACK_S` before the
+watermark and skips the rows already in the snapshot, by their `insert_id` (rows of a
+`/feedback/batch` request share their `created_at`), or for rows inserted before it was
+stored by their values, counting repeats. Rows inserted later than the lookback after
+their `created_at` are not read : the feedback writer logs them, and the snapshot must be
+rebuilt (its directory removed) to include them. Parts are compacted into one once there
+are more than `max_parts`.
+
+Parquet files cannot be appended to in place : each refresh adds a part file, the
+parts together form the snapshot, read as one table.
+"""
+
+import json
+import logging
+import os
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from shared.config import Config
+from shared.utils import parse_timestamp
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = "_state.json"
+COLUMNS = ["created_at", "user_claim", "predicted_category", "correct_category", "assistant_explanation", "insert_id"]
+# columns of the training dataframe, as returned by Gcp.load_data_bq
+RENAMES = {
+    "user_claim": "text",
+    "predicted_category": "label_pred",
+    "correct_category": "label_true",
+    "assistant_explanation": "explanation",
+}
+
+
+class BigQueryStorageReader:
+    """Rows of the feedback table created after a timestamp, read with the BigQuery Storage API"""
+
+    def __init__(self, project_id: str, dataset_id: str, table_id: str, max_streams: int = 4):
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+        self.max_streams = max_streams
+
+    def __call__(self, after: Optional[datetime]) -> pa.Table:
+        from google.cloud import bigquery_storage
+        from google.cloud.bigquery_storage import types
+
+        client = bigquery_storage.BigQueryReadClient()
+        read_options = types.ReadSession.TableReadOptions(selected_fields=COLUMNS)
+        if after is not None:
+            # the watermark is a timestamp of the snapshot, never user input
+            read_options.row_restriction = f'created_at > TIMESTAMP "{after.isoformat()}"'
+        session = client.create_read_session(
+            parent=f"projects/{self.project_id}",
+            read_session=types.ReadSession(
+                table=f"projects/{self.project_id}/datasets/{self.dataset_id}/tables/{self.table_id}",
+                data_format=types.DataFormat.ARROW,
+                read_options=read_options,
+            ),
+            max_stream_count=self.max_streams,
+        )
+        tables = [
+            client.read_rows(stream.name).to_arrow(session)
+            for stream in session.streams
+        ]
+        tables = [table for table in tables if table.num_rows]
+        if not tables:
+            return empty_table()
+        return pa.concat_tables(tables).select(COLUMNS)
+
+
+def empty_table() -> pa.Table:
+    return pa.table({
+        "created_at": pa.array([], pa.timestamp("us", tz="UTC")),
+        "user_claim": pa.array([], pa.string()),
+        "predicted_category": pa.array([], pa.int64()),
+        "correct_category": pa.array([], pa.int64()),
+        "assistant_explanation": pa.array([], pa.string()),
+        "insert_id": pa.array([], pa.string()),
+    })
+
+
+def _row_key(row: dict):
+    """Identity of a row : its insert id, or all its values for rows inserted before it was stored"""
+    if row["insert_id"] is not None:
+        return row["insert_id"]
+    return tuple(row[column] for column in COLUMNS)
+
+
+class FeedbackSnapshot:
+    def __init__(
+        self,
+        directory: str,
+        reader: Callable[[Optional[datetime]], pa.Table],
+        lookback_s: float = 24 * 3600,
+        max_parts: int = 64,
+    ):
+        """
+        Args:
+            directory: directory of the snapshot parts and state.
+            reader: rows of the table created after a timestamp (all rows for None), as an Arrow table.
+            lookback_s: rows created up to this long before the watermark are read again, for late inserts.
+            max_parts: parts are compacted into one above this number.
+        """
+        self.directory = directory
+        self.reader = reader
+        self.lookback_s = lookback_s
+        self.max_parts = max_parts
+
+    # ---- state
+
+    def state(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, STATE_NAME), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"watermark": None, "rows": 0, "parts": [], "next_part": 0, "columns": COLUMNS}
+
+    def _write_state(self, state: dict):
+        tmp_path = os.path.join(self.directory, f".{STATE_NAME}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.directory, STATE_NAME))
+
+    @property
+    def watermark(self) -> Optional[datetime]:
+        watermark = self.state()["watermark"]
+        return datetime.fromisoformat(watermark) if watermark else None
+
+    # ---- refresh
+
+    def refresh(self) -> int:
+        """Append the rows created since the watermark as a new part ; number of new rows"""
+        os.makedirs(self.directory, exist_ok=True)
+        state = self.state()
+        if state["parts"] and state.get("columns") != COLUMNS:
+            # parts written with other columns : read again from the start
+            logger.info("Feedback snapshot columns changed, rebuilding it")
+            self._write_state({"watermark": None, "rows": 0, "parts": [], "next_part": state["next_part"], "columns": COLUMNS})
+            for part in state["parts"]:
+                os.remove(os.path.join(self.directory, part))
+            state = self.state()
+        watermark = self.watermark
+        after = watermark - timedelta(seconds=self.lookback_s) if watermark else None
+        rows = self.reader(after)
+        if after is not None and rows.num_rows:
+            rows = self._new_rows(rows, after)
+        if not rows.num_rows:
+            logger.info("Feedback snapshot up to date (%d rows)", state["rows"])
+            return 0
+
+        rows = rows.select(COLUMNS).cast(empty_table().schema).sort_by("created_at")
+        name = self._write_part(rows, state)
+        latest = pc.max(rows["created_at"]).as_py()
+        if watermark is not None and latest < watermark:
+            latest = watermark
+        state = {
+            "watermark": latest.astimezone(timezone.utc).isoformat(),
+            "rows": state["rows"] + rows.num_rows,
+            "parts": state["parts"] + [name],
+            "next_part": state["next_part"] + 1,
+            "columns": COLUMNS,
+        }
+        # the state is written last : a part not in the state is ignored and overwritten
+        self._write_state(state)
+        logger.info("Feedback snapshot : %d new rows, %d in total", rows.num_rows, state["rows"])
+        if len(state["parts"]) > self.max_parts:
+            self.compact()
+        return rows.num_rows
+
+    def _new_rows(self, rows: pa.Table, after: datetime) -> pa.Table:
+        """Rows not already in the snapshot, among those read back after the lookback start"""
+        existing = self.read(after=after)
+        if not existing.num_rows:
+            return rows
+        # rows without insert id are identical for their values : as many are skipped as the snapshot holds
+        seen = Counter(_row_key(row) for row in existing.select(COLUMNS).to_pylist())
+        keep = []
+        for row in rows.select(COLUMNS).to_pylist():
+            key = _row_key(row)
+            keep.append(seen[key] == 0)
+            if seen[key]:
+                seen[key] -= 1
+        return rows.filter(pa.array(keep, pa.bool_()))
+
+    def _write_part(self, rows: pa.Table, state: dict) -> str:
+        """Write rows as the next part of the state ; its name"""
+        name = f"part-{state['next_part']:08d}.parquet"
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=".parquet")
+        os.close(fd)
+        try:
+            pq.write_table(rows, tmp_path, compression="zstd")
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return name
+
+    def compact(self):
+        """Rewrite the parts as a single one"""
+        state = self.state()
+        name = self._write_part(self.read(), state)
+        self._write_state({**state, "parts": [name], "next_part": state["next_part"] + 1})
+        for part in state["parts"]:
+            os.remove(os.path.join(self.directory, part))
+        logger.info("Feedback snapshot compacted : %d parts into one", len(state["parts"]))
+
+    # ---- read
+
+    def read(self, columns: Optional[List[str]] = None, after: Optional[datetime] = None) -> pa.Table:
+        """Rows of the snapshot, memory-mapped, optionally only those created after a timestamp"""
+        parts = [os.path.join(self.directory, part) for part in self.state()["parts"]]
+        if not parts:
+            table = empty_table()
+            return table.select(columns) if columns else table
+        filters = [("created_at", ">", pa.scalar(after, pa.timestamp("us", tz="UTC")))] if after else None
+        tables = [pq.read_table(part, columns=columns, filters=filters, memory_map=True) for part in parts]
+        return pa.concat_tables(tables)
+
+    def load(self, start_date: Optional[str] = None) -> "pd.DataFrame":
+        """Training dataframe of the snapshot, with the columns of `Gcp.load_data_bq`"""
+        after = parse_timestamp(start_date) if start_date else None
+        df = self.read(after=after).rename_columns(
+            [RENAMES.get(name, name) for name in COLUMNS]
+        ).to_pandas()
+        df = df[["text", "label_pred", "label_true", "explanation", "created_at"]]
+        df["text"] = df["text"].str.strip()
+        return df
+
+
+def feedback_snapshot(project_id: str, dataset_id: str, table_id: str) -> FeedbackSnapshot:
+    """Snapshot of a feedback table under `Config.FEEDBACK_SNAPSHOT_DIRECTORY`"""
+    return FeedbackSnapshot(
+        directory=os.path.join(Config.FEEDBACK_SNAPSHOT_DIRECTORY, f"{project_id}.{dataset_id}.{table_id}"),
+        reader=BigQueryStorageReader(project_id, dataset_id, table_id),
+        lookback_s=Config.FEEDBACK_SNAPSHOT_LOOKBACK_S,
+    )
+
+
+def load_feedback(
+    project_id: str,
+    dataset_id: str,
+    table_id: str,
+    start_date: Optional[str] = None,
+) -> "pd.DataFrame":
+    """
+    Feedback rows for training and evaluation : the local snapshot, refreshed with the
+    rows created since the last refresh. The snapshot is read as is if BigQuery is unreachable.
+    """
+    snapshot = feedback_snapshot(project_id, dataset_id, table_id)
+    try:
+        snapshot.refresh()
+    except Exception as e:
+        if not snapshot.state()["parts"]:
+            raise
+        logger.warning("Feedback snapshot not refreshed, reading it as of %s: %s", snapshot.watermark, e)
+    return snapshot.load(start_date=start_date)
@@ -0,0 +1,219 @@
+"""
+Process-wide energy meter.
+
+A single background sampler per process reads an energy counter : the RAPL package
+counters when they are readable (energy of the whole CPU packages), else an estimate
+from the process CPU time and `Config.ENERGY_W_PER_CPU_CORE`. Energies of the estimate
+are flagged as such (`EnergyMeter.estimated`), they are not measurements.
+
+Work to measure runs inside a span. The counter is also read when a span opens and
+closes, so sequential spans get exactly the energy spent during them. The energy of
+an interval during which several spans are open is split between them by the CPU
+time their threads used in that interval. Callers split the energy of a span
+between the requests it served, e.g. by their share of its CPU time and tokens.
+
+The package counters include the idle draw of the CPUs : spans are only charged the
+energy above an idle baseline, `Config.ENERGY_IDLE_W` or, if unset, the power measured
+over the intervals without open spans (until the first one, spans include idle power).
+The idle energy of the intervals with open spans is reported apart in the meter metrics.
+The CPU time estimate has no idle draw.
+"""
+
+import glob
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from shared.config import Config
+
+logger = logging.getLogger(__name__)
+
+RAPL_GLOB = "/sys/class/powercap/intel-rapl:[0-9]*"
+# intervals without spans shorter than this are too noisy to learn the idle power from
+MIN_IDLE_INTERVAL_S = 0.1
+# time constant of the moving average of the learned idle power
+IDLE_WINDOW_S = 60.0
+
+
+class EnergySpan:
+    """Energy attributed to a unit of work, filled by the meter"""
+
+    def __init__(self, clock_id: Optional[int]):
+        self.clock_id = clock_id
+        self.energy_j = 0.0
+        self.co2_g = 0.0
+        self._cpu_s = self._thread_cpu_s()
+
+    def _thread_cpu_s(self) -> float:
+        if self.clock_id is None:
+            return 0.0
+        try:
+            return time.clock_gettime(self.clock_id)
+        except OSError:
+            return 0.0
+
+    def cpu_delta_s(self) -> float:
+        cpu_s = self._thread_cpu_s()
+        delta, self._cpu_s = cpu_s - self._cpu_s, cpu_s
+        return delta
+
+
+class EnergyMeter:
+    def __init__(
+        self,
+        sample_interval_s: float = 1.0,
+        watts_per_core: float = 10.0,
+        carbon_intensity_g_per_kwh: float = 475.0,
+        rapl_glob: str = RAPL_GLOB,
+        idle_w: Optional[float] = None,
+    ):
+        """
+        Args:
+            sample_interval_s: interval between two readings of the energy counter.
+            watts_per_core: power of a fully busy CPU core, for the CPU time estimate.
+            carbon_intensity_g_per_kwh: grams of CO2 emitted per kWh consumed.
+            rapl_glob: RAPL package domains, the CPU time estimate is used if none is readable.
+            idle_w: idle power of the packages, not charged to spans ; learned without open spans if None.
+        """
+        self.sample_interval_s = sample_interval_s
+        self.watts_per_core = watts_per_core
+        self.carbon_intensity_g_per_kwh = carbon_intensity_g_per_kwh
+        self._rapl = self._rapl_domains(rapl_glob)
+        self.source = "rapl" if self._rapl else "cpu_time"
+        # no power measurement : energies are CPU time times watts_per_core
+        self.estimated = not self._rapl
+        self._learn_idle = idle_w is None and bool(self._rapl)
+        self._idle_learned = False
+        self.idle_w = 0.0 if idle_w is None or not self._rapl else idle_w
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._active: List[EnergySpan] = []
+        self._last_j = self._read_j()
+        self._last_t = time.monotonic()
+        self._totals = {"energy_j": 0.0, "attributed_j": 0.0, "idle_j": 0.0, "spans": 0}
+
+    @staticmethod
+    def _rapl_domains(pattern: str) -> list:
+        """Readable RAPL package counters, as [path, max_range_uj, last_uj, total_uj]"""
+        domains = []
+        for path in sorted(glob.glob(pattern)):
+            # package domains only : intel-rapl:0, not its subdomains intel-rapl:0:0
+            if os.path.basename(path).count(":") != 1:
+                continue
+            try:
+                with open(os.path.join(path, "energy_uj")) as f:
+                    last = int(f.read())
+                with open(os.path.join(path, "max_energy_range_uj")) as f:
+                    max_range = int(f.read())
+            except (OSError, ValueError):
+                continue
+            domains.append([os.path.join(path, "energy_uj"), max_range, last, 0])
+        return domains
+
+    def _read_j(self) -> float:
+        """Cumulative energy counter, in joules"""
+        if not self._rapl:
+            return time.process_time() * self.watts_per_core
+        for domain in self._rapl:
+            with open(domain[0]) as f:
+                value = int(f.read())
+            # the counter wraps around at max_energy_range_uj
+            domain[3] += (value - domain[2]) % (domain[1] + 1)
+            domain[2] = value
+        return sum(domain[3] for domain in self._rapl) / 1e6
+
+    def co2_g(self, energy_j: float) -> float:
+        return energy_j / 3.6e6 * self.carbon_intensity_g_per_kwh
+
+    def _sample(self):
+        """Read the counter and split the energy above the idle power since the last reading between open spans"""
+        now_j = self._read_j()
+        now_t = time.monotonic()
+        delta, self._last_j = now_j - self._last_j, now_j
+        elapsed, self._last_t = now_t - self._last_t, now_t
+        self._totals["energy_j"] += delta
+        if not self._active:
+            if self._learn_idle and elapsed >= MIN_IDLE_INTERVAL_S:
+                # moving average over about IDLE_WINDOW_S of idle time
+                weight = min(1.0, elapsed / IDLE_WINDOW_S) if self._idle_learned else 1.0
+                self.idle_w += weight * (delta / elapsed - self.idle_w)
+                self._idle_learned = True
+            return
+        idle = min(delta, self.idle_w * elapsed)
+        self._totals["idle_j"] += idle
+        delta -= idle
+        cpu = [span.cpu_delta_s() for span in self._active]
+        total_cpu = sum(cpu)
+        for span, span_cpu in zip(self._active, cpu):
+            share = span_cpu / total_cpu if total_cpu > 0 else 1 / len(self._active)
+            span.energy_j += delta * share
+        self._totals["attributed_j"] += delta
+
+    @contextmanager
+    def span(self) -> Iterator[EnergySpan]:
+        """Measure the energy of the enclosed work, run on the current thread"""
+        try:
+            clock_id = time.pthread_getcpuclockid(threading.get_ident())
+        except (AttributeError, OSError):
+            clock_id = None
+        with self._lock:
+            self._sample()
+            span = EnergySpan(clock_id)
+            self._active.append(span)
+        try:
+            yield span
+        finally:
+            with self._lock:
+                self._sample()
+                self._active.remove(span)
+                self._totals["spans"] += 1
+            span.co2_g = self.co2_g(span.energy_j)
+
+    def start(self):
+        """Start the background sampler, once per process"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="energy-meter", daemon=True)
+            self._thread.start()
+        logger.info("Energy meter started (source=%s)", self.source)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.sample_interval_s):
+            with self._lock:
+                self._sample()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            self._sample()
+            totals = dict(self._totals)
+        return {
+            "source": self.source,
+            "estimated": self.estimated,
+            "idle_w": self.idle_w,
+            **totals,
+            "co2_g": self.co2_g(totals["energy_j"]),
+            "attributed_co2_g": self.co2_g(totals["attributed_j"]),
+            "active_spans": len(self._active),
+        }
+
+
+# process-wide energy meter, started by the API and by tracked training runs
+energy_meter = EnergyMeter(
+    sample_interval_s=Config.ENERGY_SAMPLE_INTERVAL_S,
+    watts_per_core=Config.ENERGY_W_PER_CPU_CORE,
+    carbon_intensity_g_per_kwh=Config.CARBON_INTENSITY_G_PER_KWH,
+    idle_w=Config.ENERGY_IDLE_W,
+)
@@ -0,0 +1,124 @@
+"""
+Layout of the BigQuery feedback table : day partitioning on created_at and clustering
+on the categories, and the migration of an existing table to it.
+
+Partitioning an existing table copies it into a new partitioned table, then swaps the
+tables by renaming them. The migration goes through these states, and resumes from the
+one it stopped in when run again :
+1. the live table is not partitioned : it is copied into `<table>_partitioned`, replaced if it exists
+2. the live table is renamed `<table>_unpartitioned` (kept as a backup)
+3. the rows of the backup missing from the copy (inserted after the copy, whatever their
+   created_at) are added to it, by difference on the full row
+4. the copy is renamed to the live table
+
+The feedback ingestion of the API must be paused during the migration : a table with a
+streaming buffer cannot be renamed, and between steps 2 and 4 there is no live table.
+"""
+
+import logging
+import time
+
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+# reads filtered on created_at only scan the days of their window,
+# and rows of a category are stored together
+PARTITIONING = bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY, field="created_at")
+CLUSTERING = ["correct_category", "predicted_category"]
+
+MIGRATED_SUFFIX = "_partitioned"
+BACKUP_SUFFIX = "_unpartitioned"
+
+
+def is_partitioned(table) -> bool:
+    partitioning = table.time_partitioning
+    return partitioning is not None and partitioning.field == PARTITIONING.field and partitioning.type_ == PARTITIONING.type_
+
+
+def table_exists(bq_client, table_ref: str) -> bool:
+    try:
+        bq_client.get_table(table_ref)
+        return True
+    except NotFound:
+        return False
+
+
+def migration_pending(bq_client, table_ref: str) -> bool:
+    """A migration stopped after the live table was renamed : there is no live table until it is resumed"""
+    return table_exists(bq_client, table_ref + MIGRATED_SUFFIX) and table_exists(bq_client, table_ref + BACKUP_SUFFIX)
+
+
+def wait_streaming_buffer(bq_client, table_ref: str, timeout_s: float = 0, poll_s: float = 60):
+    """
+    Wait until the table has no streaming buffer, up to timeout_s : a table with
+    rows in its streaming buffer cannot be renamed. Raises RuntimeError on timeout.
+    """
+    deadline = time.monotonic() + timeout_s
+    while True:
+        table = bq_client.get_table(table_ref)
+        if table.streaming_buffer is None:
+            return table
+        if time.monotonic() >= deadline:
+            raise RuntimeError(
+                f"Table {table_ref} has a streaming buffer ({table.streaming_buffer.estimated_rows} rows), "
+                "pause the feedback ingestion and retry once it is flushed (up to 90 minutes)."
+            )
+        logger.info("Waiting for the streaming buffer of %s to be flushed", table_ref)
+        time.sleep(poll_s)
+
+
+def migrate_feedback_table(bq_client, table_ref: str, buffer_timeout_s: float = 0):
+    """
+    Migrate the feedback table table_ref ("project.dataset.table") to day partitioning on
+    created_at and clustering, resuming a migration that stopped midway.
+    - clustering only : updated in place
+    - partitioning : copied, swapped and completed as described in the module docstring ;
+      waits up to buffer_timeout_s for the streaming buffer to be flushed, fails otherwise
+    """
+    table_id = table_ref.rsplit(".", 1)[1]
+    migrated_ref = table_ref + MIGRATED_SUFFIX
+    backup_ref = table_ref + BACKUP_SUFFIX
+
+    if not migration_pending(bq_client, table_ref):
+        table = bq_client.get_table(table_ref)
+        if is_partitioned(table):
+            if table.clustering_fields != CLUSTERING:
+                table.clustering_fields = CLUSTERING
+                bq_client.update_table(table, ["clustering_fields"])
+                logger.info("Table %s clustered on %s", table_ref, ", ".join(CLUSTERING))
+            return
+
+        wait_streaming_buffer(bq_client, table_ref, timeout_s=buffer_timeout_s)
+        bq_client.query(
+            f"""
+            CREATE OR REPLACE TABLE `{migrated_ref}`
+            PARTITION BY DATE(created_at)
+            CLUSTER BY {", ".join(CLUSTERING)}
+            AS SELECT * FROM `{table_ref}`
+            """
+        ).result()
+        # rows streamed during the copy must be flushed before the rename
+        wait_streaming_buffer(bq_client, table_ref, timeout_s=buffer_timeout_s)
+        bq_client.query(f"ALTER TABLE `{table_ref}` RENAME TO `{table_id}{BACKUP_SUFFIX}`").result()
+    else:
+        logger.info("Resuming the migration of %s", table_ref)
+
+    # rows of the backup missing from the copy : inserted after it, or replayed late with an older created_at
+    delta = bq_client.query(
+        f"""
+        INSERT INTO `{migrated_ref}`
+        SELECT * FROM `{backup_ref}`
+        EXCEPT DISTINCT
+        SELECT * FROM `{migrated_ref}`
+        """
+    )
+    delta.result()
+    bq_client.query(f"ALTER TABLE `{migrated_ref}` RENAME TO `{table_id}`").result()
+    logger.info(
+        "Table %s migrated to a partitioned table (%d rows copied after the copy), previous table kept as %s",
+        table_ref,
+        delta.num_dml_affected_rows or 0,
+        backup_ref,
+    )
@@ -1,18 +1,32 @@
 import logging
 import os
 from datetime import datetime, timezone
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-import pandas as pd
-from google.cloud import bigquery, storage
-from google.cloud.exceptions import GoogleCloudError
-from google.cloud.storage import transfer_manager
+from google.cloud import bigquery
+from google.cloud.exceptions import GoogleCloudError, NotFound
 
 from shared import pydantic_models, utils
+from shared.bucket_sync import BucketSync, open_bucket
+from shared.config import Config
+from shared.gcp_clients import clients
+
+# pandas is only needed to load training data, not on the serving path
+if TYPE_CHECKING:
+    import pandas as pd
 
 logger = logging.getLogger(__name__)
 
 
+class RowsRejectedError(Exception):
+    """Rows rejected by the table for good (invalid, too large) : retrying them cannot succeed"""
+
+    def __init__(self, rejected: Dict[int, str]):
+        """rejected : error of each rejected row, by index in the inserted rows"""
+        super().__init__(f"{len(rejected)} rows rejected: {rejected}")
+        self.rejected = rejected
+
+
 class Gcp:
     @staticmethod
     def load_adapter_gcs(
@@ -22,16 +36,19 @@ class Gcp:
         local_directory: str,
     ) -> Optional[str]:
         """
-        Downloads adapter files from a specified GCS bucket to a specified local directory.
+        Syncs adapter files from a specified GCS bucket to local_directory/adapter_name.
+        Only files whose generation or crc32c changed since the last sync are downloaded,
+        verified, and swapped in atomically : a sync without changes is a single listing.
 
         Args:
             project_id (str): Google Cloud project ID.
-            bucket_name (str): Name of the GCS bucket.
+            bucket_name (str): Name of the GCS bucket, or "file://<path>" for a local directory.
             adapter_name (str): Prefix name of the adapter folder in GCS.
             local_directory (str): Local directory path where files will be saved.
 
         Returns:
-            Optional[str]: The local directory path if the download succeeds, else None.
+            Optional[str]: The local directory path if the sync succeeds, else None
+            (the previous local copy, if any, is left unchanged).
 
         Raises:
             GoogleCloudError: If a GCS-related error occurs.
@@ -41,41 +58,25 @@ class Gcp:
             logger.info("📍 load_adapter_gcs")
 
             utils.validate_required_fields(
-                project_id=project_id,
                 bucket_name=bucket_name,
                 adapter_name=adapter_name,
                 local_directory=local_directory,
             )
 
-            client = storage.Client(project=project_id)
-            logger.info("connected to client : %s", client.project)
+            bucket = open_bucket(project_id=project_id, bucket_name=bucket_name)
+            logger.info("connected to bucket : %s", bucket_name)
 
-            bucket = client.bucket(bucket_name)
-            logger.info("connected to bucket : %s", bucket.name)
-
-            prefix = adapter_name + "/"
-            logger.info(f"Looking with prefix : {prefix}")
-            blobs = list(bucket.list_blobs(prefix=prefix, delimiter="/"))
-            logger.info(f"Number of blobs found: {len(blobs)}")
-            if not blobs:
-                raise ValueError("No files found")
-
-            blob_names = [
-                blob.name for blob in blobs if blob.name.startswith(f"{adapter_name}/")
-            ]
-            results = transfer_manager.download_many_to_path(
-                bucket, blob_names, destination_directory=local_directory
+            sync = BucketSync(
+                bucket=bucket,
+                chunk_size=Config.GCS_DOWNLOAD_CHUNK_MB * 1024**2,
+                max_workers=Config.GCS_DOWNLOAD_WORKERS,
             )
-
-            for name, result in zip(blob_names, results):
-                if isinstance(result, Exception):
-                    logger.error(
-                        "Failed to download %s due to exception: %s", name, result
-                    )
-                else:
-                    logger.info("Downloaded %s.", os.path.join(local_directory, name))
-
-            logger.info("✅ Adapter downloaded successfully from GCS.")
+            os.makedirs(local_directory, exist_ok=True)
+            changed = sync.sync(
+                prefix=adapter_name + "/",
+                path=os.path.join(local_directory, adapter_name),
+            )
+            logger.info("✅ Adapter downloaded successfully from GCS." if changed else "✅ Adapter already up to date.")
             return local_directory
 
         except GoogleCloudError as e:
@@ -91,15 +92,19 @@ class Gcp:
         dataset_id: str,
         table_id: str,
         start_date: Optional[str] = None,
-    ) -> pd.DataFrame:
+        end_date: Optional[str] = None,
+    ) -> "pd.DataFrame":
         """
         Loads data from a BigQuery table into a pandas DataFrame.
+        The window is passed as query parameters on created_at : on the partitioned
+        feedback table only the partitions of the window are scanned.
 
         Args:
             project_id (str): Google Cloud project ID.
             dataset_id (str): BigQuery dataset ID.
             table_id (str): BigQuery table ID.
-            start_date (Optional[str]): If provided, filters rows with a timestamp after this date.
+            start_date (Optional[str]): If provided, filters rows created after this date (ISO format).
+            end_date (Optional[str]): If provided, filters rows created up to this date (ISO format).
 
         Returns:
             pd.DataFrame: DataFrame containing the queried rows with following fields:
@@ -118,13 +123,21 @@ class Gcp:
                 table_id=table_id,
                 optional={
                     "start_date": start_date,
+                    "end_date": end_date,
                 },
             )
 
-            client = bigquery.Client(project=project_id)
+            client = clients.bigquery(project_id)
             logger.info(f"BigQuery table : {project_id}.{dataset_id}.{table_id}")
 
-            where_clause = f"WHERE timestamp > '{start_date}'" if start_date else ""
+            conditions, parameters = [], []
+            for name, value, operator in (("start_date", start_date, ">"), ("end_date", end_date, "<=")):
+                if value:
+                    conditions.append(f"created_at {operator} @{name}")
+                    parameters.append(
+                        bigquery.ScalarQueryParameter(name, "TIMESTAMP", utils.parse_timestamp(value))
+                    )
+            where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
             query = f"""
             SELECT 
                 user_claim as text,
@@ -132,11 +145,18 @@ class Gcp:
                 correct_category as label_true,
                 assistant_explanation as explanation,
                 created_at
-            FROM `{dataset_id}.{table_id}`
+            FROM `{project_id}.{dataset_id}.{table_id}`
             {where_clause}
             """
 
-            df = client.query(query).to_dataframe()
+            job = client.query(
+                query,
+                job_config=bigquery.QueryJobConfig(query_parameters=parameters),
+                retry=clients.retry,
+                timeout=clients.timeout_s,
+            )
+            df = job.to_dataframe()
+            logger.info(f"Bytes billed : {job.total_bytes_billed}")
             df["text"] = df["text"].str.strip()
 
             logger.info(f"✅ Query successful, df shape {df.shape}")
@@ -203,19 +223,13 @@ class Gcp:
 
             validated_row = pydantic_models.FeedbackInsertionBQ(**row_data)
 
-            client = bigquery.Client(project=project_id)
-            table_ref = client.dataset(dataset_id).table(table_id)
-            table = client.get_table(table_ref)
-            logger.info("BigQuery table : %s", table)
-
-            errors = client.insert_rows_json(
-                table, [validated_row.model_dump(mode="json")]
+            Gcp.insert_feedback_rows_bq(
+                project_id=project_id,
+                dataset_id=dataset_id,
+                table_id=table_id,
+                rows=[validated_row.model_dump(mode="json")],
             )
 
-            if errors:
-                logger.error(f"BigQuery insertion failed: {errors}")
-                raise Exception(f"BigQuery insertion failed: {errors}")
-
             logger.info(
                 f"✅ BigQuery insertion succeeded: {validated_row.model_dump()}"
             )
@@ -229,6 +243,52 @@ class Gcp:
             raise
 
 
+    @staticmethod
+    def insert_feedback_rows_bq(
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        rows: List[dict],
+        row_ids: Optional[List[str]] = None,
+    ):
+        """
+        Inserts validated feedback rows into a BigQuery table with a single streaming insert,
+        with the shared client and the cached table metadata : one API call per batch.
+
+        Args:
+            project_id (str): Google Cloud project ID.
+            dataset_id (str): BigQuery dataset ID.
+            table_id (str): BigQuery table ID.
+            rows (List[dict]): JSON rows, validated with `FeedbackInsertionBQ`.
+            row_ids (Optional[List[str]]): Insert ids, for the best-effort dedup of BigQuery (rows retried within about a minute).
+
+        Raises:
+            GoogleCloudError: If a BigQuery-related error occurs.
+            RowsRejectedError: If rows are invalid ; the other rows of the call are not inserted.
+        """
+        table = clients.table(project_id, dataset_id, table_id)
+        try:
+            errors = clients.bigquery(project_id).insert_rows_json(
+                table, rows, row_ids=row_ids, retry=clients.retry, timeout=clients.timeout_s
+            )
+        except NotFound:
+            # table recreated : its metadata is fetched again on the next call
+            clients.invalidate_table(project_id, dataset_id, table_id)
+            raise
+
+        if errors:
+            logger.error(f"BigQuery insertion failed: {errors}")
+            # valid rows of a request with invalid ones are reported as "stopped"
+            rejected = {
+                error["index"]: str(error["errors"])
+                for error in errors
+                if any(e.get("reason") != "stopped" for e in error["errors"])
+            }
+            if rejected:
+                raise RowsRejectedError(rejected)
+            raise Exception(f"BigQuery insertion failed: {errors}")
+
+
 def test_gcp_pipeline(config: object):
     Gcp.load_data_bq(
         project_id=config.GCP_PROJECT_ID,
@@ -0,0 +1,144 @@
+"""
+Long-lived GCP clients, shared by the whole process.
+
+Building a `bigquery.Client` or a `storage.Client` resolves credentials and opens a
+new HTTP session : the registry builds one client per kind and project, on first
+use, and every caller reuses it (the clients are thread-safe). Their sessions keep
+up to `Config.GCP_HTTP_POOL_SIZE` connections per host alive, so concurrent calls
+do not open new TLS connections.
+
+Table metadata is fetched once per table and cached : a feedback insert is then a
+single API call. Calls use the retry and timeout policy of the registry
+(`Config.GCP_RETRY_DEADLINE_S`, `Config.GCP_TIMEOUT_S`).
+
+Tests substitute fakes with `clients.override(kind, factory)`.
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, Tuple
+
+from shared.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    def __init__(
+        self,
+        pool_size: int = 16,
+        timeout_s: float = 30.0,
+        retry_deadline_s: float = 60.0,
+        retry=None,
+    ):
+        """
+        Args:
+            pool_size: HTTP connections kept alive per host, per client.
+            timeout_s: timeout of a single API call.
+            retry_deadline_s: total time spent retrying a call on transient errors.
+            retry: retry policy, `bigquery.DEFAULT_RETRY` with retry_deadline_s if None.
+        """
+        self.pool_size = pool_size
+        self.timeout_s = timeout_s
+        self.retry_deadline_s = retry_deadline_s
+        self._lock = threading.Lock()
+        self._factories: Dict[str, Callable[[str], object]] = {
+            "bigquery": self._bigquery_client,
+            "storage": self._storage_client,
+        }
+        self._clients: Dict[Tuple[str, str], object] = {}
+        self._tables: Dict[Tuple[str, str, str], object] = {}
+        self._retry = retry
+
+    # ---- clients
+
+    def _session(self):
+        """Authorized HTTP session with a connection pool of pool_size"""
+        import google.auth
+        import requests
+        from google.auth.transport.requests import AuthorizedSession
+
+        credentials, _ = google.auth.default()
+        session = AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        return session
+
+    def _bigquery_client(self, project_id: str):
+        from google.cloud import bigquery
+
+        return bigquery.Client(project=project_id, _http=self._session())
+
+    def _storage_client(self, project_id: str):
+        from google.cloud import storage
+
+        return storage.Client(project=project_id, _http=self._session())
+
+    def get(self, kind: str, project_id: str):
+        """The client of kind ("bigquery" or "storage") for the project, built on first use"""
+        key = (kind, project_id)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    logger.info("Creating %s client for project %s", kind, project_id)
+                    client = self._factories[kind](project_id)
+                    self._clients[key] = client
+        return client
+
+    def bigquery(self, project_id: str):
+        return self.get("bigquery", project_id)
+
+    def storage(self, project_id: str):
+        return self.get("storage", project_id)
+
+    def override(self, kind: str, factory: Callable[[str], object]):
+        """Build the clients of kind with factory(project_id), e.g. fakes in tests ; drops the cached ones"""
+        with self._lock:
+            self._factories[kind] = factory
+            self._clients = {key: client for key, client in self._clients.items() if key[0] != kind}
+            self._tables.clear()
+
+    def reset(self):
+        """Drop the cached clients and tables, restore the default factories"""
+        with self._lock:
+            self._factories.update(bigquery=self._bigquery_client, storage=self._storage_client)
+            self._clients.clear()
+            self._tables.clear()
+
+    # ---- tables
+
+    def table(self, project_id: str, dataset_id: str, table_id: str):
+        """BigQuery table with its schema, fetched once"""
+        key = (project_id, dataset_id, table_id)
+        table = self._tables.get(key)
+        if table is None:
+            table = self.bigquery(project_id).get_table(
+                f"{project_id}.{dataset_id}.{table_id}", retry=self.retry, timeout=self.timeout_s
+            )
+            self._tables[key] = table
+        return table
+
+    def invalidate_table(self, project_id: str, dataset_id: str, table_id: str):
+        """Fetch the table metadata again on next use, e.g. after a schema change"""
+        self._tables.pop((project_id, dataset_id, table_id), None)
+
+    # ---- policy
+
+    @property
+    def retry(self):
+        """Retry of transient API errors, up to retry_deadline_s"""
+        if self._retry is None:
+            from google.cloud.bigquery import DEFAULT_RETRY
+
+            self._retry = DEFAULT_RETRY.with_deadline(self.retry_deadline_s)
+        return self._retry
+
+
+# process-wide registry
+clients = ClientRegistry(
+    pool_size=Config.GCP_HTTP_POOL_SIZE,
+    timeout_s=Config.GCP_TIMEOUT_S,
+    retry_deadline_s=Config.GCP_RETRY_DEADLINE_S,
+)
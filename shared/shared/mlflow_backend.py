@@ -0,0 +1,321 @@
+"""
+Asynchronous, batched MLflow logging backend.
+
+Callers get a run handle immediately and log params / metrics into a queue : a
+background thread resolves experiment ids once, groups the queued records per run
+and sends them with `log_batch` calls (at most 1000 metrics and 100 params each,
+the MLflow limits). When the tracking server is unreachable the pending operations
+are appended to a local JSONL spool, replayed in order once the server answers again,
+including from a later process. After a failure the server is left alone for a backoff,
+doubling with each further failure : operations queued meanwhile go straight to the spool.
+
+The backend talks to a small client interface (`experiment_id`, `create_run`,
+`log_batch`, `set_terminated`) : `MlflowTrackingClient` wraps `mlflow.MlflowClient`,
+tests use a local-file stand-in.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from shared.config import Config
+
+logger = logging.getLogger(__name__)
+
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_PARAM_LENGTH = 6000
+
+
+class MlflowTrackingClient:
+    """The subset of `mlflow.MlflowClient` used by the backend, with plain python records"""
+
+    def __init__(self, tracking_uri: str):
+        import mlflow
+
+        self.client = mlflow.MlflowClient(tracking_uri=tracking_uri)
+
+    def experiment_id(self, name: str) -> str:
+        experiment = self.client.get_experiment_by_name(name)
+        if experiment is not None:
+            return experiment.experiment_id
+        return self.client.create_experiment(name)
+
+    def create_run(self, experiment_id: str, run_name: Optional[str] = None) -> str:
+        return self.client.create_run(experiment_id, run_name=run_name).info.run_id
+
+    def log_batch(self, run_id: str, metrics: list, params: dict):
+        from mlflow.entities import Metric, Param
+
+        self.client.log_batch(
+            run_id,
+            metrics=[Metric(m["key"], m["value"], m["timestamp"], m["step"]) for m in metrics],
+            params=[Param(key, value) for key, value in params.items()],
+        )
+
+    def set_terminated(self, run_id: str, status: str = "FINISHED"):
+        self.client.set_terminated(run_id, status=status)
+
+
+class MlflowLoggingBackend:
+    def __init__(
+        self,
+        client_factory: Callable[[], object],
+        spool_directory: str,
+        flush_interval_s: float = 1.0,
+        retry_backoff_s: float = 5.0,
+        max_retry_backoff_s: float = 300.0,
+    ):
+        """
+        Args:
+            client_factory: builds the tracking client, called lazily from the first operation.
+            spool_directory: directory of the spool of operations not sent yet.
+            flush_interval_s: maximum delay before queued records are sent.
+            retry_backoff_s: delay before the server is retried after a failure, doubled on each further failure.
+            max_retry_backoff_s: maximum delay between retries.
+        """
+        self.client_factory = client_factory
+        self.spool_path = os.path.join(spool_directory, "spool.jsonl")
+        self.flush_interval_s = flush_interval_s
+        self.retry_backoff_s = retry_backoff_s
+        self.max_retry_backoff_s = max_retry_backoff_s
+        self._backoff_s = 0.0
+        self._retry_at = 0.0
+        self._client = None
+        self._experiment_ids: Dict[str, str] = {}
+        self._run_ids: Dict[str, str] = {}
+        # notified when a run is created on the server
+        self._created = threading.Condition()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        self._counters = {"batches": 0, "spooled": 0, "replayed": 0, "errors": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    # ---- caller side
+
+    def experiment_id(self, name: str) -> str:
+        """Experiment id, resolved (and created if needed) once per process ; raises if unreachable"""
+        with self._lock:
+            if name not in self._experiment_ids:
+                self._experiment_ids[name] = self.client.experiment_id(name)
+            return self._experiment_ids[name]
+
+    def create_run(self, experiment_name: str, run_name: Optional[str] = None) -> str:
+        """Handle of a new run, created on the server by the background thread"""
+        handle = f"local-{uuid.uuid4().hex}"
+        self._put({"op": "create_run", "handle": handle, "experiment_name": experiment_name, "run_name": run_name})
+        return handle
+
+    def attach_run(self, run_id: str) -> str:
+        """Handle of a run already created on the server"""
+        self._run_ids[run_id] = run_id
+        return run_id
+
+    def run_id(self, handle: str, timeout: Optional[float] = None) -> Optional[str]:
+        """Server id of the run of handle, waiting up to timeout for its creation ; None if not created"""
+        with self._created:
+            self._created.wait_for(lambda: handle in self._run_ids, timeout)
+            return self._run_ids.get(handle)
+
+    def log_params(self, handle: str, params: dict):
+        params = {key: str(value)[:MAX_PARAM_LENGTH] for key, value in params.items()}
+        self._put({"op": "log", "handle": handle, "metrics": [], "params": params})
+
+    def log_metrics(self, handle: str, metrics: dict, step: int = 0):
+        timestamp = int(time.time() * 1000)
+        records = [
+            {"key": key, "value": float(value), "timestamp": timestamp, "step": step}
+            for key, value in metrics.items()
+        ]
+        self._put({"op": "log", "handle": handle, "metrics": records, "params": {}})
+
+    def end_run(self, handle: str, status: str = "FINISHED"):
+        self._put({"op": "end_run", "handle": handle, "status": status})
+
+    def flush(self, timeout: Optional[float] = None):
+        """Wait until every queued operation is sent or spooled"""
+        if self._thread is None:
+            self._process(self._drain())
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Send or spool the queued operations and stop the background thread"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def metrics(self) -> dict:
+        return {**self._counters, "queued": self._queue.qsize(), "spool": os.path.exists(self.spool_path)}
+
+    def _put(self, op: dict):
+        self._queue.put(op)
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="mlflow-logging", daemon=True)
+                    self._thread.start()
+
+    # ---- background thread
+
+    def _drain(self) -> list:
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval_s)
+            except queue.Empty:
+                if os.path.exists(self.spool_path):
+                    self._process([])
+                continue
+            # let concurrent callers fill the batch
+            time.sleep(min(self.flush_interval_s, 0.05))
+            items = [first] + self._drain()
+            ops = [item for item in items if isinstance(item, dict)]
+            self._process(ops)
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in items:
+                return
+
+    def _process(self, ops: list):
+        if time.monotonic() < self._retry_at:
+            # the server failed recently : not retried before the end of the backoff
+            self._spool(ops)
+            return
+        if os.path.exists(self.spool_path) and not self._replay():
+            self._spool(ops)
+            self._failed()
+            return
+        sent = self._send(ops)
+        if sent < len(ops):
+            self._spool(ops[sent:])
+            self._failed()
+        else:
+            self._backoff_s = 0.0
+
+    def _failed(self):
+        self._backoff_s = min(self.max_retry_backoff_s, self._backoff_s * 2 or self.retry_backoff_s)
+        self._retry_at = time.monotonic() + self._backoff_s
+        logger.info("MLflow server retried in %.0fs", self._backoff_s)
+
+    def _replay(self) -> bool:
+        """Send the spooled operations, True when the spool is empty afterwards"""
+        with open(self.spool_path, encoding="utf-8") as f:
+            ops = [json.loads(line) for line in f if line.strip()]
+        sent = self._send(ops)
+        self._counters["replayed"] += sent
+        if sent == len(ops):
+            os.remove(self.spool_path)
+            logger.info("MLflow spool replayed: %d operations", sent)
+            return True
+        tmp_path = self.spool_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for op in ops[sent:]:
+                f.write(json.dumps(op) + "\n")
+        os.replace(tmp_path, self.spool_path)
+        return False
+
+    def _spool(self, ops: list):
+        if not ops:
+            return
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        with open(self.spool_path, "a", encoding="utf-8") as f:
+            for op in ops:
+                # operations on runs known to the server survive a restart of the process
+                run_id = self._run_ids.get(op["handle"])
+                if run_id is not None:
+                    op = {**op, "handle": run_id}
+                f.write(json.dumps(op) + "\n")
+        self._counters["spooled"] += len(ops)
+        logger.warning("MLflow unreachable, %d operations spooled to %s", len(ops), self.spool_path)
+
+    def _send(self, ops: list) -> int:
+        """Send ops in order, merging consecutive logs of a run ; number of ops sent"""
+        i = 0
+        try:
+            while i < len(ops):
+                op = ops[i]
+                if op["op"] == "create_run":
+                    experiment_id = self.experiment_id(op["experiment_name"])
+                    run_id = self.client.create_run(experiment_id, run_name=op["run_name"])
+                    with self._created:
+                        self._run_ids[op["handle"]] = run_id
+                        self._created.notify_all()
+                    i += 1
+                elif op["op"] == "end_run":
+                    self.client.set_terminated(self._run_id(op["handle"]), status=op["status"])
+                    i += 1
+                else:
+                    j = i
+                    metrics, params = [], {}
+                    while j < len(ops) and ops[j]["op"] == "log" and ops[j]["handle"] == op["handle"]:
+                        metrics.extend(ops[j]["metrics"])
+                        params.update(ops[j]["params"])
+                        j += 1
+                    self._log_batch(self._run_id(op["handle"]), metrics, params)
+                    i = j
+        except Exception as e:
+            self._counters["errors"] += 1
+            logger.warning("MLflow logging failed: %s", e)
+        return i
+
+    def _run_id(self, handle: str) -> str:
+        # handles of runs created on the server by a previous process are their run ids
+        return self._run_ids.get(handle, handle)
+
+    def _log_batch(self, run_id: str, metrics: list, params: dict):
+        params = list(params.items())
+        while metrics or params:
+            self.client.log_batch(
+                run_id,
+                metrics=metrics[:MAX_METRICS_PER_BATCH],
+                params=dict(params[:MAX_PARAMS_PER_BATCH]),
+            )
+            self._counters["batches"] += 1
+            metrics = metrics[MAX_METRICS_PER_BATCH:]
+            params = params[MAX_PARAMS_PER_BATCH:]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> MlflowLoggingBackend:
+    """Process-wide backend logging to `Config.MLFLOW_TRACKING_URI`"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = MlflowLoggingBackend(
+                client_factory=lambda: MlflowTrackingClient(Config.MLFLOW_TRACKING_URI),
+                spool_directory=Config.MLFLOW_SPOOL_DIRECTORY,
+                flush_interval_s=Config.MLFLOW_FLUSH_INTERVAL_S,
+                retry_backoff_s=Config.MLFLOW_RETRY_BACKOFF_S,
+                max_retry_backoff_s=Config.MLFLOW_MAX_RETRY_BACKOFF_S,
+            )
+            atexit.register(_backend.close)
+        return _backend
@@ -1,11 +1,13 @@
 import functools
 import logging
 import os
-
-import mlflow
-from codecarbon import EmissionsTracker
+import threading
+import time
+from typing import Optional
 
 from shared.config import Config, setup_logging
+from shared.energy import energy_meter
+from shared.mlflow_backend import get_backend
 
 logger = logging.getLogger(__name__)
 
@@ -14,74 +16,101 @@ os.environ["MLFLOW_HTTP_REQUEST_TIMEOUT"] = "30"
 os.environ["MLFLOW_HTTP_REQUEST_MAX_RETRIES"] = "3"
 
 
+# handles of the runs of the tracked functions running in each thread, innermost last
+_local = threading.local()
+
+
+def active_run_handle() -> Optional[str]:
+    """Backend handle of the run of the innermost tracked function running in this thread"""
+    handles = getattr(_local, "handles", None)
+    return handles[-1] if handles else None
+
+
 def mlflow_track(experiment_name: str = "default"):
     """
     Decorator to track a function in an MLflow run.
-    Automatically logs params and metrics
-    Additionally logs execution time and carbon emissions.
+    Logs execution time, energy and carbon emissions, measured by the
+    process-wide energy meter.
+
+    The run is created, and its metrics sent, by the logging backend from its background
+    thread : the function never waits for the tracking server. If the server is unreachable
+    the run is spooled to disk and sent later, and the server is retried with a backoff.
+    Frameworks are not autologged : autologging opens MLflow runs synchronously.
+    Usable as `@mlflow_track` or `@mlflow_track(experiment_name=...)`.
     """
+    if callable(experiment_name):
+        return mlflow_track()(experiment_name)
 
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            backend = get_backend()
+            handle = backend.create_run(experiment_name, run_name=func.__name__)
+            logger.info("Experiment %s, run %s", experiment_name, func.__name__)
+            if not hasattr(_local, "handles"):
+                _local.handles = []
+            _local.handles.append(handle)
+
+            status = "FAILED"
             try:
-                mlflow.set_tracking_uri(Config.MLFLOW_TRACKING_URI)
-                logger.info("Connected to %s", Config.MLFLOW_TRACKING_URI)
-
-                logger.info("creds %s", Config.GOOGLE_APPLICATION_CREDENTIALS)
-
-                mlflow.set_experiment(experiment_name)
-                logger.info("Experiment %s", experiment_name)
-
-                with mlflow.start_run() as run:
-                    logger.info("Run name %s", run.info._run_name)
-
-                    mlflow.autolog()
-
-                    tracker = EmissionsTracker(
-                        project_name="frugalai",
-                        measure_power_secs=1,
-                        save_to_file=False,
-                        log_level='error'
-                    )
-                    tracker.start()
+                energy_meter.start()
+                start = time.perf_counter()
+                with energy_meter.span() as span:
                     _result = func(*args, **kwargs)
-                    tracker.stop()
-
-                    for key, value in vars(tracker.final_emissions_data).items():
-                        if isinstance(value, (int, float)):
-                            mlflow.log_metric(f"codecarbon_{key}", value)
-                        else:
-                            mlflow.log_param(f"codecarbon_{key}", value)
-
-                    mlflow.log_metric("duration", tracker.final_emissions_data.duration)
 
-                    return _result
+                backend.log_metrics(handle, {
+                    "duration": time.perf_counter() - start,
+                    "energy_j": span.energy_j,
+                    "emissions_g": span.co2_g,
+                })
+                backend.log_params(handle, {
+                    "energy_source": energy_meter.source,
+                    "energy_estimated": energy_meter.estimated,
+                    "carbon_intensity_g_per_kwh": energy_meter.carbon_intensity_g_per_kwh,
+                })
+                status = "FINISHED"
+                return _result
 
             except Exception as e:
-                logger.error("MLflow tracking failed for %s : %s", func.__name__, e)
+                logger.error("MLflow tracked function %s failed : %s", func.__name__, e)
                 raise
 
+            finally:
+                _local.handles.pop()
+                backend.end_run(handle, status=status)
+
         return wrapper
 
     return decorator
 
 
-def mlflow_log_model(model, name: str, registered_model_name: str = None):
+def mlflow_log_model(model, name: str, registered_model_name: str = None, timeout_s: float = 30):
     """
-    Log a PyTorch model (e.g., LLM adapter) to MLflow.
+    Log a PyTorch model (e.g., LLM adapter) to MLflow, in the run of the tracked function
+    calling it. Waits up to timeout_s for the run to be created on the tracking server :
+    the model is not logged if it is unreachable.
     """
+    import mlflow
+    import mlflow.sklearn
+
     try:
-        # mlflow.set_tracking_uri(Config.MLFLOW_TRACKING_URI)
-        # logger.info("Connected to %s", Config.MLFLOW_TRACKING_URI)
+        handle = active_run_handle()
+        if handle is None:
+            raise RuntimeError("not called from a function tracked with mlflow_track")
+        run_id = get_backend().run_id(handle, timeout=timeout_s)
+        if run_id is None:
+            raise RuntimeError(f"run not created on {Config.MLFLOW_TRACKING_URI} within {timeout_s}s")
 
-        mlflow.sklearn.log_model(model, name=name)
+        mlflow.set_tracking_uri(Config.MLFLOW_TRACKING_URI)
+        # status of the run set by the backend when the tracked function returns
+        with mlflow.start_run(run_id=run_id):
+            mlflow.sklearn.log_model(model, name=name)
 
-        if registered_model_name:
-            mlflow.register_model(
-                f"runs:/{mlflow.active_run().info.run_id}/{name}",
-                registered_model_name,
-            )
+            if registered_model_name:
+                mlflow.register_model(
+                    f"runs:/{run_id}/{name}",
+                    registered_model_name,
+                )
 
         logger.info("✅ Model logged to MLflow")
         return True
@@ -98,6 +127,9 @@ def mlflow_load_model(model_uri: str):
     Args:
         model_uri: MLflow model URI (e.g., 'models:/my-model-name/production')
     """
+    import mlflow
+    import mlflow.sklearn
+
     try:
         mlflow.set_tracking_uri(Config.MLFLOW_TRACKING_URI)
         logger.info("Loading model from MLflow: %s", model_uri)
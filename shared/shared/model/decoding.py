@@ -0,0 +1,100 @@
+"""
+Structured decoding of the assistant answer.
+
+The prompt ends with the answer header (`PromptTemplate.GENERATION_TEMPLATE`),
+so the model only decodes the shape of `PromptTemplate.ASSISTANT_TEMPLATE` after it :
+"<category digit>\n\nexplanation : <explanation>".
+- CategoryLogitsProcessor forces the first decoded token to be a category digit
+- AnswerStoppingCriteria stops each sequence once its answer is complete
+- EventStoppingCriteria stops the whole generation when its consumer is gone
+- parse_answer turns the decoded answer (prompt excluded) into (category, explanation)
+"""
+
+import logging
+import re
+import threading
+from typing import List, Tuple
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+logger = logging.getLogger(__name__)
+
+# optional answer header, in case the model repeats it before the category
+CATEGORY_PATTERN = re.compile(r"^\s*(?:#+\s*Answer\s*:\s*)?(?:category\s*:\s*)?(\d)", re.IGNORECASE)
+EXPLANATION_HEADER_PATTERN = re.compile(r"^explanation\s*:\s*", re.IGNORECASE)
+# a new section or a new answer : the explanation is over
+END_OF_ANSWER_PATTERN = re.compile(r"\n\s*(?:#{2,}|category\s*:)", re.IGNORECASE)
+
+
+def parse_answer(answer: str) -> Tuple[str, str]:
+    """
+    Parse the decoded assistant answer (without the prompt) into (category, explanation).
+    If no category is found, category is "" and the whole answer is the explanation.
+    """
+    m = CATEGORY_PATTERN.search(answer)
+    if not m:
+        return "", answer.strip()
+
+    explanation = EXPLANATION_HEADER_PATTERN.sub("", answer[m.end():].strip())
+    end = END_OF_ANSWER_PATTERN.search(explanation)
+    if end:
+        explanation = explanation[: end.start()]
+    return m.group(1), explanation.strip()
+
+
+class CategoryLogitsProcessor(LogitsProcessor):
+    """Restricts the first decoded token to the category digits"""
+
+    def __init__(self, category_ids: List[int], prompt_length: int):
+        self.category_ids = category_ids
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if input_ids.shape[1] != self.prompt_length:
+            return scores
+        mask = torch.full_like(scores, float("-inf"))
+        mask[:, self.category_ids] = 0
+        return scores + mask
+
+
+class AnswerStoppingCriteria(StoppingCriteria):
+    """
+    Stops each sequence of a batch independently when :
+    - its explanation exceeds max_explanation_tokens, or
+    - it starts a new section or a new answer after the explanation.
+    End of sequence tokens are already handled by `generate`.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, max_explanation_tokens: int, window: int = 8):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_explanation_tokens = max_explanation_tokens
+        self.window = window
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        generated = input_ids[:, self.prompt_length:]
+        # the first generated token is the category
+        over_budget = generated.shape[1] - 1 >= self.max_explanation_tokens
+        done = torch.full(
+            (input_ids.shape[0],), over_budget, dtype=torch.bool, device=input_ids.device
+        )
+        if over_budget or generated.shape[1] <= 1:
+            return done
+
+        # only the last tokens need checking : earlier ones were checked at previous steps
+        tails = self.tokenizer.batch_decode(generated[:, 1:][:, -self.window:], skip_special_tokens=True)
+        for i, tail in enumerate(tails):
+            if END_OF_ANSWER_PATTERN.search(tail):
+                done[i] = True
+        return done
+
+
+class EventStoppingCriteria(StoppingCriteria):
+    """Stops every sequence once the event is set, e.g. by a consumer that stopped reading a stream"""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
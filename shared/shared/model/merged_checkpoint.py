@@ -0,0 +1,111 @@
+"""
+Merged checkpoints : base model weights with the LoRA adapter folded in.
+
+Serving a merged model skips the extra LoRA matmuls of every forward pass.
+The merged weights are saved as safetensors under
+`<local_directory>/merged/<key>`, where key hashes the base model revision,
+the adapter files and the dtype, so that later starts memory-map them
+instead of loading the base model and applying the adapter again.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+MERGED_DIRECTORY = "merged"
+
+
+def _hash_files(directory: str) -> str:
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(directory)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, directory).encode())
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024**2), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def adapter_hash(adapter_dir: str) -> str:
+    """Hash of the adapter files"""
+    return _hash_files(adapter_dir)
+
+
+def adapter_slot(adapter_name: str, adapter_dir: str) -> str:
+    """Name of a loaded adapter version : its name and a hash of its files, without dots"""
+    try:
+        version = adapter_hash(adapter_dir)[:8]
+    except OSError:
+        version = "local"
+    return re.sub(r"[^0-9A-Za-z_-]", "_", f"{adapter_name}_{version}")
+
+
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt")
+
+
+def _local_model_hash(directory: str) -> str:
+    """
+    Hash of a local model directory : its config and weight index, and the name, size
+    and modification time of its weight files (hashing the weights themselves would
+    read gigabytes at every start).
+    """
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name == "config.json" or name.endswith(".index.json"):
+            digest.update(name.encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        elif name.endswith(WEIGHT_SUFFIXES):
+            stat = os.stat(path)
+            digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def base_model_hash(model_name: str) -> str:
+    """
+    Revision of the base model : hash of its config and weight files for a local directory,
+    else the commit of the snapshot in the Hugging Face cache, else its name.
+    """
+    if os.path.isdir(model_name):
+        return _local_model_hash(model_name)
+    try:
+        from huggingface_hub import try_to_load_from_cache
+
+        path = try_to_load_from_cache(model_name, "config.json")
+        if isinstance(path, str):
+            # .../snapshots/<commit>/config.json
+            return os.path.basename(os.path.dirname(path))
+    except Exception as e:
+        logger.warning("Base model revision not found in cache: %s", e)
+    return hashlib.sha256(model_name.encode()).hexdigest()
+
+
+def merged_checkpoint_dir(local_directory: str, model_name: str, adapter_dir: str, dtype) -> str:
+    key = hashlib.sha256(
+        "\n".join(
+            [model_name, base_model_hash(model_name), adapter_hash(adapter_dir), str(dtype)]
+        ).encode()
+    ).hexdigest()[:16]
+    return os.path.join(local_directory, MERGED_DIRECTORY, key)
+
+
+def save_merged(model, tokenizer, path: str):
+    """Save a merged model and its tokenizer as safetensors, atomically : readers never see a partial checkpoint"""
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        model.save_pretrained(tmp_dir, safe_serialization=True)
+        tokenizer.save_pretrained(tmp_dir)
+        os.replace(tmp_dir, path)
+        logger.info("Merged checkpoint saved to %s", path)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
@@ -2,27 +2,56 @@ import logging
 import os
 import re
 import gc
-
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
 
 import torch
-from datasets import Dataset
-from peft import PeftModel, prepare_model_for_kbit_training
+from peft import PeftModel
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
-    DataCollatorForSeq2Seq,
-    TrainingArguments,
+    LogitsProcessorList,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
 )
-from trl import SFTTrainer
 
+from shared.model.decoding import (
+    AnswerStoppingCriteria,
+    CategoryLogitsProcessor,
+    EventStoppingCriteria,
+    parse_answer,
+)
+from shared.model.model_mirror import has_safetensors, resolve_base_model
+from shared.model.merged_checkpoint import adapter_slot, merged_checkpoint_dir, save_merged
+from shared.model.precision import DTYPES, apply_precision, check_precision, resolve_precision
+from shared.model.prefix_cache import PrefixCache
 from shared.model.prompt import PromptTemplate
+from shared.model.prompt_tokens import (
+    PLACEHOLDER,
+    VERIFICATION_QUOTES,
+    TokenizedPromptTemplate,
+)
 from shared.config import Config, setup_logging
+from shared.energy import EnergySpan, energy_meter
 from shared.gcp import Gcp
 from shared.mlflow_utils import mlflow_track, mlflow_load_model, mlflow_log_model
 from shared.system_utils import format_memory_info, get_memory_info
+from shared.telemetry import telemetry
+
+# training-only dependencies (datasets, trl, peft training utils) are imported in train :
+# the serving path only loads what inference needs
+if TYPE_CHECKING:
+    from datasets import Dataset
 
 logger = logging.getLogger(__name__)
 
+# labels of the climate narrative categories, see PromptTemplate.SYSTEM_MSG
+CATEGORIES = tuple(str(i) for i in range(8))
+
 
 class LLMWrapper:
     def __init__(
@@ -32,7 +61,21 @@ class LLMWrapper:
         model_name: str,
         project_id: str,
         bucket_name: str,
+        precision: str = Config.MODEL_PRECISION,
+        merge_adapter: bool = False,
     ):
+        # (prompt suffix, category token ids) used by classify_fast, resolved on first use
+        self._category_tokens = None
+        # generation prompt tokenized around the quote, built at load
+        self._prompt_template = None
+        # KV cache of the prompt prefix shared by every quote, per adapter slot
+        self._prefix_caches: Dict[str, PrefixCache] = {}
+        # adapter slots in use by inference calls, and slots to delete once idle
+        self._adapters_lock = threading.Lock()
+        self._inflight = Counter()
+        self._retired = set()
+        self._clear_when_idle = False
+        check_precision(precision, merge_adapter)
         try:
             logger.info("Loading model and tokenizer")
             total, start = get_memory_info()
@@ -53,6 +96,11 @@ class LLMWrapper:
                 )
 
             self.model_name = model_name
+            self.adapter_name = adapter_name
+            # identity of the default adapter : its name and a hash of its files
+            self.active_adapter = self._adapter_slot(adapter_name, adapter_dir)
+            # slot of each served adapter, sharing the base model
+            self.adapters: Dict[str, str] = {adapter_name: self.active_adapter}
             logger.info(f"Base model: {self.model_name}")
             logger.info(f"Adapter directory: {adapter_dir}")
 
@@ -66,26 +114,77 @@ class LLMWrapper:
                 self.device = "mps"
             else:
                 self.device = "cpu"
-            self.torch_dtype = torch.float16 if self.device == "mps" else torch.float32
+            self.precision = resolve_precision(precision, self.device)
+            self.torch_dtype = DTYPES[self.precision]
             device_map = "auto" if self.device != "cpu" else None
-            logger.info("Using device=%s, dtype=%s, device_map=%s", self.device, self.torch_dtype, device_map)
+            logger.info(
+                "Using device=%s, precision=%s, dtype=%s, device_map=%s",
+                self.device, self.precision, self.torch_dtype, device_map,
+            )
 
-            # loading base model from hugging face
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            # base model from the local or bucket mirror, the Hugging Face Hub only as a fallback
+            self.model_path = resolve_base_model(self.model_name)
+            logger.info("Base model path: %s", self.model_path)
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+            # left padding so that every prompt in a batch ends right before generation starts
+            self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self._prompt_template = self._build_prompt_template()
+
+            merged_dir = (
+                merged_checkpoint_dir(
+                    local_directory=local_directory,
+                    model_name=self.model_path,
+                    adapter_dir=adapter_dir,
+                    dtype=self.torch_dtype,
+                )
+                if merge_adapter
+                else None
+            )
 
-            self.base_model = AutoModelForCausalLM.from_pretrained(
-                pretrained_model_name_or_path=self.model_name,
-                torch_dtype=self.torch_dtype,
-                device_map=device_map,
-            ).to(self.device)
+            if merged_dir is not None and os.path.exists(merged_dir):
+                # safetensors are memory-mapped : no Hub download, no adapter to apply
+                logger.info("Loading merged checkpoint %s", merged_dir)
+                self.base_model = AutoModelForCausalLM.from_pretrained(
+                    pretrained_model_name_or_path=merged_dir,
+                    torch_dtype=self.torch_dtype,
+                    device_map=device_map,
+                    low_cpu_mem_usage=True,
+                ).to(self.device)
+                self.model = self.base_model
 
-            # loading the adapter from local directory
-            self.model = PeftModel.from_pretrained(
-                model=self.base_model,
-                model_id=adapter_dir,
-                torch_dtype=self.torch_dtype,
-                device_map=device_map,
-            ).to(self.device)
+            else:
+                # safetensors are memory-mapped, weights are materialized once in their dtype
+                self.base_model = AutoModelForCausalLM.from_pretrained(
+                    pretrained_model_name_or_path=self.model_path,
+                    torch_dtype=self.torch_dtype,
+                    device_map=device_map,
+                    low_cpu_mem_usage=True,
+                    use_safetensors=has_safetensors(self.model_path) or None,
+                ).to(self.device)
+
+                # loading the adapter from local directory
+                self.model = PeftModel.from_pretrained(
+                    model=self.base_model,
+                    model_id=adapter_dir,
+                    adapter_name=self.active_adapter,
+                    torch_dtype=self.torch_dtype,
+                    device_map=device_map,
+                ).to(self.device)
+
+                if merged_dir is not None:
+                    # fold the LoRA weights into the base weights : no extra matmuls per forward pass
+                    logger.info("Merging adapter into base model")
+                    self.model = self.model.merge_and_unload()
+                    self.base_model = self.model
+                    try:
+                        save_merged(model=self.model, tokenizer=self.tokenizer, path=merged_dir)
+                    except Exception as e:
+                        logger.warning("Failed to save merged checkpoint: %s", e)
+
+            self.model.eval()
+            self.model = apply_precision(self.model, self.precision)
 
             logger.info("✅ model loaded on %s", next(self.model.parameters()).device)
             total, end = get_memory_info()
@@ -117,7 +216,28 @@ class LLMWrapper:
 
         return formatted_texts
 
-    def _apply_chat_template_training(self, ds: Dataset):
+    def _render_training_text(self, quote, label, response) -> str:
+        """Fully filled Q/A : system, user and assistant prompt, rendered with the chat template"""
+        messages = [
+            {"role": "system", "content": PromptTemplate.SYSTEM_MSG},
+            {
+                "role": "user",
+                "content": PromptTemplate.USER_TEMPLATE.format(quote=quote),
+            },
+            {
+                "role": "assistant",
+                "content": PromptTemplate.ASSISTANT_TEMPLATE.format(
+                    response=response, label=label
+                ),
+            },
+        ]
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=False,  # for fine tuning
+        )
+
+    def _apply_chat_template_training(self, ds: "Dataset"):
         """
         - Takes a dataset object containing 'quote', 'label', and 'response' fields
         - Formats each example into a conversation using prefedined prompt templates
@@ -131,71 +251,570 @@ class LLMWrapper:
         for quote, label, response in zip(
             ds["text"], ds["label_pred"], ds["explanation"]
         ):
-            messages = [
-                {"role": "system", "content": PromptTemplate.SYSTEM_MSG},
-                {
-                    "role": "user",
-                    "content": PromptTemplate.USER_TEMPLATE.format(quote=quote),
-                },
-                {
-                    "role": "assistant",
-                    "content": PromptTemplate.ASSISTANT_TEMPLATE.format(
-                        response=response, label=label
-                    ),
-                },
-            ]
+            formatted_texts.append(self._render_training_text(quote, label, response))
 
-            formatted_text = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=False,  # for fine tuning
+        return {"text": formatted_texts}
+
+    def _apply_answer_prompts(self, quotes: List[str]) -> List[str]:
+        """
+        Generation prompts completed with the answer header (`PromptTemplate.GENERATION_TEMPLATE`),
+        such that the next token is the category digit.
+        """
+        prompt_suffix, _ = self._resolve_category_tokens()
+        return [
+            prompt + PromptTemplate.GENERATION_TEMPLATE + prompt_suffix
+            for prompt in self._apply_chat_template_generation(quotes=quotes)
+        ]
+
+    def _answer_decoding(self, prompt_length: int, max_explanation_tokens: int) -> dict:
+        """`model.generate` arguments decoding the answer shape and stopping once it is complete"""
+        _, category_ids = self._resolve_category_tokens()
+        return {
+            "logits_processor": LogitsProcessorList(
+                [CategoryLogitsProcessor(category_ids=category_ids, prompt_length=prompt_length)]
+            ),
+            "stopping_criteria": StoppingCriteriaList(
+                [
+                    AnswerStoppingCriteria(
+                        tokenizer=self.tokenizer,
+                        prompt_length=prompt_length,
+                        max_explanation_tokens=max_explanation_tokens,
+                    )
+                ]
+            ),
+        }
+
+    def _build_prompt_template(self) -> Optional[TokenizedPromptTemplate]:
+        """
+        Render the answer prompt once around a placeholder quote and tokenize its constant parts.
+        Splicing is only enabled if it gives the same ids as the full tokenization of the prompts.
+        """
+        try:
+            rendered = self._apply_answer_prompts(quotes=[PLACEHOLDER])[0]
+            template = TokenizedPromptTemplate(tokenizer=self.tokenizer, rendered=rendered)
+            expected = self.tokenizer(
+                self._apply_answer_prompts(quotes=VERIFICATION_QUOTES)
+            )["input_ids"]
+            template.verify(expected=expected, quotes=VERIFICATION_QUOTES)
+            return template
+        except Exception as e:
+            logger.warning("Prompt template tokenization disabled: %s", e)
+            return None
+
+    def _get_prefix_cache(self, adapter: str) -> Optional[PrefixCache]:
+        """
+        KV cache of the prompt prefix shared by every quote : the chat template up to the line
+        holding the quote. Computed once per loaded adapter slot.
+        Returns None if the prefix cannot be cached.
+        """
+        prefix_cache = self._prefix_caches.get(adapter)
+        if prefix_cache is not None:
+            return prefix_cache
+
+        try:
+            if self._prompt_template is None:
+                raise ValueError("Prompt template not available")
+            self.model.eval()
+            prefix_cache = PrefixCache.build(
+                model=self.model,
+                tokenizer=self.tokenizer,
+                prefix_text=self._prompt_template.prefix_text,
+                device=self.device,
+                key=adapter,
+                model_kwargs=self._adapter_kwargs(adapter, batch_size=1),
             )
+            self._prefix_caches[adapter] = prefix_cache
+        except Exception as e:
+            logger.warning("Prefix cache disabled: %s", e)
+        return prefix_cache
 
-            formatted_texts.append(formatted_text)
+    def _encode_answer_prompts(self, quotes: List[str], adapter: str) -> Tuple[dict, object]:
+        """
+        Tokenize the answer prompts of quotes, only the quotes when the prompt template is verified,
+        and reuse the KV cache of the shared prefix when possible.
+        Returns (inputs, past_key_values) : inputs always hold the full prompts,
+        past_key_values is None when the prefix cache cannot be used.
+        """
+        if self._prompt_template is not None and self._prompt_template.verified:
+            encoded = self._prompt_template.encode(quotes=quotes)
+        else:
+            encoded = self.tokenizer(self._apply_answer_prompts(quotes=quotes))["input_ids"]
+
+        prefix_cache = self._get_prefix_cache(adapter)
+        if prefix_cache is not None:
+            batch = prefix_cache.encode(
+                encoded=encoded,
+                pad_token_id=self.tokenizer.pad_token_id,
+                device=self.device,
+            )
+            if batch is not None:
+                return batch
+            logger.warning("Prompts do not start with the cached prefix, full prefill")
+
+        inputs = self.tokenizer.pad(
+            {"input_ids": encoded}, padding=True, return_tensors="pt"
+        ).to(self.device)
+        return inputs, None
+
+    @staticmethod
+    def _adapter_slot(adapter_name: str, adapter_dir: str) -> str:
+        """Name of a loaded adapter version : its name and a hash of its files, without dots"""
+        return adapter_slot(adapter_name, adapter_dir)
+
+    @property
+    def can_swap_adapters(self) -> bool:
+        """Adapters can be loaded next to each other unless they were merged into the base weights"""
+        return isinstance(self.model, PeftModel)
+
+    def _adapter_kwargs(self, adapter: str, batch_size: int) -> dict:
+        """Model call arguments running every row of a batch with the adapter slot"""
+        if not self.can_swap_adapters:
+            return {}
+        return {"adapter_names": [adapter] * batch_size}
+
+    def _acquire_adapter(self, adapter: Optional[str] = None) -> str:
+        """Hold an adapter slot, the active one by default : it is not deleted until released"""
+        with self._adapters_lock:
+            adapter = adapter or self.active_adapter
+            self._inflight[adapter] += 1
+            return adapter
+
+    @contextmanager
+    def _using_adapter(self, adapter: Optional[str] = None) -> Iterator[str]:
+        """Hold an adapter slot for the duration of an inference call"""
+        adapter = self._acquire_adapter(adapter)
+        try:
+            yield adapter
+        finally:
+            self._release_adapter(adapter)
+
+    def _release_adapter(self, adapter: str):
+        with self._adapters_lock:
+            self._inflight[adapter] -= 1
+            if self._inflight[adapter] > 0:
+                return
+            del self._inflight[adapter]
+            clear = self._clear_when_idle and not self._inflight
+            delete = adapter in self._retired
+            self._retired.discard(adapter)
+        if clear:
+            self.clear()
+        elif delete:
+            self._delete_adapter(adapter)
+
+    def _delete_adapter(self, adapter: str):
+        logger.info("Deleting adapter %s", adapter)
+        self._prefix_caches.pop(adapter, None)
+        self.model.delete_adapter(adapter)
+        gc.collect()
+
+    def load_adapter(self, adapter_name: str) -> str:
+        """
+        Load the adapter files of local_directory/adapter_name next to the loaded adapters,
+        on the resident base model. Memory grows by the size of the adapter only.
+        Returns the adapter slot, not served until `switch_adapter`.
+        """
+        if not self.can_swap_adapters:
+            raise ValueError("Adapter merged into the base model, adapters cannot be swapped")
+        adapter_dir = os.path.join(self.local_directory, adapter_name)
+        slot = self._adapter_slot(adapter_name, adapter_dir)
+        if slot in self.model.peft_config:
+            logger.info("Adapter %s already loaded", slot)
+            return slot
+        logger.info("Loading adapter %s from %s", slot, adapter_dir)
+        self.model.load_adapter(adapter_dir, adapter_name=slot)
+        self.model.eval()
+        return slot
 
-        return {"text": formatted_texts}
+    def warm_up(self, adapter: str):
+        """
+        Classify verification quotes with the adapter slot, also building its prefix cache.
+        Raises if an answer has no valid category.
+        """
+        quotes = list(VERIFICATION_QUOTES[:2])
+        results = self.generate_batch(quotes=quotes, max_explanation_tokens=8, adapter=adapter)
+        invalid = [category for category, _ in results if category not in CATEGORIES]
+        if invalid:
+            raise ValueError(f"Adapter {adapter} answers invalid categories: {invalid}")
+        logger.info("Adapter %s warmed up", adapter)
+
+    def resolve_adapter(self, adapter_name: Optional[str] = None) -> str:
+        """Slot serving adapter_name, the default adapter if None ; raises KeyError if not loaded"""
+        if adapter_name is None:
+            return self.active_adapter
+        return self.adapters[adapter_name]
+
+    def acquire_adapter(self, adapter_name: Optional[str] = None) -> str:
+        """
+        Hold the slot serving adapter_name (the default adapter if None) until `release_adapter` :
+        a reload does not delete it, nor clear the model, while claims routed to it wait for inference.
+        Raises KeyError if the adapter is not served.
+        """
+        with self._adapters_lock:
+            adapter = self.resolve_adapter(adapter_name)
+            self._inflight[adapter] += 1
+            return adapter
+
+    def release_adapter(self, adapter: str):
+        """Release a slot held by `acquire_adapter`"""
+        self._release_adapter(adapter)
+
+    def switch_adapter(self, adapter: str, adapter_name: str):
+        """
+        Serve new inference calls for adapter_name with the adapter slot. The slot it replaces
+        is deleted as soon as the calls using it are finished.
+        """
+        with self._adapters_lock:
+            previous = self.adapters.get(adapter_name)
+            if previous == adapter:
+                return
+            self.adapters[adapter_name] = adapter
+            if adapter_name == self.adapter_name:
+                self.active_adapter = adapter
+            idle = False
+            if previous is not None and previous not in self.adapters.values():
+                self._retired.add(previous)
+                idle = not self._inflight[previous]
+                if idle:
+                    self._retired.discard(previous)
+        logger.info("Serving adapter %s with %s, previous %s", adapter_name, adapter, previous)
+        if idle:
+            self._delete_adapter(previous)
+
+    def reload_adapter(self, adapter_name: str) -> str:
+        """
+        Hot swap : load adapter_name next to the served adapters, warm it up and switch to it.
+        Also adds an adapter not served yet.
+        """
+        slot = self.load_adapter(adapter_name)
+        if self.adapters.get(adapter_name) == slot:
+            logger.info("Adapter %s unchanged", adapter_name)
+            return slot
+        try:
+            self.warm_up(slot)
+        except Exception:
+            if slot not in self.adapters.values():
+                self._delete_adapter(slot)
+            raise
+        self.switch_adapter(slot, adapter_name)
+        return slot
+
+    def clear_when_idle(self):
+        """Free the model once no inference call is running, e.g. after it was replaced"""
+        with self._adapters_lock:
+            self._clear_when_idle = True
+            idle = not self._inflight
+        if idle:
+            self.clear()
 
-    @mlflow_track(experiment_name='generate')
     def generate(
         self,
         quote: str = "Climate change is not happening",
         max_new_tokens: int = 2048,
+        max_explanation_tokens: int = Config.MAX_EXPLANATION_TOKENS,
     ):
         """
         Generate classification (category and explanation) from quote
         Returns category and explanation
         """
+        return self.generate_batch(
+            quotes=[quote],
+            max_new_tokens=max_new_tokens,
+            max_explanation_tokens=max_explanation_tokens,
+        )[0]
+
+    def _usage(self, span: EnergySpan, start: float, inputs: dict, generated, quotes: List[str]) -> Dict[str, dict]:
+        """
+        Usage of each quote of an inference call : its tokens, the latency of the call, and
+        the energy of the call split between quotes. The meter gives the call its share of the
+        process CPU time ; within the call, every row of the padded batch takes the same CPU
+        time, so half of the energy is split evenly between quotes and half by their share of
+        tokens. The call is recorded in the serving telemetry.
+        generated is None for a single forward pass, which produces one token per quote.
+        """
+        latency_s = time.perf_counter() - start
+        tokens_in = inputs["attention_mask"].sum(dim=1).tolist()
+        tokens_out = (
+            (generated != self.tokenizer.pad_token_id).sum(dim=1).tolist()
+            if generated is not None
+            else [1] * len(quotes)
+        )
+        telemetry.record(
+            latency_s=latency_s,
+            tokens_in=sum(tokens_in),
+            tokens_out=sum(tokens_out),
+            energy_j=span.energy_j,
+            co2_g=span.co2_g,
+            requests=len(quotes),
+        )
+        total_tokens = max(1, sum(tokens_in) + sum(tokens_out))
+        usage = {}
+        for quote, quote_in, quote_out in zip(quotes, tokens_in, tokens_out):
+            share = (1 / len(quotes) + (quote_in + quote_out) / total_tokens) / 2
+            usage[quote] = {
+                "tokens_in": quote_in,
+                "tokens_out": quote_out,
+                "latency_s": latency_s,
+                "energy_j": span.energy_j * share,
+                "co2_g": span.co2_g * share,
+                "energy_estimated": energy_meter.estimated,
+            }
+        return usage
+
+    def generate_batch(
+        self,
+        quotes: List[str],
+        max_new_tokens: int = 2048,
+        max_explanation_tokens: int = Config.MAX_EXPLANATION_TOKENS,
+        return_usage: bool = False,
+        adapter: Optional[str] = None,
+    ) -> list:
+        """
+        Generate classifications (category and explanation) for a list of quotes
+        in a single batched `model.generate` call, with the adapter slot (the active one by default).
+        Decoding starts at the category digit and each sequence stops as soon as its answer is complete.
+        Identical quotes are only generated once.
+        Returns a list of (category, explanation), in the same order as quotes,
+        and with return_usage the list of their usage (tokens, latency, energy).
+        """
         assert self.model is not None
 
-        logger.info("LLMWrapper.generate quote: %s", quote)
+        unique_quotes = list(dict.fromkeys(quotes))
+        logger.info(
+            "LLMWrapper.generate_batch %d quotes (%d unique)", len(quotes), len(unique_quotes)
+        )
 
-        formatted_prompt = self._apply_chat_template_generation(quotes=[quote])[0]
-        logger.info("LLMWrapper.generate formatted_prompt: %s", formatted_prompt)
-        inputs = self.tokenizer(formatted_prompt, return_tensors="pt").to(self.device)
+        start = time.perf_counter()
+        with self._using_adapter(adapter) as adapter, energy_meter.span() as span:
+            inputs, past_key_values = self._encode_answer_prompts(quotes=unique_quotes, adapter=adapter)
+            prompt_length = inputs["input_ids"].shape[1]
+
+            self.model.eval()
+            with torch.no_grad():
+                output_ids = self.model.generate(
+                    **inputs,
+                    past_key_values=past_key_values,
+                    max_new_tokens=max_new_tokens,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    **self._answer_decoding(prompt_length, max_explanation_tokens),
+                    **self._adapter_kwargs(adapter, batch_size=len(unique_quotes)),
+                )
+            # only decode the new tokens : prompts are padded to the same length
+            generated = output_ids[:, prompt_length:]
+            answers = self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+        usage = self._usage(span, start, inputs, generated, unique_quotes)
+
+        results = {}
+        for quote, answer in zip(unique_quotes, answers):
+            category, explanation = parse_answer(answer)
+            logger.info("category: %s", category)
+            logger.info("explanation: %s", explanation)
+            results[quote] = (category, explanation)
+
+        if return_usage:
+            return [results[quote] for quote in quotes], [usage[quote] for quote in quotes]
+        return [results[quote] for quote in quotes]
+
+    def _resolve_category_tokens(self) -> Tuple[str, List[int]]:
+        """
+        Find how the tokenizer encodes the category digit after "category:".
+        Returns the suffix to append to the prompt and the token id of each category,
+        such that the category is exactly the next token.
+        """
+        if self._category_tokens is not None:
+            return self._category_tokens
+
+        prefix = PromptTemplate.GENERATION_TEMPLATE
+        # either the space is its own token and digits follow it, or the space is merged into the digit
+        for prompt_suffix, digit_prefix in ((" ", ""), ("", " ")):
+            prompt_ids = self.tokenizer.encode(prefix + prompt_suffix, add_special_tokens=False)
+            category_ids = []
+            for category in CATEGORIES:
+                ids = self.tokenizer.encode(
+                    prefix + prompt_suffix + digit_prefix + category, add_special_tokens=False
+                )
+                if ids[: len(prompt_ids)] != prompt_ids or len(ids) != len(prompt_ids) + 1:
+                    break
+                category_ids.append(ids[-1])
+            else:
+                self._category_tokens = (prompt_suffix, category_ids)
+                logger.info("Category token ids: %s", category_ids)
+                return self._category_tokens
 
-        self.model.eval()
-        output_ids = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
-        output_text = self.tokenizer.decode(output_ids[0], skip_special_tokens=True)
-
-        answer = output_text.split("assistant")[1]
-        m = re.search(r"\d", answer)
-        if m:
-            category = m.group(0)
-            explanation = answer.split(category)[1].strip()
-        else:
-            category = ""
-            explanation = answer
-        logger.info("category: %s", category)
-        logger.info("explanation: %s", explanation)
+        raise ValueError("Category digits are not single tokens for this tokenizer")
+
+    def classify_fast(
+        self,
+        quotes: List[str],
+        return_usage: bool = False,
+        adapter: Optional[str] = None,
+    ) -> list:
+        """
+        Classify quotes with a single forward pass, without decoding an explanation,
+        with the adapter slot (the active one by default).
+        The prompt is completed with the answer header (`PromptTemplate.GENERATION_TEMPLATE`)
+        and the next-token distribution is restricted to the eight category digits.
+        Identical quotes are only scored once.
+        Returns a list of (category, {category: probability}), in the same order as quotes,
+        and with return_usage the list of their usage (tokens, latency, energy).
+        """
+        assert self.model is not None
+
+        unique_quotes = list(dict.fromkeys(quotes))
+        logger.info(
+            "LLMWrapper.classify_fast %d quotes (%d unique)", len(quotes), len(unique_quotes)
+        )
+
+        start = time.perf_counter()
+        with self._using_adapter(adapter) as adapter, energy_meter.span() as span:
+            _, category_ids = self._resolve_category_tokens()
+            inputs, past_key_values = self._encode_answer_prompts(quotes=unique_quotes, adapter=adapter)
+            adapter_kwargs = self._adapter_kwargs(adapter, batch_size=len(unique_quotes))
+
+            self.model.eval()
+            with torch.no_grad():
+                if past_key_values is None:
+                    # prompts are left padded : the last position is the next token of every prompt
+                    logits = self.model(**inputs, logits_to_keep=1, **adapter_kwargs).logits[:, -1, :]
+                else:
+                    # only the suffixes go through prefill, positions follow the attention mask
+                    cached = past_key_values.get_seq_length()
+                    total = inputs["input_ids"].shape[1]
+                    position_ids = (inputs["attention_mask"].cumsum(-1) - 1).clamp(min=0)
+                    logits = self.model(
+                        input_ids=inputs["input_ids"][:, cached:],
+                        attention_mask=inputs["attention_mask"],
+                        position_ids=position_ids[:, cached:],
+                        past_key_values=past_key_values,
+                        cache_position=torch.arange(cached, total, device=self.device),
+                        logits_to_keep=1,
+                        **adapter_kwargs,
+                    ).logits[:, -1, :]
+            probabilities = torch.softmax(logits[:, category_ids].float(), dim=-1).cpu()
+        usage = self._usage(span, start, inputs, None, unique_quotes)
+
+        results = {}
+        for quote, probs in zip(unique_quotes, probabilities.tolist()):
+            scores = dict(zip(CATEGORIES, probs))
+            category = max(scores, key=scores.get)
+            logger.info("category: %s (p=%.3f)", category, scores[category])
+            results[quote] = (category, scores)
+
+        if return_usage:
+            return [results[quote] for quote in quotes], [usage[quote] for quote in quotes]
+        return [results[quote] for quote in quotes]
+
+    def generate_stream(
+        self,
+        quote: str = "Climate change is not happening",
+        max_new_tokens: int = 2048,
+        max_explanation_tokens: int = Config.MAX_EXPLANATION_TOKENS,
+        executor: Optional[Executor] = None,
+        adapter: Optional[str] = None,
+    ) -> Iterator[Tuple[str, dict]]:
+        """
+        Stream the classification of a quote while it is decoded, with the adapter slot (the active one by default).
+        Yields (event, data) tuples :
+        - ("category", {"category"}) as soon as the category digit is decoded
+        - ("explanation", {"text"}) for each decoded chunk of the explanation
+        - ("done", {"category", "explanation"}) with the same result as `generate`
+        model.generate runs on executor if given, else on a dedicated thread. Closing the
+        iterator before the end stops the generation at the next token and waits for it.
+        """
+        assert self.model is not None
 
-        return category, explanation
+        logger.info("LLMWrapper.generate_stream quote: %s", quote)
+
+        # the adapter is held until generation ends, even if the consumer stops early
+        adapter = self._acquire_adapter(adapter)
+        try:
+            inputs, past_key_values = self._encode_answer_prompts(quotes=[quote], adapter=adapter)
+        except Exception:
+            self._release_adapter(adapter)
+            raise
+        prompt_length = inputs["input_ids"].shape[1]
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        stop = threading.Event()
+
+        def _generate():
+            try:
+                start = time.perf_counter()
+                decoding = self._answer_decoding(prompt_length, max_explanation_tokens)
+                decoding["stopping_criteria"].append(EventStoppingCriteria(stop))
+                with energy_meter.span() as span:
+                    self.model.eval()
+                    with torch.no_grad():
+                        output_ids = self.model.generate(
+                            **inputs,
+                            past_key_values=past_key_values,
+                            max_new_tokens=max_new_tokens,
+                            pad_token_id=self.tokenizer.pad_token_id,
+                            streamer=streamer,
+                            **decoding,
+                            **self._adapter_kwargs(adapter, batch_size=1),
+                        )
+                self._usage(span, start, inputs, output_ids[:, prompt_length:], [quote])
+            finally:
+                self._release_adapter(adapter)
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream")
+        try:
+            future = executor.submit(_generate)
+        except Exception:
+            self._release_adapter(adapter)
+            raise
+        # unblock the consumer if generation fails before the end of the stream
+        future.add_done_callback(lambda f: f.exception() is not None and streamer.end())
+
+        try:
+            answer = ""
+            category = None
+            sent = ""
+            for chunk in streamer:
+                answer += chunk
+                parsed_category, explanation = parse_answer(answer)
+                if not parsed_category:
+                    continue
+                if category is None:
+                    category = parsed_category
+                    yield "category", {"category": category}
+                # hold back text that may still be the explanation header
+                if "explanation :".startswith(explanation.lower()):
+                    continue
+                if explanation.startswith(sent) and len(explanation) > len(sent):
+                    yield "explanation", {"text": explanation[len(sent):]}
+                    sent = explanation
+
+            # re-raise generation errors
+            future.result()
+
+            category, explanation = parse_answer(answer)
+            logger.info("category: %s", category)
+            logger.info("explanation: %s", explanation)
+            yield "done", {"category": category, "explanation": explanation}
+
+        finally:
+            # consumer gone before the end : generation stops at the next token
+            stop.set()
+            wait([future])
+            if own_executor:
+                executor.shutdown(wait=False)
 
     @mlflow_track
     def train(
         self,
-        data_train: Dataset,
+        data_train: "Dataset",
         # data_val : Dataset
     ):
+        from datasets import Dataset
+        from peft import prepare_model_for_kbit_training
+        from transformers import DataCollatorForSeq2Seq, TrainingArguments
+        from trl import SFTTrainer
+
         # format training set with chat template
         formatted_ds = self._apply_chat_template_training(ds=data_train)
         logger.info("formatted train_ds sample %s", formatted_ds['text'][0])
@@ -272,7 +891,7 @@ class LLMWrapper:
     @mlflow_track
     def evaluate(
         self,
-        data : Dataset
+        data : "Dataset"
     ):
         pass
 
@@ -281,6 +900,7 @@ class LLMWrapper:
         try:
             total, start = get_memory_info()
             logger.info(format_memory_info(total_gb=total, available_gb=start))
+            self._prefix_caches = {}
             del self.model
             del self.tokenizer
             gc.collect()
@@ -0,0 +1,294 @@
+"""
+Content-addressed mirror of base models, so that a replica starts without the Hugging Face Hub.
+
+A mirror holds the files of each base model once, named by their sha256 :
+    <root>/blobs/<sha256>
+    <root>/models/<model>/manifest.json    {"model_name", "files": {path: {"sha256", "size"}}}
+    <root>/models/<model>/snapshots/<revision>/<path>    hard links to the blobs
+where revision hashes the manifest. The same layout is used locally under
+`Config.MODEL_MIRROR_DIRECTORY` and in `Config.MODEL_MIRROR_BUCKET` under
+`Config.MODEL_MIRROR_PREFIX` (a GCS bucket, or "file://<path>" for a local directory).
+
+A base model is resolved from the local mirror first, without any network call,
+else its missing blobs are fetched from the bucket mirror : in parallel, large blobs
+in parallel chunks, each verified against its crc32c and sha256. Only if both
+miss is the Hub name returned. Models are published to the mirrors with
+    python -m shared.model.model_mirror publish <model_name> [--upload]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from shared.bucket_sync import BucketSync, download, open_bucket, sha256
+from shared.config import Config, setup_logging
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIRECTORY = "blobs"
+MODELS_DIRECTORY = "models"
+SNAPSHOTS_DIRECTORY = "snapshots"
+MANIFEST_NAME = "manifest.json"
+# weights in these formats are not mirrored when the model has safetensors
+PICKLED_WEIGHTS = ["*.bin", "*.pt", "*.pth", "*.h5", "*.msgpack", "*.ckpt"]
+
+
+def model_key(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "--", model_name)
+
+
+def has_safetensors(path: str) -> bool:
+    return os.path.isdir(path) and any(name.endswith(".safetensors") for name in os.listdir(path))
+
+
+class ModelMirror:
+    def __init__(
+        self,
+        directory: str,
+        bucket=None,
+        prefix: str = "base_models",
+        chunk_size: int = 32 * 1024**2,
+        max_workers: int = 8,
+        retries: int = 3,
+    ):
+        """
+        Args:
+            directory: local mirror.
+            bucket: `GcsBucket` or `LocalBucket` of the bucket mirror, None for a local mirror only.
+            prefix: prefix of the mirror in the bucket.
+            chunk_size: blobs larger than this are downloaded in parallel chunks of this size.
+            max_workers: parallel downloads.
+            retries: attempts per blob before the fetch fails.
+        """
+        self.directory = directory
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.retries = retries
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, BLOBS_DIRECTORY, digest)
+
+    def _model_dir(self, model_name: str) -> str:
+        return os.path.join(self.directory, MODELS_DIRECTORY, model_key(model_name))
+
+    def _remote(self, *parts: str) -> str:
+        return "/".join([self.prefix, *parts]) if self.prefix else "/".join(parts)
+
+    @staticmethod
+    def revision(manifest: dict) -> str:
+        return hashlib.sha256(json.dumps(manifest["files"], sort_keys=True).encode()).hexdigest()[:16]
+
+    def read_manifest(self, model_name: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self._model_dir(model_name), MANIFEST_NAME), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def local_path(self, model_name: str) -> Optional[str]:
+        """Snapshot of the model in the local mirror, None if it is missing or incomplete"""
+        manifest = self.read_manifest(model_name)
+        if manifest is None:
+            return None
+        snapshot = os.path.join(self._model_dir(model_name), SNAPSHOTS_DIRECTORY, self.revision(manifest))
+        for path, entry in manifest["files"].items():
+            file_path = os.path.join(snapshot, path)
+            if not os.path.isfile(file_path) or os.path.getsize(file_path) != entry["size"]:
+                logger.warning("Mirror snapshot of %s is incomplete : %s", model_name, path)
+                return None
+        return snapshot
+
+    def resolve(self, model_name: str) -> str:
+        """
+        Local path of the model : a local directory as is, else the local mirror, else
+        fetched from the bucket mirror. Raises FileNotFoundError if no mirror has it.
+        """
+        if os.path.isdir(model_name):
+            return model_name
+        path = self.local_path(model_name)
+        if path is not None:
+            logger.info("Base model %s found in local mirror", model_name)
+            return path
+        if self.bucket is None:
+            raise FileNotFoundError(f"{model_name} is not in the local mirror {self.directory}")
+        return self.fetch(model_name)
+
+    def fetch(self, model_name: str) -> str:
+        """Download the blobs of the model missing from the local mirror, verified, and link its snapshot"""
+        manifest_blob = self.bucket.get(self._remote(MODELS_DIRECTORY, model_key(model_name), MANIFEST_NAME))
+        if manifest_blob is None:
+            raise FileNotFoundError(f"{model_name} is not in the bucket mirror")
+        os.makedirs(os.path.join(self.directory, BLOBS_DIRECTORY), exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mirror-chunk") as chunks:
+            with tempfile.TemporaryDirectory(dir=self.directory) as tmp_dir:
+                manifest_path = os.path.join(tmp_dir, MANIFEST_NAME)
+                download(self.bucket, manifest_blob, manifest_path, chunks, self.chunk_size, self.retries)
+                with open(manifest_path, encoding="utf-8") as f:
+                    manifest = json.load(f)
+
+            missing = {
+                entry["sha256"]: entry
+                for entry in manifest["files"].values()
+                if not os.path.isfile(self._blob_path(entry["sha256"]))
+            }
+            logger.info(
+                "Fetching %d of %d files of %s from the bucket mirror",
+                len(missing), len(manifest["files"]), model_name,
+            )
+
+            def fetch_blob(digest: str):
+                blob = self.bucket.get(self._remote(BLOBS_DIRECTORY, digest))
+                if blob is None:
+                    raise FileNotFoundError(f"Blob {digest} of {model_name} is not in the bucket mirror")
+                partial = f"{self._blob_path(digest)}.{os.getpid()}.partial"
+                try:
+                    download(
+                        self.bucket, blob, partial, chunks, self.chunk_size, self.retries,
+                        expected_sha256=digest,
+                    )
+                    os.replace(partial, self._blob_path(digest))
+                finally:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+
+            # one thread per file, the chunks of large files are downloaded on the chunk pool
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mirror") as files:
+                list(files.map(fetch_blob, missing))
+
+        return self._link_snapshot(model_name, manifest)
+
+    def _link_snapshot(self, model_name: str, manifest: dict) -> str:
+        """Link the snapshot of the manifest to its blobs, then make it the current one"""
+        model_dir = self._model_dir(model_name)
+        snapshots = os.path.join(model_dir, SNAPSHOTS_DIRECTORY)
+        snapshot = os.path.join(snapshots, self.revision(manifest))
+        os.makedirs(snapshots, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=snapshots, prefix=".tmp-")
+        try:
+            for path, entry in manifest["files"].items():
+                destination = os.path.join(tmp_dir, path)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                BucketSync._link(self._blob_path(entry["sha256"]), destination)
+            shutil.rmtree(snapshot, ignore_errors=True)
+            os.replace(tmp_dir, snapshot)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        # the manifest is written last : a snapshot is only used once complete
+        tmp_manifest = os.path.join(model_dir, f".{MANIFEST_NAME}.tmp")
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_manifest, os.path.join(model_dir, MANIFEST_NAME))
+        # earlier snapshots : files already memory-mapped by a running process stay readable
+        for name in os.listdir(snapshots):
+            if name != os.path.basename(snapshot) and not name.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(snapshots, name), ignore_errors=True)
+        logger.info("Base model %s mirrored in %s", model_name, snapshot)
+        return snapshot
+
+    def add(self, model_name: str, source: str) -> str:
+        """Add the files of a local model directory to the local mirror"""
+        os.makedirs(os.path.join(self.directory, BLOBS_DIRECTORY), exist_ok=True)
+        files: Dict[str, dict] = {}
+        for root, _, names in os.walk(source):
+            for name in names:
+                file_path = os.path.join(root, name)
+                path = os.path.relpath(file_path, source)
+                if path.startswith("."):
+                    continue
+                digest = sha256(file_path)
+                files[path] = {"sha256": digest, "size": os.path.getsize(file_path)}
+                if not os.path.isfile(self._blob_path(digest)):
+                    partial = f"{self._blob_path(digest)}.{os.getpid()}.partial"
+                    # realpath : Hub snapshots are symlinks to the Hub cache blobs
+                    shutil.copyfile(os.path.realpath(file_path), partial)
+                    os.replace(partial, self._blob_path(digest))
+        return self._link_snapshot(model_name, {"model_name": model_name, "files": files})
+
+    def upload(self, model_name: str):
+        """Upload the blobs of the model missing from the bucket mirror, then its manifest"""
+        manifest = self.read_manifest(model_name)
+        if manifest is None:
+            raise FileNotFoundError(f"{model_name} is not in the local mirror {self.directory}")
+        digests = {entry["sha256"] for entry in manifest["files"].values()}
+
+        def upload_blob(digest: str):
+            name = self._remote(BLOBS_DIRECTORY, digest)
+            if self.bucket.get(name) is None:
+                self.bucket.upload(self._blob_path(digest), name)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mirror") as files:
+            list(files.map(upload_blob, digests))
+        self.bucket.upload(
+            os.path.join(self._model_dir(model_name), MANIFEST_NAME),
+            self._remote(MODELS_DIRECTORY, model_key(model_name), MANIFEST_NAME),
+        )
+        logger.info("Base model %s uploaded to the bucket mirror", model_name)
+
+    def publish(self, model_name: str, source: Optional[str] = None, upload: bool = False) -> str:
+        """
+        Add a model to the local mirror, from a local directory or else from the Hub
+        (safetensors only when the model has them), and upload it to the bucket mirror.
+        """
+        if source is None:
+            from huggingface_hub import HfApi, snapshot_download
+
+            files = HfApi().list_repo_files(model_name)
+            ignore = PICKLED_WEIGHTS if any(name.endswith(".safetensors") for name in files) else None
+            source = snapshot_download(repo_id=model_name, ignore_patterns=ignore)
+        path = self.add(model_name, source)
+        if upload:
+            if self.bucket is None:
+                raise ValueError("No bucket mirror to upload to")
+            self.upload(model_name)
+        return path
+
+
+def default_mirror() -> ModelMirror:
+    bucket = (
+        open_bucket(project_id=Config.GCP_PROJECT_ID, bucket_name=Config.MODEL_MIRROR_BUCKET)
+        if Config.MODEL_MIRROR_BUCKET
+        else None
+    )
+    return ModelMirror(
+        directory=Config.MODEL_MIRROR_DIRECTORY,
+        bucket=bucket,
+        prefix=Config.MODEL_MIRROR_PREFIX,
+        chunk_size=Config.GCS_DOWNLOAD_CHUNK_MB * 1024**2,
+        max_workers=Config.GCS_DOWNLOAD_WORKERS,
+    )
+
+
+def resolve_base_model(model_name: str, mirror: Optional[ModelMirror] = None) -> str:
+    """Local path of the base model from the mirrors, else its name for the Hub"""
+    try:
+        return (mirror or default_mirror()).resolve(model_name)
+    except Exception as e:
+        logger.warning("Base model %s not mirrored, loading it from the Hub : %s", model_name, e)
+        return model_name
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Base model mirror")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    publish = subparsers.add_parser("publish", help="add a base model to the mirrors")
+    publish.add_argument("model_name", nargs="?", default=Config.MODEL_NAME)
+    publish.add_argument("--source", help="local model directory, else downloaded from the Hub")
+    publish.add_argument("--upload", action="store_true", help="also upload it to the bucket mirror")
+    args = parser.parse_args()
+
+    path = default_mirror().publish(args.model_name, source=args.source, upload=args.upload)
+    print(path)
@@ -0,0 +1,211 @@
+"""
+Precision policy of the served model.
+
+- fp32 : full precision
+- bf16 : half the weight memory, used by default on CPUs with native bf16 support (AVX512-BF16 / AMX)
+- int8 : dynamic int8 quantization of the linear layers, CPU only, a quarter of the linear weights memory ;
+         requires a merged adapter (`Config.MERGE_ADAPTER`), LoRA layers read the dtype of their weights
+- auto : bf16 on CPUs supporting it, else fp32 ; fp16 on mps and fp32 on cuda as before
+
+`self_check` compares a reduced precision model with the outputs of the fp32 model on a
+fixed claim set. The fp32 outputs are computed offline, once per model and adapter version,
+and stored as JSON : the served process never loads a second, full precision copy.
+
+    python -m shared.model.precision   # writes the reference of Config.ADAPTER_NAME
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+
+import torch
+
+from shared.config import Config
+from shared.system_utils import cpu_supports_bf16
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("auto", "fp32", "bf16", "fp16", "int8")
+
+DTYPES = {
+    "fp32": torch.float32,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+    # int8 loads in fp32, the linear layers are quantized after loading
+    "int8": torch.float32,
+}
+
+# fixed claims of the precision self-check, one per category
+SELF_CHECK_QUOTES = [
+    "The new stadium will open next spring.",
+    "Climate change is not happening, the planet has been cooling for decades.",
+    "The climate has always changed, humans have nothing to do with it.",
+    "A warmer climate will be good for agriculture and fewer people will die from cold.",
+    "Carbon taxes will destroy jobs and make energy unaffordable for families.",
+    "Climate models are unreliable and have failed every prediction.",
+    "Climate scientists exaggerate the crisis to keep their research grants.",
+    "We need coal and gas, renewables can never power a modern economy.",
+]
+
+
+def resolve_precision(precision: str, device: str) -> str:
+    """Concrete precision for the device : resolves auto, falls back to fp32 for int8 outside CPU"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+    if precision == "auto":
+        if device == "mps":
+            return "fp16"
+        if device == "cpu" and cpu_supports_bf16():
+            return "bf16"
+        return "fp32"
+    if precision == "int8" and device != "cpu":
+        logger.warning("int8 dynamic quantization is CPU only, using fp32 on %s", device)
+        return "fp32"
+    return precision
+
+
+def check_precision(precision: str, merge_adapter: bool):
+    """
+    int8 needs the adapter merged into the base model : PEFT LoRA layers read
+    `lora_A.weight.dtype`, a method on dynamically quantized linear layers.
+    """
+    if precision == "int8" and not merge_adapter:
+        raise ValueError("int8 precision requires a merged adapter, set MERGE_ADAPTER=true")
+
+
+def apply_precision(model, precision: str):
+    """Quantize the linear layers of a loaded model for int8, returns the model to serve"""
+    if precision != "int8":
+        return model
+    if any("lora_" in name for name, _ in model.named_modules()):
+        raise ValueError("int8 precision requires a model without LoRA layers, merge the adapter first")
+    logger.info("Quantizing linear layers to int8")
+    # in place : avoids holding an fp32 copy of the model during quantization
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def footprint_bytes(model) -> int:
+    """Memory of the weights, including packed quantized weights which are not parameters"""
+
+    def _bytes(value) -> int:
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(_bytes(v) for v in value)
+        return 0
+
+    return sum(_bytes(value) for value in model.state_dict().values())
+
+
+def _throughput(llm, quotes: List[str], max_explanation_tokens: int) -> float:
+    """Generated tokens per second over quotes"""
+    start = time.perf_counter()
+    outputs = llm.generate_batch(quotes=quotes, max_explanation_tokens=max_explanation_tokens)
+    duration = time.perf_counter() - start
+    tokens = sum(
+        1 + len(llm.tokenizer(explanation, add_special_tokens=False)["input_ids"])
+        for _, explanation in outputs
+    )
+    return tokens / duration if duration else 0.0
+
+
+def reference_path(directory: str, model_name: str, adapter: str) -> str:
+    """File of the fp32 reference of a base model and adapter slot (name and version)"""
+    return os.path.join(directory, f"{model_name.replace('/', '--')}.{adapter}.json")
+
+
+def reference_outputs(
+    llm,
+    quotes: List[str] = SELF_CHECK_QUOTES,
+    max_explanation_tokens: int = 32,
+) -> dict:
+    """Outputs of an fp32 LLMWrapper on quotes, with its active adapter : category probabilities, memory and tokens/s"""
+    outputs = llm.classify_fast(quotes=quotes)
+    return {
+        "model_name": llm.model_name,
+        "adapter": llm.active_adapter,
+        "precision": llm.precision,
+        "quotes": list(quotes),
+        "categories": [category for category, _ in outputs],
+        "probabilities": [probabilities for _, probabilities in outputs],
+        "footprint_mb": footprint_bytes(llm.model) / 1024**2,
+        "tokens_per_s": _throughput(llm, quotes, max_explanation_tokens),
+    }
+
+
+def write_reference(llm, directory: str = Config.PRECISION_REFERENCE_DIRECTORY) -> str:
+    """Compute and store the reference outputs of an fp32 LLMWrapper ; path of the file"""
+    if llm.precision != "fp32":
+        raise ValueError(f"The reference must be computed in fp32, not {llm.precision}")
+    path = reference_path(directory, llm.model_name, llm.active_adapter)
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(reference_outputs(llm), f, indent=1)
+    logger.info("Precision reference written to %s", path)
+    return path
+
+
+def load_reference(model_name: str, adapter: str, directory: str = Config.PRECISION_REFERENCE_DIRECTORY) -> Optional[dict]:
+    """Stored fp32 reference of a base model and adapter slot, None if it was not computed"""
+    try:
+        with open(reference_path(directory, model_name, adapter), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def self_check(llm, reference: dict, max_explanation_tokens: int = 32) -> dict:
+    """
+    Compare llm with the stored fp32 reference outputs (`reference_outputs`) on their quotes :
+    category agreement rate and largest category probability difference (single forward pass),
+    weight memory and generation tokens/s. The reference tokens/s were measured where it was computed.
+    """
+    quotes = reference["quotes"]
+    outputs = llm.classify_fast(quotes=quotes)
+    agreement = sum(
+        category == expected for (category, _), expected in zip(outputs, reference["categories"])
+    ) / len(quotes)
+    probability_delta = max(
+        abs(probabilities[category] - expected[category])
+        for (_, probabilities), expected in zip(outputs, reference["probabilities"])
+        for category in expected
+    )
+
+    report = {
+        "precision": llm.precision,
+        "agreement_rate": agreement,
+        "max_probability_delta": probability_delta,
+        "footprint_mb": footprint_bytes(llm.model) / 1024**2,
+        "reference_footprint_mb": reference["footprint_mb"],
+        "tokens_per_s": _throughput(llm, quotes, max_explanation_tokens),
+        "reference_tokens_per_s": reference["tokens_per_s"],
+    }
+    logger.info("Precision self-check: %s", report)
+    return report
+
+
+if __name__ == "__main__":
+    from shared.config import setup_logging
+    from shared.model.model import LLMWrapper
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Write the fp32 reference outputs of the precision self-check")
+    parser.add_argument("--adapter", default=Config.ADAPTER_NAME)
+    parser.add_argument("--directory", default=Config.PRECISION_REFERENCE_DIRECTORY)
+    args = parser.parse_args()
+
+    llm = LLMWrapper(
+        local_directory=Config.LOCAL_DIRECTORY,
+        adapter_name=args.adapter,
+        model_name=Config.MODEL_NAME,
+        project_id=Config.GCP_PROJECT_ID,
+        bucket_name=Config.GCS_BUCKET_NAME,
+        precision="fp32",
+    )
+    write_reference(llm, directory=args.directory)
@@ -0,0 +1,94 @@
+"""
+KV cache of the prompt prefix shared by every claim.
+
+Every generation prompt starts with the same tokens : the chat template around
+`PromptTemplate.SYSTEM_MSG` and the `PromptTemplate.USER_TEMPLATE` header, up to the
+line holding the claim. Their past key/values are computed once and reused, so
+only the claim-specific suffix goes through prefill.
+
+Batches are padded *between* the prefix and the suffixes ("middle padding") :
+the prefix keeps the positions it was cached with, pads are masked out,
+and position ids are derived from the attention mask.
+"""
+
+import copy
+import logging
+from typing import Hashable, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixCache:
+    def __init__(self, input_ids: List[int], past_key_values, key: Hashable):
+        """
+        Args:
+            input_ids: token ids of the shared prefix.
+            past_key_values: model cache holding the prefix key/values, batch size 1.
+            key: identity of the model the cache was computed with, e.g. the adapter slot.
+        """
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.key = key
+
+    @classmethod
+    def build(
+        cls,
+        model,
+        tokenizer,
+        prefix_text: str,
+        device: str,
+        key: Hashable,
+        model_kwargs: Optional[dict] = None,
+    ) -> "PrefixCache":
+        """Run the prefill of prefix_text once and keep its key/values, model_kwargs e.g. select the adapter"""
+        input_ids = tokenizer(prefix_text)["input_ids"]
+        with torch.no_grad():
+            outputs = model(
+                input_ids=torch.tensor([input_ids], device=device),
+                use_cache=True,
+                **(model_kwargs or {}),
+            )
+        logger.info("Prefix cache built : %d tokens (key=%s)", len(input_ids), key)
+        return cls(input_ids=input_ids, past_key_values=outputs.past_key_values, key=key)
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def matches(self, input_ids: List[int]) -> bool:
+        return input_ids[: len(self.input_ids)] == self.input_ids
+
+    def expand(self, batch_size: int):
+        """Fresh copy of the cache for a batch : generation appends to the cache in place"""
+        past_key_values = copy.deepcopy(self.past_key_values)
+        if batch_size > 1:
+            past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+
+    def encode(
+        self, encoded: List[List[int]], pad_token_id: int, device: str
+    ) -> Optional[Tuple[dict, object]]:
+        """
+        Assemble a batch from token ids of full prompts starting with the prefix.
+        Returns (inputs, past_key_values) with middle padding, or None if a prompt does not start with the prefix.
+        """
+        if not all(self.matches(ids) for ids in encoded):
+            return None
+
+        n = len(self.input_ids)
+        suffixes = [ids[n:] for ids in encoded]
+        width = max(len(suffix) for suffix in suffixes)
+        input_ids = [
+            self.input_ids + [pad_token_id] * (width - len(suffix)) + suffix
+            for suffix in suffixes
+        ]
+        attention_mask = [
+            [1] * n + [0] * (width - len(suffix)) + [1] * len(suffix)
+            for suffix in suffixes
+        ]
+        inputs = {
+            "input_ids": torch.tensor(input_ids, device=device),
+            "attention_mask": torch.tensor(attention_mask, device=device),
+        }
+        return inputs, self.expand(len(encoded))
@@ -0,0 +1,92 @@
+"""
+Generation prompt tokenized once, around the quote.
+
+The rendered chat template is split in three :
+- prefix  : everything up to the line holding the quote, tokenized once
+- segment : the quote line up to the next special token, tokenized per request
+- suffix  : from that special token to the end of the prompt, tokenized once
+Special tokens are never merged with their neighbours, and the prefix ends with a newline,
+so prefix_ids + tokenize(segment) + suffix_ids gives the same ids as tokenizing the whole prompt.
+This is checked on a set of claims at load time, see `verify`.
+"""
+
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = "{quote}"
+
+# claims checked at load time : spliced and full tokenization must give the same ids
+VERIFICATION_QUOTES = [
+    "Climate change is not happening",
+    '"Quoted" claims, with punctuation... and numbers: 1.5°C / 2050!',
+    "  leading and trailing spaces  ",
+    "The assistant said CO2 is plant food",
+    "Le réchauffement climatique est un mythe 🌍",
+    "Multi-line\nclaim\n\nwith blank lines",
+    "{braces} ### Answer: category: 3",
+]
+
+
+class TokenizedPromptTemplate:
+    def __init__(self, tokenizer, rendered: str, placeholder: str = PLACEHOLDER):
+        """
+        Args:
+            tokenizer: tokenizer of the model.
+            rendered: full generation prompt rendered with placeholder as the quote.
+            placeholder: text standing for the quote in rendered.
+        """
+        self.tokenizer = tokenizer
+        self.verified = False
+
+        start = rendered.index(placeholder)
+        end = start + len(placeholder)
+        # prefix stops at the start of the quote line
+        line_start = rendered.rfind("\n", 0, start) + 1
+        # suffix starts at the first special token after the quote
+        suffix_start = self._find_special_token(rendered, end)
+        if suffix_start is None:
+            suffix_start = len(rendered)
+
+        self.prefix_text = rendered[:line_start]
+        self.segment_head = rendered[line_start:start]
+        self.segment_tail = rendered[end:suffix_start]
+        self.suffix_text = rendered[suffix_start:]
+
+        self.prefix_ids = tokenizer(self.prefix_text)["input_ids"]
+        self.suffix_ids = (
+            tokenizer(self.suffix_text, add_special_tokens=False)["input_ids"]
+            if self.suffix_text
+            else []
+        )
+
+    def _find_special_token(self, text: str, start: int) -> Optional[int]:
+        positions = [
+            text.find(token, start)
+            for token in self.tokenizer.all_special_tokens
+            if token and text.find(token, start) != -1
+        ]
+        return min(positions) if positions else None
+
+    def encode(self, quotes: List[str]) -> List[List[int]]:
+        """Token ids of the prompts of quotes, only the quote lines are tokenized"""
+        segments = [self.segment_head + quote + self.segment_tail for quote in quotes]
+        segment_ids = self.tokenizer(segments, add_special_tokens=False)["input_ids"]
+        return [self.prefix_ids + ids + self.suffix_ids for ids in segment_ids]
+
+    def verify(self, expected: List[List[int]], quotes: List[str] = VERIFICATION_QUOTES) -> bool:
+        """
+        Compare spliced ids of quotes with the ids of the full tokenization (expected).
+        Sets and returns `verified`.
+        """
+        self.verified = self.encode(quotes) == expected
+        if self.verified:
+            logger.info(
+                "Prompt template tokenized : %d prefix ids, %d suffix ids",
+                len(self.prefix_ids),
+                len(self.suffix_ids),
+            )
+        else:
+            logger.warning("Spliced prompt ids differ from full tokenization, splicing disabled")
+        return self.verified
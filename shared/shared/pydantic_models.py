@@ -1,6 +1,6 @@
 import logging
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
 
@@ -21,6 +21,10 @@ class ClassifyResponse(BaseModel):
     )
     category: str
     explanation: str
+    probabilities: Optional[Dict[str, float]] = None
+    # True when answered with the prediction of a near-duplicate claim, with its estimated similarity
+    approximate: bool = False
+    similarity: Optional[float] = None
 
 
 class FeedbackRequest(BaseModel):
@@ -31,14 +35,53 @@ class FeedbackRequest(BaseModel):
         ..., strip_whitespace=True, min_length=1
     )
 
+class FeedbackBatchRequest(BaseModel):
+    instances: List[FeedbackRequest] = Field(..., min_length=1, max_length=1000)
+
+
+class FeedbackBatchResponse(BaseModel):
+    # rows queued for insertion, written asynchronously
+    accepted: int
+
+
+class PredictParameters(BaseModel):
+    # generate : category and explanation decoded by the model
+    # classify_fast : category and per-category probabilities from a single forward pass, no explanation
+    mode: Literal["generate", "classify_fast"] = "generate"
+    # adapter serving the claims, chosen by the routing policy if None
+    adapter: Optional[str] = None
+
+
 class PredictRequest(BaseModel):
     instances: List[ClassifyRequest]
+    parameters: PredictParameters = PredictParameters()
+
+
+class Usage(BaseModel):
+    tokens_in: int = 0
+    tokens_out: int = 0
+    latency_s: float = 0.0
+    # share of the energy of the inference call, estimated by the process-wide energy meter
+    energy_j: float = 0.0
+    co2_g: float = 0.0
+    # True when the meter has no power counter (RAPL) : energy_j and co2_g are estimated from CPU time
+    energy_estimated: bool = False
+
+
+class PredictMetadata(BaseModel):
+    # totals of the request, latency_s is the latency of the whole request
+    usage: Usage
+    # usage of each prediction, None when served from the caches without inference
+    instances: List[Optional[Usage]]
 
 
 class PredictResponse(BaseModel):
     predictions: List[ClassifyResponse]
+    metadata: Optional[PredictMetadata] = None
 
 
 # BQ
 class FeedbackInsertionBQ(FeedbackRequest):
     created_at: datetime  # TIMESTAMP
+    # identity of the row, also its streaming insert id ; None for rows inserted before it was stored
+    insert_id: Optional[str] = None
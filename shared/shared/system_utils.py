@@ -24,6 +24,20 @@ def get_memory_info():
         available_gb = mem.available / 1024**3
         return total_gb, available_gb
 
+def cpu_supports_bf16():
+    """True if the CPU has native bf16 instructions (AVX512-BF16 or AMX)"""
+    if platform.system() != "Linux":
+        return False
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    flags = set(line.split(':', 1)[1].split())
+                    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+    except OSError:
+        pass
+    return False
+
 def format_memory_info(total_gb, available_gb, model_size=None):
     result = []
     result.append(f"Total Memory    : {total_gb:.2f} GB")
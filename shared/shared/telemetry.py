@@ -0,0 +1,191 @@
+"""
+In-process serving telemetry.
+
+Inference calls record their latency, token counts and estimated energy into an
+aggregator, which costs a lock and a few additions : nothing on the request path
+talks to MLflow. A background thread periodically turns the aggregated records into
+a summary and queues it on the MLflow logging backend ; a slow or unreachable MLflow
+server only delays that summary.
+
+The energy of each call is measured by the process-wide energy meter
+(`shared.energy`). Totals of requests, tokens and energy are counted for every
+call, sampling only applies to the latency and per-request details of a window.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from shared.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def mlflow_sink(experiment_name: str = "generate") -> Callable[[dict], None]:
+    """Sink logging each summary as one MLflow run, through the batched logging backend"""
+
+    def sink(summary: dict):
+        from shared.mlflow_backend import get_backend
+
+        backend = get_backend()
+        handle = backend.create_run(experiment_name, run_name="serving-summary")
+        backend.log_metrics(handle, {
+            key: value for key, value in summary.items() if isinstance(value, (int, float))
+        })
+        backend.log_params(handle, {"sample_rate": summary["sample_rate"]})
+        backend.end_run(handle)
+
+    return sink
+
+
+class InferenceTelemetry:
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        flush_interval_s: float = 60,
+        sink: Optional[Callable[[dict], None]] = None,
+    ):
+        """
+        Args:
+            sample_rate: fraction of inference calls whose details (latency, tokens, energy) are aggregated.
+            flush_interval_s: interval between two summaries.
+            sink: callable receiving each summary, e.g. `mlflow_sink()` ; summaries are only logged if None.
+        """
+        self.sample_rate = sample_rate
+        self.flush_interval_s = flush_interval_s
+        self.sink = sink
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset()
+        self._totals = {
+            "calls": 0,
+            "requests": 0,
+            "tokens_in": 0,
+            "tokens_out": 0,
+            "energy_j": 0.0,
+            "co2_g": 0.0,
+            "summaries": 0,
+            "sink_errors": 0,
+        }
+
+    def _reset(self):
+        self._window_start = time.time()
+        self._calls = 0
+        self._requests = 0
+        self._sampled = {
+            "latencies_s": [],
+            "requests": 0,
+            "tokens_in": 0,
+            "tokens_out": 0,
+            "energy_j": 0.0,
+        }
+
+    def record(
+        self,
+        latency_s: float,
+        tokens_in: int,
+        tokens_out: int,
+        energy_j: float,
+        co2_g: float = 0.0,
+        requests: int = 1,
+    ):
+        """Record one inference call serving `requests` claims"""
+        with self._lock:
+            self._calls += 1
+            self._requests += requests
+            totals = self._totals
+            totals["calls"] += 1
+            totals["requests"] += requests
+            totals["tokens_in"] += tokens_in
+            totals["tokens_out"] += tokens_out
+            totals["energy_j"] += energy_j
+            totals["co2_g"] += co2_g
+            if random.random() >= self.sample_rate:
+                return
+            sampled = self._sampled
+            sampled["latencies_s"].append(latency_s)
+            sampled["requests"] += requests
+            sampled["tokens_in"] += tokens_in
+            sampled["tokens_out"] += tokens_out
+            sampled["energy_j"] += energy_j
+
+    def summary(self, reset: bool = False) -> dict:
+        """Aggregates of the current window"""
+        with self._lock:
+            sampled = self._sampled
+            latencies = sampled["latencies_s"]
+            requests = sampled["requests"]
+            summary = {
+                "window_s": time.time() - self._window_start,
+                "sample_rate": self.sample_rate,
+                "calls": self._calls,
+                "requests": self._requests,
+                "sampled_calls": len(latencies),
+                "latency_s_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                "latency_s_p50": _percentile(latencies, 0.5),
+                "latency_s_p95": _percentile(latencies, 0.95),
+                "tokens_in_per_request": sampled["tokens_in"] / requests if requests else 0.0,
+                "tokens_out_per_request": sampled["tokens_out"] / requests if requests else 0.0,
+                "energy_j_per_request": sampled["energy_j"] / requests if requests else 0.0,
+                "energy_j_sampled": sampled["energy_j"],
+            }
+            if reset:
+                self._reset()
+            return summary
+
+    def flush(self):
+        """Send the summary of the current window to the sink, never raises"""
+        summary = self.summary(reset=True)
+        if not summary["calls"]:
+            return
+        logger.info("Inference telemetry: %s", summary)
+        if self.sink is None:
+            return
+        try:
+            self.sink(summary)
+            self._totals["summaries"] += 1
+        except Exception as e:
+            self._totals["sink_errors"] += 1
+            logger.warning("Telemetry summary not sent: %s", e)
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread, after a last flush"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval_s):
+            self.flush()
+        self.flush()
+
+    def metrics(self) -> dict:
+        return {**self._totals, "current_window": self.summary()}
+
+
+# process-wide telemetry of the served model, started by the API
+telemetry = InferenceTelemetry(
+    sample_rate=Config.TELEMETRY_SAMPLE_RATE,
+    flush_interval_s=Config.TELEMETRY_FLUSH_INTERVAL_S,
+    sink=mlflow_sink(experiment_name="generate") if Config.TELEMETRY_MLFLOW else None,
+)
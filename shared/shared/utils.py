@@ -1,4 +1,5 @@
 import logging
+from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
@@ -12,3 +13,12 @@ def validate_required_fields(**kwargs):
             logger.info(f"Required - {name:<20} : {val}")
             if not val:
                 raise ValueError(f"Missing {name}.")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ISO date or timestamp, UTC if it has no timezone"""
+    # "Z" suffix, as serialized by pydantic, is only parsed by fromisoformat from Python 3.11
+    timestamp = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+pytest.importorskip("google_crc32c")
+
+from shared.bucket_sync import MANIFEST_NAME, BucketSync, LocalBucket
+
+
+class CountingBucket(LocalBucket):
+    """Local bucket counting downloaded ranges, failing the first `failures` of them"""
+
+    def __init__(self, root, failures=0):
+        super().__init__(root)
+        self.downloads = []
+        self.failures = failures
+
+    def download(self, blob, f, start, end):
+        self.downloads.append((blob.name, start, end))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("transient")
+        super().download(blob, f, start, end)
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_sync_downloads_only_changes(tmp_path):
+    bucket_root = tmp_path / "bucket"
+    _write(str(bucket_root / "adapter" / "adapter_config.json"), b"{}")
+    _write(str(bucket_root / "adapter" / "adapter_model.safetensors"), os.urandom(1000))
+    bucket = CountingBucket(str(bucket_root))
+    sync = BucketSync(bucket, chunk_size=256, max_workers=4)
+    local = str(tmp_path / "models" / "adapter")
+    os.makedirs(os.path.dirname(local))
+
+    assert sync.sync("adapter/", local)
+    weights = bucket_root / "adapter" / "adapter_model.safetensors"
+    assert open(os.path.join(local, "adapter_model.safetensors"), "rb").read() == weights.read_bytes()
+    # 1000 bytes in chunks of 256 and the config
+    assert len(bucket.downloads) == 5
+    assert os.path.exists(os.path.join(local, MANIFEST_NAME))
+
+    # no change : no download, same version
+    bucket.downloads.clear()
+    version = os.path.realpath(local)
+    assert not sync.sync("adapter/", local)
+    assert bucket.downloads == [] and os.path.realpath(local) == version
+
+    # one file changed : only that file is downloaded, into a new version
+    _write(str(bucket_root / "adapter" / "adapter_config.json"), b'{"r": 8}')
+    assert sync.sync("adapter/", local)
+    assert [name for name, _, _ in bucket.downloads] == ["adapter/adapter_config.json"]
+    assert open(os.path.join(local, "adapter_config.json"), "rb").read() == b'{"r": 8}'
+    # the replaced version stays readable until the next sync
+    assert os.path.exists(version)
+
+    previous = os.path.realpath(local)
+    _write(str(bucket_root / "adapter" / "adapter_config.json"), b'{"r": 16}')
+    assert sync.sync("adapter/", local)
+    assert os.path.exists(previous) and not os.path.exists(version)
+
+
+def test_failed_downloads_are_retried(tmp_path):
+    _write(str(tmp_path / "bucket" / "adapter" / "weights"), b"0123456789")
+    bucket = CountingBucket(str(tmp_path / "bucket"), failures=2)
+    local = str(tmp_path / "adapter")
+
+    assert BucketSync(bucket, retries=3).sync("adapter/", local)
+    assert open(os.path.join(local, "weights"), "rb").read() == b"0123456789"
+
+    bucket = CountingBucket(str(tmp_path / "bucket"), failures=3)
+    _write(str(tmp_path / "bucket" / "adapter" / "weights"), b"changed")
+    with pytest.raises(RuntimeError):
+        BucketSync(bucket, retries=3).sync("adapter/", local)
+    # the previous version is still served
+    assert open(os.path.join(local, "weights"), "rb").read() == b"0123456789"
@@ -0,0 +1,102 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from shared.model.decoding import AnswerStoppingCriteria, CategoryLogitsProcessor, parse_answer
+
+# toy vocabulary : one string per id, decoded by concatenation
+VOCAB = ["<pad>", "0", "1", "2", "3", "\n", "\n\n", "explanation", " :", " warming", " is", " real", "##", " Answer", "category", ":"]
+IDS = {token: i for i, token in enumerate(VOCAB)}
+CATEGORY_IDS = [IDS[digit] for digit in "0123"]
+
+
+class ToyTokenizer:
+    pad_token_id = IDS["<pad>"]
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return [
+            "".join(VOCAB[i] for i in sequence if not (skip_special_tokens and i == self.pad_token_id))
+            for sequence in sequences.tolist()
+        ]
+
+
+def _ids(*tokens):
+    return [IDS[token] for token in tokens]
+
+
+# left padded prompts ending with the answer header, the second one showing an example answer
+PROMPTS = torch.tensor([
+    _ids("<pad>", "<pad>", "<pad>", "<pad>", "<pad>", "##", " Answer", ":", "\n"),
+    _ids("category", ":", "3", "\n", "##", "##", " Answer", ":", "\n"),
+])
+PROMPT_LENGTH = PROMPTS.shape[1]
+
+
+def _step(input_ids, *tokens):
+    return torch.cat([input_ids, torch.tensor([[IDS[token]] for token in tokens])], dim=1)
+
+
+def test_category_processor_only_allows_digits_on_the_first_token():
+    processor = CategoryLogitsProcessor(category_ids=CATEGORY_IDS, prompt_length=PROMPT_LENGTH)
+    scores = torch.randn(2, len(VOCAB))
+    # the model prefers a word to a digit
+    scores[:, IDS[" warming"]] = 100.0
+
+    first = processor(PROMPTS, scores.clone())
+    assert first.argmax(dim=1).tolist() == [CATEGORY_IDS[i] for i in scores[:, CATEGORY_IDS].argmax(dim=1).tolist()]
+    assert torch.isinf(first[:, [i for i in range(len(VOCAB)) if i not in CATEGORY_IDS]]).all()
+    assert torch.equal(first[:, CATEGORY_IDS], scores[:, CATEGORY_IDS])
+
+    # later tokens are free
+    later = processor(_step(PROMPTS, "2", "1"), scores.clone())
+    assert torch.equal(later, scores)
+
+
+def test_stopping_criteria_stops_each_sequence_on_the_end_marker():
+    criteria = AnswerStoppingCriteria(
+        tokenizer=ToyTokenizer(), prompt_length=PROMPT_LENGTH, max_explanation_tokens=10, window=4
+    )
+    scores = torch.zeros(2, len(VOCAB))
+
+    # the markers of the prompt (second row) do not count
+    input_ids = _step(PROMPTS, "2", "1")
+    assert criteria(input_ids, scores).tolist() == [False, False]
+    for tokens in [("\n\n", "\n\n"), ("explanation", "explanation"), (" :", " :"), (" warming", " warming")]:
+        input_ids = _step(input_ids, *tokens)
+        assert criteria(input_ids, scores).tolist() == [False, False]
+
+    # a new section starts in the first sequence only
+    input_ids = _step(input_ids, "\n", " is")
+    input_ids = _step(input_ids, "##", " real")
+    assert criteria(input_ids, scores).tolist() == [True, False]
+
+
+def test_stopping_criteria_stops_every_sequence_over_budget():
+    criteria = AnswerStoppingCriteria(
+        tokenizer=ToyTokenizer(), prompt_length=PROMPT_LENGTH, max_explanation_tokens=2
+    )
+    scores = torch.zeros(2, len(VOCAB))
+
+    assert criteria(_step(_step(PROMPTS, "2", "1"), " is", " is"), scores).tolist() == [False, False]
+    assert criteria(_step(_step(_step(PROMPTS, "2", "1"), " is", " is"), " real", " real"), scores).tolist() == [True, True]
+
+
+def test_parse_answer_reads_the_generated_ids_only():
+    output_ids = PROMPTS
+    for tokens in [("2", "1"), ("\n\n", "\n\n"), ("explanation", "explanation"), (" :", " :"), (" warming", " is"), (" is", " real")]:
+        output_ids = _step(output_ids, *tokens)
+    output_ids = _step(output_ids, "\n", "<pad>")
+    output_ids = _step(output_ids, "##", "<pad>")
+
+    answers = ToyTokenizer().batch_decode(output_ids[:, PROMPT_LENGTH:], skip_special_tokens=True)
+    assert [parse_answer(answer) for answer in answers] == [("2", "warming is"), ("1", "is real")]
+
+    # the example answer of the second prompt would be parsed from the full sequence
+    full = ToyTokenizer().batch_decode(output_ids, skip_special_tokens=True)
+    assert parse_answer(full[1])[0] == "3"
+
+
+def test_parse_answer_without_category():
+    assert parse_answer(" warming is real") == ("", "warming is real")
+    assert parse_answer("## Answer: category : 4\n\nexplanation : real") == ("4", "real")
@@ -0,0 +1,107 @@
+import threading
+
+from shared.energy import EnergyMeter
+
+
+def _rapl(tmp_path, energy_uj, max_range_uj=10**9):
+    domain = tmp_path / "intel-rapl:0"
+    domain.mkdir(exist_ok=True)
+    (domain / "energy_uj").write_text(str(energy_uj))
+    (domain / "max_energy_range_uj").write_text(str(max_range_uj))
+    return str(tmp_path / "intel-rapl:[0-9]*")
+
+
+def test_sequential_spans_get_their_own_energy(tmp_path):
+    pattern = _rapl(tmp_path, 0)
+    meter = EnergyMeter(carbon_intensity_g_per_kwh=360, rapl_glob=pattern)
+    assert meter.source == "rapl"
+
+    # idle energy before the span is not attributed
+    _rapl(tmp_path, 5_000_000)
+    with meter.span() as span:
+        _rapl(tmp_path, 8_000_000)
+    _rapl(tmp_path, 9_000_000)
+    with meter.span() as other:
+        _rapl(tmp_path, 10_000_000)
+
+    assert span.energy_j == 3.0
+    assert other.energy_j == 1.0
+    assert span.co2_g == 3.0 / 3.6e6 * 360
+    metrics = meter.metrics()
+    assert metrics["energy_j"] == 10.0
+    assert metrics["attributed_j"] == 4.0
+
+
+def test_counter_wraparound(tmp_path):
+    pattern = _rapl(tmp_path, 900, max_range_uj=999)
+    meter = EnergyMeter(rapl_glob=pattern)
+    with meter.span() as span:
+        _rapl(tmp_path, 100, max_range_uj=999)
+    assert abs(span.energy_j - 200e-6) < 1e-12
+
+
+def test_concurrent_spans_split_energy(tmp_path):
+    pattern = _rapl(tmp_path, 0)
+    meter = EnergyMeter(rapl_glob=pattern)
+    opened = threading.Barrier(2)
+    release = threading.Event()
+    spans = []
+
+    def work():
+        with meter.span() as span:
+            spans.append(span)
+            opened.wait()
+            release.wait()
+
+    threads = [threading.Thread(target=work) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while len(spans) < 2:
+        pass
+    _rapl(tmp_path, 4_000_000)
+    with meter._lock:
+        meter._sample()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert abs(sum(span.energy_j for span in spans) - 4.0) < 1e-9
+
+
+def test_cpu_time_fallback_is_flagged_as_estimated(tmp_path):
+    meter = EnergyMeter(watts_per_core=10.0, rapl_glob=str(tmp_path / "intel-rapl:[0-9]*"))
+    assert meter.source == "cpu_time"
+    assert meter.estimated and meter.metrics()["estimated"]
+
+    assert not EnergyMeter(rapl_glob=_rapl(tmp_path, 0)).estimated
+
+
+def test_idle_power_is_not_charged_to_spans(tmp_path):
+    pattern = _rapl(tmp_path, 0)
+    meter = EnergyMeter(rapl_glob=pattern)
+
+    # 10 s without spans at 5 W
+    meter._last_t -= 10
+    _rapl(tmp_path, 50_000_000)
+    with meter.span() as span:
+        # 2 s at 5 W idle + 12 J of work
+        meter._last_t -= 2
+        _rapl(tmp_path, 72_000_000)
+
+    # up to the real time elapsed between the readings
+    assert abs(meter.idle_w - 5.0) < 0.01
+    assert abs(span.energy_j - 12.0) < 0.1
+    metrics = meter.metrics()
+    assert abs(metrics["idle_j"] - 10.0) < 0.1
+    assert abs(metrics["attributed_j"] - 12.0) < 0.1
+
+
+def test_configured_idle_power(tmp_path):
+    pattern = _rapl(tmp_path, 0)
+    meter = EnergyMeter(rapl_glob=pattern, idle_w=4.0)
+    with meter.span() as span:
+        meter._last_t -= 1
+        _rapl(tmp_path, 3_000_000)
+    # never below zero
+    assert span.energy_j == 0.0
+    assert meter.idle_w == 4.0
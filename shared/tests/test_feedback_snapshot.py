@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+
+from shared.data.feedback_snapshot import FeedbackSnapshot
+
+START = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+class FakeTable:
+    """In-memory feedback table, recording the timestamps it was read after"""
+
+    def __init__(self):
+        self.rows = []
+        self.reads = []
+
+    def insert(self, minutes, claim):
+        self.rows.append({
+            "created_at": START + timedelta(minutes=minutes),
+            "user_claim": f" {claim} ",
+            "predicted_category": 1,
+            "correct_category": 2,
+            "assistant_explanation": None,
+            "insert_id": f"id-{len(self.rows)}",
+        })
+
+    def __call__(self, after):
+        self.reads.append(after)
+        rows = [row for row in self.rows if after is None or row["created_at"] > after]
+        return pa.Table.from_pylist(rows, schema=pa.schema([
+            ("created_at", pa.timestamp("us", tz="UTC")),
+            ("user_claim", pa.string()),
+            ("predicted_category", pa.int64()),
+            ("correct_category", pa.int64()),
+            ("assistant_explanation", pa.string()),
+            ("insert_id", pa.string()),
+        ]))
+
+
+def test_refresh_appends_only_new_rows(tmp_path):
+    table = FakeTable()
+    snapshot = FeedbackSnapshot(str(tmp_path), reader=table, lookback_s=600)
+    for i in range(3):
+        table.insert(i, f"claim {i}")
+    assert snapshot.refresh() == 3
+    assert snapshot.watermark == START + timedelta(minutes=2)
+
+    table.insert(10, "claim 10")
+    # inserted late, within the lookback
+    table.insert(1.5, "late claim")
+    assert snapshot.refresh() == 2
+    assert snapshot.refresh() == 0
+    assert table.reads[0] is None
+    assert table.reads[1] == START + timedelta(minutes=2) - timedelta(seconds=600)
+
+    df = snapshot.load()
+    assert sorted(df["text"]) == ["claim 0", "claim 1", "claim 10", "claim 2", "late claim"]
+    assert list(df.columns) == ["text", "label_pred", "label_true", "explanation", "created_at"]
+    assert len(snapshot.load(start_date="2025-06-01T00:05:00")) == 1
+
+
+def test_parts_are_compacted(tmp_path):
+    table = FakeTable()
+    snapshot = FeedbackSnapshot(str(tmp_path), reader=table, lookback_s=0, max_parts=2)
+    for i in range(4):
+        table.insert(i, f"claim {i}")
+        snapshot.refresh()
+
+    state = snapshot.state()
+    assert len(state["parts"]) <= 2
+    assert state["rows"] == 4
+    assert len(snapshot.read()) == 4
+    assert sorted(p.name for p in tmp_path.glob("part-*")) == sorted(state["parts"])
+
+
+def test_rows_sharing_created_at_are_kept(tmp_path):
+    table = FakeTable()
+    snapshot = FeedbackSnapshot(str(tmp_path), reader=table, lookback_s=600)
+    # a /feedback/batch request : one created_at, the same claim twice
+    table.insert(0, "claim")
+    table.insert(0, "claim")
+    assert snapshot.refresh() == 2
+
+    table.insert(0, "claim")
+    assert snapshot.refresh() == 1
+    assert snapshot.refresh() == 0
+    assert len(snapshot.load()) == 3
+
+
+def test_rows_without_insert_id_are_counted(tmp_path):
+    table = FakeTable()
+    snapshot = FeedbackSnapshot(str(tmp_path), reader=table, lookback_s=600)
+    # inserted before the insert id was stored
+    table.insert(0, "claim")
+    table.rows[-1]["insert_id"] = None
+    table.rows.append(dict(table.rows[-1]))
+    assert snapshot.refresh() == 2
+
+    table.rows.append(dict(table.rows[-1]))
+    assert snapshot.refresh() == 1
+    assert snapshot.refresh() == 0
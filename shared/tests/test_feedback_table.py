@@ -0,0 +1,108 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+from google.cloud.exceptions import NotFound
+
+from shared.feedback_table import PARTITIONING, migrate_feedback_table
+
+TABLE = "project.dataset.feedback"
+
+
+class FakeJob:
+    def __init__(self, affected=None):
+        self.num_dml_affected_rows = affected
+
+    def result(self):
+        return self
+
+
+class FakeBigQuery:
+    """Tables by reference, running the statements of the migration ; fails on the statement in fail_on"""
+
+    def __init__(self, tables, fail_on=None):
+        self.tables = tables
+        self.fail_on = fail_on
+        self.queries = []
+
+    def get_table(self, table_ref):
+        if table_ref not in self.tables:
+            raise NotFound(table_ref)
+        return self.tables[table_ref]
+
+    def query(self, query, job_config=None):
+        query = " ".join(query.split())
+        self.queries.append(query)
+        if self.fail_on and self.fail_on in query:
+            raise RuntimeError("job failed")
+        if m := re.match(r"CREATE OR REPLACE TABLE `(.+?)` .* AS SELECT \* FROM `(.+?)`", query):
+            self.tables[m[1]] = _table(rows=set(self.tables[m[2]].rows), partitioned=True)
+        elif m := re.match(r"ALTER TABLE `(.+?)` RENAME TO `(.+?)`", query):
+            dataset = m[1].rsplit(".", 1)[0]
+            self.tables[f"{dataset}.{m[2]}"] = self.tables.pop(m[1])
+        elif m := re.match(r"INSERT INTO `(.+?)` SELECT \* FROM `(.+?)` EXCEPT DISTINCT SELECT \* FROM `(.+?)`", query):
+            delta = self.tables[m[2]].rows - self.tables[m[3]].rows
+            self.tables[m[1]].rows |= delta
+            return FakeJob(affected=len(delta))
+        return FakeJob()
+
+
+def _table(rows, partitioned=False):
+    return SimpleNamespace(
+        rows=rows,
+        time_partitioning=PARTITIONING if partitioned else None,
+        clustering_fields=None,
+        streaming_buffer=None,
+    )
+
+
+def test_migration_copies_late_rows_and_resumes():
+    # (created_at, user_claim) rows
+    client = FakeBigQuery({TABLE: _table(rows={("10:00", "a"), ("11:00", "b")})}, fail_on="INSERT INTO")
+    original_query = client.query
+
+    def query(query, job_config=None):
+        job = original_query(query, job_config)
+        if query.lstrip().startswith("CREATE"):
+            # replayed from a journal after the copy, stamped before its newest row
+            client.tables[TABLE].rows.add(("09:00", "late"))
+        return job
+
+    client.query = query
+    with pytest.raises(RuntimeError):
+        migrate_feedback_table(client, TABLE)
+    # stopped after the rename : no live table
+    assert TABLE not in client.tables
+
+    client.fail_on = None
+    migrate_feedback_table(client, TABLE)
+
+    assert client.tables[TABLE].time_partitioning is PARTITIONING
+    assert client.tables[TABLE].rows == {("10:00", "a"), ("11:00", "b"), ("09:00", "late")}
+    assert TABLE + "_unpartitioned" in client.tables
+    assert TABLE + "_partitioned" not in client.tables
+
+
+def test_migration_restarts_after_a_failed_copy():
+    client = FakeBigQuery({TABLE: _table(rows={("10:00", "a")})}, fail_on="RENAME")
+    with pytest.raises(RuntimeError):
+        migrate_feedback_table(client, TABLE)
+    assert TABLE + "_partitioned" in client.tables
+
+    client.fail_on = None
+    migrate_feedback_table(client, TABLE)
+    assert client.tables[TABLE].rows == {("10:00", "a")}
+    assert client.tables[TABLE].time_partitioning is PARTITIONING
+
+
+def test_migration_refuses_a_streaming_table():
+    table = _table(rows=set())
+    table.streaming_buffer = SimpleNamespace(estimated_rows=3)
+    client = FakeBigQuery({TABLE: table})
+
+    with pytest.raises(RuntimeError, match="streaming buffer"):
+        migrate_feedback_table(client, TABLE)
+    assert client.queries == []
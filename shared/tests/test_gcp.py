@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+pd = pytest.importorskip("pandas")
+
+from shared.gcp import Gcp
+from shared.gcp_clients import clients
+
+
+class FakeQueryJob:
+    total_bytes_billed = 0
+
+    def to_dataframe(self):
+        return pd.DataFrame({"text": [" claim "], "label_pred": [1], "label_true": [2], "explanation": [""], "created_at": [None]})
+
+
+class FakeBigQuery:
+    def __init__(self, project_id):
+        self.calls = []
+
+    def query(self, query, job_config=None, retry=None, timeout=None):
+        self.calls.append((query, job_config))
+        return FakeQueryJob()
+
+
+@pytest.fixture
+def bigquery():
+    clients.override("bigquery", FakeBigQuery)
+    yield clients.bigquery("project")
+    clients.reset()
+
+
+def test_load_data_window_is_passed_as_parameters(bigquery):
+    df = Gcp.load_data_bq("project", "dataset", "feedback", start_date="2024-01-01", end_date="2024-02-01T12:00:00+00:00")
+
+    query, job_config = bigquery.calls[0]
+    assert "created_at > @start_date" in query and "created_at <= @end_date" in query
+    assert "2024" not in query
+    parameters = {p.name: p for p in job_config.query_parameters}
+    assert set(parameters) == {"start_date", "end_date"}
+    assert parameters["start_date"].type_ == "TIMESTAMP"
+    assert parameters["start_date"].value.isoformat() == "2024-01-01T00:00:00+00:00"
+    assert parameters["end_date"].value.isoformat() == "2024-02-01T12:00:00+00:00"
+    assert df["text"].tolist() == ["claim"]
+
+
+def test_load_data_without_window_has_no_filter(bigquery):
+    Gcp.load_data_bq("project", "dataset", "feedback")
+
+    query, job_config = bigquery.calls[0]
+    assert "WHERE" not in query
+    assert job_config.query_parameters == []
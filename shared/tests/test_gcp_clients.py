@@ -0,0 +1,48 @@
+import threading
+
+from shared.gcp_clients import ClientRegistry
+
+
+class FakeBigQuery:
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.get_table_calls = 0
+
+    def get_table(self, table_ref, retry=None, timeout=None):
+        self.get_table_calls += 1
+        return {"ref": table_ref, "schema": ["created_at", "user_claim"]}
+
+
+def test_one_client_per_project_shared_by_threads():
+    registry = ClientRegistry(retry="retry")
+    built = []
+
+    def factory(project_id):
+        built.append(project_id)
+        return FakeBigQuery(project_id)
+
+    registry.override("bigquery", factory)
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(registry.bigquery("project"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert built == ["project"]
+    assert all(client is seen[0] for client in seen)
+    assert registry.bigquery("other") is not seen[0]
+
+
+def test_table_metadata_is_cached():
+    registry = ClientRegistry(retry="retry")
+    registry.override("bigquery", FakeBigQuery)
+
+    tables = [registry.table("project", "dataset", "feedback") for _ in range(5)]
+    client = registry.bigquery("project")
+    assert client.get_table_calls == 1
+    assert tables[0]["ref"] == "project.dataset.feedback"
+
+    registry.invalidate_table("project", "dataset", "feedback")
+    registry.table("project", "dataset", "feedback")
+    assert client.get_table_calls == 2
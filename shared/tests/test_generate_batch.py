@@ -0,0 +1,87 @@
+import threading
+from collections import Counter
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("peft")
+
+from transformers import BatchEncoding
+
+from shared.model.model import LLMWrapper
+
+PAD = 0
+
+
+class CharTokenizer:
+    """One id per character, left padding"""
+
+    pad_token_id = PAD
+
+    def __call__(self, texts):
+        return {"input_ids": [[ord(c) for c in text] for text in texts]}
+
+    def pad(self, encoded, padding=True, return_tensors="pt"):
+        width = max(len(ids) for ids in encoded["input_ids"])
+        return BatchEncoding({
+            "input_ids": torch.tensor([[PAD] * (width - len(ids)) + ids for ids in encoded["input_ids"]]),
+            "attention_mask": torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in encoded["input_ids"]]),
+        })
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return ["".join(chr(i) for i in ids if i != PAD) for ids in sequences.tolist()]
+
+
+class EchoModel:
+    """Answers each row with the length of its prompt as category and the prompt as explanation"""
+
+    def __init__(self):
+        self.batches = []
+
+    def eval(self):
+        pass
+
+    def generate(self, input_ids, attention_mask, past_key_values=None, **kwargs):
+        prompts = ["".join(chr(i) for i, m in zip(row, mask) if m) for row, mask in zip(input_ids.tolist(), attention_mask.tolist())]
+        self.batches.append(prompts)
+        answers = [[ord(c) for c in f"{len(prompt) % 8}\n\nexplanation : {prompt}"] for prompt in prompts]
+        width = max(len(answer) for answer in answers)
+        generated = torch.tensor([answer + [PAD] * (width - len(answer)) for answer in answers])
+        return torch.cat([input_ids, generated], dim=1)
+
+
+class EchoLLM(LLMWrapper):
+    """LLMWrapper around EchoModel : prompts are the quotes themselves"""
+
+    def __init__(self):
+        self._adapters_lock = threading.Lock()
+        self._inflight = Counter()
+        self._retired = set()
+        self._clear_when_idle = False
+        self._prefix_caches = {}
+        self._prompt_template = None
+        self.active_adapter = "adapter_0"
+        self.tokenizer = CharTokenizer()
+        self.model = EchoModel()
+        self.device = "cpu"
+
+    def _apply_answer_prompts(self, quotes):
+        return list(quotes)
+
+    def _answer_decoding(self, prompt_length, max_explanation_tokens):
+        return {}
+
+
+def test_duplicate_quotes_get_the_answer_of_their_position():
+    llm = EchoLLM()
+    quotes = ["ice melts", "co2", "ice melts", "sea levels rise", "co2"]
+
+    results, usage = llm.generate_batch(quotes, return_usage=True)
+
+    # generated once per distinct quote, in order of first appearance
+    assert llm.model.batches == [["ice melts", "co2", "sea levels rise"]]
+    assert results == [(str(len(quote) % 8), quote) for quote in quotes]
+    # left padding is not counted in the tokens of a quote
+    assert [u["tokens_in"] for u in usage] == [len(quote) for quote in quotes]
+    assert usage[0] == usage[2] and usage[1] == usage[4]
+    assert not llm._inflight
@@ -0,0 +1,24 @@
+import os
+
+from shared.model.merged_checkpoint import base_model_hash
+
+
+def test_local_base_model_hash_follows_weights(tmp_path):
+    (tmp_path / "config.json").write_text('{"model_type": "llama"}')
+    weights = tmp_path / "model.safetensors"
+    weights.write_bytes(b"\0" * 16)
+    (tmp_path / "README.md").write_text("model card")
+    revision = base_model_hash(str(tmp_path))
+
+    assert base_model_hash(str(tmp_path)) == revision
+    (tmp_path / "README.md").write_text("edited model card")
+    assert base_model_hash(str(tmp_path)) == revision
+
+    # same config, new weights
+    weights.write_bytes(b"\1" * 32)
+    assert base_model_hash(str(tmp_path)) != revision
+
+    revision = base_model_hash(str(tmp_path))
+    stat = weights.stat()
+    os.utime(weights, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert base_model_hash(str(tmp_path)) != revision
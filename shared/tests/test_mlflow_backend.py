@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+
+from shared.mlflow_backend import MlflowLoggingBackend
+
+
+class FileTrackingServer:
+    """Local-file stand-in of the MLflow tracking server, one JSON file per run"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.available = True
+        self.calls = 0
+        self.experiments = {}
+
+    def _call(self):
+        self.calls += 1
+        if not self.available:
+            raise ConnectionError("tracking server unreachable")
+
+    def _path(self, run_id):
+        return os.path.join(self.directory, f"{run_id}.json")
+
+    def _update(self, run_id, update):
+        with open(self._path(run_id)) as f:
+            run = json.load(f)
+        update(run)
+        with open(self._path(run_id), "w") as f:
+            json.dump(run, f)
+
+    def run(self, run_id):
+        with open(self._path(run_id)) as f:
+            return json.load(f)
+
+    def runs(self):
+        return [self.run(name[:-5]) for name in sorted(os.listdir(self.directory))]
+
+    def experiment_id(self, name):
+        self._call()
+        return self.experiments.setdefault(name, str(len(self.experiments)))
+
+    def create_run(self, experiment_id, run_name=None):
+        self._call()
+        run_id = f"run{len(os.listdir(self.directory))}"
+        with open(self._path(run_id), "w") as f:
+            json.dump({"experiment_id": experiment_id, "name": run_name, "metrics": {}, "params": {}, "status": "RUNNING"}, f)
+        return run_id
+
+    def log_batch(self, run_id, metrics, params):
+        self._call()
+
+        def update(run):
+            run["metrics"].update({m["key"]: m["value"] for m in metrics})
+            run["params"].update(params)
+
+        self._update(run_id, update)
+
+    def set_terminated(self, run_id, status="FINISHED"):
+        self._call()
+        self._update(run_id, lambda run: run.update(status=status))
+
+
+def _backend(tmp_path, server):
+    return MlflowLoggingBackend(
+        client_factory=lambda: server,
+        spool_directory=str(tmp_path / "spool"),
+        flush_interval_s=0.05,
+    )
+
+
+def test_logs_are_batched_per_run(tmp_path):
+    (tmp_path / "server").mkdir()
+    server = FileTrackingServer(str(tmp_path / "server"))
+    backend = _backend(tmp_path, server)
+
+    handle = backend.create_run("train", run_name="train")
+    for i in range(20):
+        backend.log_metrics(handle, {f"metric_{i}": i})
+    backend.log_params(handle, {"lr": 1e-4})
+    backend.end_run(handle)
+    backend.close()
+
+    (run,) = server.runs()
+    assert run["status"] == "FINISHED"
+    assert len(run["metrics"]) == 20
+    assert run["params"] == {"lr": "0.0001"}
+    # experiment, run creation, one batch, termination
+    assert server.calls == 4
+
+
+def test_unreachable_server_spools_and_replays(tmp_path):
+    (tmp_path / "server").mkdir()
+    server = FileTrackingServer(str(tmp_path / "server"))
+    server.available = False
+    backend = _backend(tmp_path, server)
+
+    handle = backend.create_run("train")
+    backend.log_metrics(handle, {"duration": 1.5})
+    backend.end_run(handle)
+    backend.close()
+
+    assert os.path.exists(backend.spool_path)
+    assert server.runs() == []
+
+    # a later process replays the spool once the server answers
+    server.available = True
+    backend = _backend(tmp_path, server)
+    backend.flush()
+
+    assert not os.path.exists(backend.spool_path)
+    (run,) = server.runs()
+    assert run["metrics"] == {"duration": 1.5}
+    assert run["status"] == "FINISHED"
+
+
+def test_failed_server_is_retried_after_a_backoff(tmp_path):
+    (tmp_path / "server").mkdir()
+    server = FileTrackingServer(str(tmp_path / "server"))
+    server.available = False
+    backend = MlflowLoggingBackend(
+        client_factory=lambda: server,
+        spool_directory=str(tmp_path / "spool"),
+        flush_interval_s=0.05,
+        retry_backoff_s=60,
+    )
+
+    handle = backend.create_run("train")
+    backend.flush()
+    calls = server.calls
+    # within the backoff : spooled without calling the server
+    server.available = True
+    backend.log_metrics(handle, {"duration": 1.5})
+    backend.end_run(handle)
+    backend.flush()
+    assert server.calls == calls
+    assert backend.run_id(handle, timeout=0) is None
+
+    backend._retry_at = 0
+    backend.flush()
+    (run,) = server.runs()
+    assert run["metrics"] == {"duration": 1.5}
+    assert backend.run_id(handle, timeout=1) == "run0"
+    backend.close()
+
+
+def test_tracked_function_does_not_wait_for_the_server(tmp_path, monkeypatch):
+    from shared import mlflow_utils
+
+    answer = threading.Event()
+
+    class SlowServer(FileTrackingServer):
+        def experiment_id(self, name):
+            answer.wait(5)
+            return super().experiment_id(name)
+
+    (tmp_path / "server").mkdir()
+    server = SlowServer(str(tmp_path / "server"))
+    backend = _backend(tmp_path, server)
+    monkeypatch.setattr(mlflow_utils, "get_backend", lambda: backend)
+    handles = []
+
+    @mlflow_utils.mlflow_track(experiment_name="test")
+    def train():
+        handles.append(mlflow_utils.active_run_handle())
+        return "model"
+
+    start = time.perf_counter()
+    assert train() == "model"
+    # the run is created by the background thread, once the server answers
+    assert time.perf_counter() - start < 1
+    assert mlflow_utils.active_run_handle() is None
+    answer.set()
+    backend.close()
+
+    (run,) = server.runs()
+    assert run["name"] == "train" and run["status"] == "FINISHED"
+    assert set(run["metrics"]) == {"duration", "energy_j", "emissions_g"}
+    assert backend.run_id(handles[0]) == "run0"
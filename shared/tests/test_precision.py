@@ -0,0 +1,79 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+peft = pytest.importorskip("peft")
+
+from shared.model.precision import apply_precision, check_precision, load_reference, self_check, write_reference
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.proj = torch.nn.Linear(8, 8)
+        self.head = torch.nn.Linear(8, 2)
+
+    def forward(self, x):
+        return self.head(torch.relu(self.proj(x)))
+
+
+def _peft_model():
+    torch.manual_seed(0)
+    config = peft.LoraConfig(r=2, target_modules=["proj"], init_lora_weights=False)
+    return peft.get_peft_model(TinyModel(), config).eval()
+
+
+def test_int8_requires_merged_adapter():
+    with pytest.raises(ValueError):
+        check_precision("int8", merge_adapter=False)
+    with pytest.raises(ValueError):
+        apply_precision(_peft_model(), "int8")
+
+
+def test_int8_forward_after_merge():
+    model = _peft_model()
+    x = torch.randn(4, 8)
+    with torch.no_grad():
+        expected = model(x)
+        quantized = apply_precision(model.merge_and_unload(), "int8")
+        output = quantized(x)
+
+    assert not isinstance(quantized.proj, torch.nn.Linear)
+    assert output.shape == expected.shape
+    assert torch.allclose(output, expected, atol=0.1)
+
+
+class FakeLLM:
+    """classify_fast with fixed probabilities, generate_batch echoing the category"""
+
+    model_name = "org/base-model"
+    active_adapter = "adapter_0123"
+
+    def __init__(self, precision, probability):
+        self.precision = precision
+        self.probability = probability
+        self.model = TinyModel()
+
+    def classify_fast(self, quotes):
+        return [("1", {"0": 1 - self.probability, "1": self.probability}) for _ in quotes]
+
+    def generate_batch(self, quotes, max_explanation_tokens):
+        return [("1", "explanation") for _ in quotes]
+
+    def tokenizer(self, text, add_special_tokens=False):
+        return {"input_ids": text.split()}
+
+
+def test_self_check_against_stored_reference(tmp_path):
+    with pytest.raises(ValueError):
+        write_reference(FakeLLM("bf16", 0.9), directory=str(tmp_path))
+    path = write_reference(FakeLLM("fp32", 0.9), directory=str(tmp_path))
+    assert path.endswith("org--base-model.adapter_0123.json")
+
+    assert load_reference("org/base-model", "adapter_other", directory=str(tmp_path)) is None
+    reference = load_reference("org/base-model", "adapter_0123", directory=str(tmp_path))
+    report = self_check(FakeLLM("bf16", 0.8), reference=reference)
+
+    assert report["precision"] == "bf16"
+    assert report["agreement_rate"] == 1.0
+    assert abs(report["max_probability_delta"] - 0.1) < 1e-9
+    assert report["reference_footprint_mb"] == report["footprint_mb"]
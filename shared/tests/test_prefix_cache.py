@@ -0,0 +1,78 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from shared.model.prefix_cache import PrefixCache
+
+PAD = 0
+PREFIX = [5, 17, 23, 9, 41, 12]
+SUFFIXES = [[30, 31, 32, 33, 34], [40], [50, 51, 52]]
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=64,
+        pad_token_id=PAD,
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+def _generate(model, inputs, past_key_values=None):
+    with torch.no_grad():
+        return model.generate(
+            **inputs,
+            past_key_values=past_key_values,
+            max_new_tokens=4,
+            do_sample=False,
+            pad_token_id=PAD,
+            output_logits=True,
+            return_dict_in_generate=True,
+        )
+
+
+def test_cached_prefix_gives_the_logits_of_a_full_prefill(model):
+    prompts = [PREFIX + suffix for suffix in SUFFIXES]
+    cache = PrefixCache.build(
+        model,
+        tokenizer=lambda text: {"input_ids": PREFIX},
+        prefix_text="prefix",
+        device="cpu",
+        key="adapter",
+    )
+
+    inputs, past_key_values = cache.encode(prompts, pad_token_id=PAD, device="cpu")
+    # middle padding : the prefix, then pads, then each suffix
+    width = max(len(suffix) for suffix in SUFFIXES)
+    for row, mask, suffix in zip(inputs["input_ids"].tolist(), inputs["attention_mask"].tolist(), SUFFIXES):
+        assert row == PREFIX + [PAD] * (width - len(suffix)) + suffix
+        assert mask == [1] * len(PREFIX) + [0] * (width - len(suffix)) + [1] * len(suffix)
+
+    # reference : full prefill of left-padded prompts
+    length = max(len(prompt) for prompt in prompts)
+    reference = {
+        "input_ids": torch.tensor([[PAD] * (length - len(p)) + p for p in prompts]),
+        "attention_mask": torch.tensor([[0] * (length - len(p)) + [1] * len(p) for p in prompts]),
+    }
+
+    cached = _generate(model, inputs, past_key_values)
+    full = _generate(model, reference)
+    assert torch.equal(cached.sequences[:, inputs["input_ids"].shape[1]:], full.sequences[:, length:])
+    for cached_logits, full_logits in zip(cached.logits, full.logits):
+        torch.testing.assert_close(cached_logits, full_logits, rtol=1e-4, atol=1e-4)
+
+    # the cache itself is left untouched for the next batch
+    assert cache.past_key_values.get_seq_length() == len(PREFIX)
+
+
+def test_prompts_without_the_prefix_are_not_encoded():
+    cache = PrefixCache(input_ids=PREFIX, past_key_values=None, key="adapter")
+    assert cache.encode([PREFIX + [1], PREFIX[:-1] + [2, 3]], pad_token_id=PAD, device="cpu") is None
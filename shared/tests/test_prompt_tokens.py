@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip("tokenizers")
+pytest.importorskip("transformers")
+
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast
+
+from shared.model.prompt import PromptTemplate
+from shared.model.prompt_tokens import PLACEHOLDER, VERIFICATION_QUOTES, TokenizedPromptTemplate
+
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|im_start|>{{ message['role'] }}\n"
+    "{{ message['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    """Byte-level BPE trained on the prompts, with chat special tokens"""
+    special_tokens = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    corpus = [PromptTemplate.SYSTEM_MSG, PromptTemplate.USER_TEMPLATE, *VERIFICATION_QUOTES] * 5
+    bpe.train_from_iterator(
+        corpus,
+        trainers.BpeTrainer(
+            vocab_size=600,
+            special_tokens=special_tokens,
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        ),
+    )
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=bpe,
+        eos_token="<|endoftext|>",
+        additional_special_tokens=["<|im_start|>", "<|im_end|>"],
+    )
+    tokenizer.chat_template = CHAT_TEMPLATE
+    return tokenizer
+
+
+def _prompt(tokenizer, quote):
+    messages = [
+        {"role": "system", "content": PromptTemplate.SYSTEM_MSG},
+        {"role": "user", "content": (PromptTemplate.USER_TEMPLATE + PromptTemplate.GENERATION_TEMPLATE).format(quote=quote)},
+    ]
+    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+def test_spliced_ids_equal_full_tokenization(tokenizer):
+    template = TokenizedPromptTemplate(tokenizer=tokenizer, rendered=_prompt(tokenizer, PLACEHOLDER))
+    assert template.prefix_ids and template.suffix_ids
+
+    quotes = list(VERIFICATION_QUOTES) + ["Sea levels are not rising", ""]
+    expected = tokenizer([_prompt(tokenizer, quote) for quote in quotes])["input_ids"]
+    assert template.encode(quotes) == expected
+    assert template.verify(expected=expected[: len(VERIFICATION_QUOTES)], quotes=VERIFICATION_QUOTES)
+    assert template.verified
+
+
+def test_verification_fails_on_different_ids(tokenizer):
+    template = TokenizedPromptTemplate(tokenizer=tokenizer, rendered=_prompt(tokenizer, PLACEHOLDER))
+    # a template trimming the quote tokenizes differently from the splice
+    trimmed = tokenizer([_prompt(tokenizer, quote.strip()) for quote in VERIFICATION_QUOTES])["input_ids"]
+
+    assert not template.verify(expected=trimmed, quotes=VERIFICATION_QUOTES)
+    assert not template.verified
@@ -30,6 +30,8 @@ def retrain(data: Dataset):
         local_directory=Config.LOCAL_DIRECTORY,
         project_id=Config.GCP_PROJECT_ID,
         bucket_name=Config.GCS_BUCKET_NAME,
+        # training needs full precision, reduced precisions are for serving
+        precision="fp32",
     )
 
     # train_metrics = model.train(data_train=data.train_ds, data_val=data.val_ds)